@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+from loguru import logger
+
+import metrics
+from config import config
+
+# Live batchers, restarted in forked children where their threads do not exist
+_batchers: "weakref.WeakSet[MicroBatcher]" = weakref.WeakSet()
+
+# Queued by close(): the thread finishes the requests ahead of it and exits
+_STOP = object()
+
+
+class MicroBatcher:
+    """Collects concurrent single-item calls into one batched model call
+
+    A background thread takes the first waiting request, then keeps
+    collecting until max_batch_size requests are gathered or max_wait_ms
+    has passed, runs batch_fn once and resolves every caller's future.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], name: str,
+                 max_batch_size: int = config.BATCH_MAX_SIZE,
+                 max_wait_ms: float = config.BATCH_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._start()
+        _batchers.add(self)
+
+    def _start(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._latencies = deque(maxlen=config.BATCH_LATENCY_WINDOW)
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the future resolves to its result"""
+        future = Future()
+        with self._close_lock:
+            if not self._closed:
+                self._queue.put((item, future, time.perf_counter()))
+                return future
+        future.set_exception(RuntimeError(f"Batcher {self.name} is closed"))
+        return future
+
+    def close(self, timeout: float = 10.0):
+        """Answer the requests already queued, then stop the thread"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        _batchers.discard(self)
+        self._thread.join(timeout)
+
+    def __call__(self, item: Any) -> Any:
+        """Blocking call for a single item"""
+        return self.submit(item).result()
+
+    def _collect(self) -> Tuple[list, bool]:
+        """The next batch, and whether close() was reached"""
+        entry = self._queue.get()
+        if entry is _STOP:
+            return [], True
+        batch = [entry]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _loop(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if not batch:
+                continue
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+                # A short result list would leave the remaining callers waiting forever
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name} returned {len(results)} results for {len(batch)} items")
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} in {self.name} failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+            finished = time.perf_counter()
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._latencies.extend(finished - enqueued for _, _, enqueued in batch)
+            # Also in the metrics registry, which inference workers report to the parent
+            metrics.inc("batches_total", batcher=self.name, size=len(batch))
+            for _, _, enqueued in batch:
+                metrics.observe("batch_latency_seconds", finished - enqueued, batcher=self.name)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, batch-size histogram and p50/p99 latency over the recent window"""
+        with self._stats_lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+            latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        batches = sum(histogram.values())
+        return {
+            "queue_depth": self.queue_depth(),
+            "batches": batches,
+            "avg_batch_size": sum(size * n for size, n in histogram.items()) / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+        }
+
+
+def _restart_after_fork():
+    # Queued futures belong to the parent; the child starts with empty queues
+    for batcher in list(_batchers):
+        batcher._start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, TypeVar
+
+from loguru import logger
+
+from config import config
+
+T = TypeVar("T")
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_files(paths: Iterable[str]) -> Iterable[str]:
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        for root, _, files in os.walk(path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                # Hub caches link snapshots to blobs; the blobs are hashed once
+                if not os.path.islink(file_path):
+                    yield file_path
+
+
+class DownloadManifest:
+    """Checksums of downloaded model files, so later starts check them locally instead of over the network
+
+    Files are hashed once when recorded. verify() trusts a file whose size
+    and mtime are unchanged and re-hashes only the ones that differ.
+    """
+
+    def __init__(self, path: str = config.MODEL_MANIFEST):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._entries: Dict[str, dict] = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+
+    def verify(self, name: str) -> bool:
+        """True when every file recorded for name is present and unchanged"""
+        entry = self._entries.get(name)
+        if not entry or not entry["files"]:
+            return False
+        touched = False
+        for path, (size, mtime_ns, checksum) in entry["files"].items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                logger.warning(f"{name}: {path} is missing")
+                return False
+            if stat.st_size != size:
+                logger.warning(f"{name}: {path} changed size")
+                return False
+            if stat.st_mtime_ns != mtime_ns:
+                if _sha256(path) != checksum:
+                    logger.warning(f"{name}: {path} does not match its checksum")
+                    return False
+                # Same content, e.g. after a copy: remember the new mtime so it is hashed only once
+                entry["files"][path][1] = stat.st_mtime_ns
+                touched = True
+        if touched:
+            self._save()
+        return True
+
+    def record(self, name: str, paths: Iterable[str]):
+        """Hash the files under paths and save them as the verified download of name"""
+        files = {}
+        for path in _iter_files(paths):
+            stat = os.stat(path)
+            files[path] = [stat.st_size, stat.st_mtime_ns, _sha256(path)]
+        self._entries[name] = {"files": files, "verified_at": datetime.now().isoformat(timespec="seconds")}
+        self._save()
+        logger.info(f"Recorded {len(files)} downloaded files of {name}")
+
+    def _save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+def load_verified(name: str, load: Callable[[bool], T], paths: Callable[[], List[str]],
+                  offline: bool = config.MODELS_OFFLINE) -> T:
+    """Call load(download) with download checks only until the files are in the manifest
+
+    Offline, a model whose files are missing or changed is an error instead
+    of a download.
+    """
+    manifest = DownloadManifest()
+    verified = manifest.verify(name)
+    if not verified and offline:
+        raise RuntimeError(f"{name} is not downloaded or does not match {manifest.path}, "
+                           f"and MODELS_OFFLINE is set")
+    model = load(not verified)
+    if not verified:
+        manifest.record(name, paths())
+    return model
+
+
+def hub_offline():
+    """Stop Hugging Face libraries from checking the hub for newer files"""
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    # The flag is read at import; patch it if the hub client is already loaded
+    constants = sys.modules.get("huggingface_hub.constants")
+    if constants is not None:
+        constants.HF_HUB_OFFLINE = True
+
+
+def hub_cache_dirs(model_name: str) -> List[str]:
+    """Hugging Face hub cache directory of a model"""
+    from huggingface_hub.constants import HF_HUB_CACHE
+
+    return [os.path.join(HF_HUB_CACHE, "models--" + model_name.replace("/", "--"))]
+
+
+def deeppavlov_download_dirs(model_config) -> List[str]:
+    """Directories a DeepPavlov config downloads into"""
+    from deeppavlov.core.commands.utils import parse_config
+
+    downloads = parse_config(model_config).get("metadata", {}).get("download", [])
+    return [os.path.expanduser(entry["subdir"]) for entry in downloads
+            if isinstance(entry, dict) and "subdir" in entry]
@@ -1,22 +1,38 @@
-import torch
-from deeppavlov import build_model, configs
+import numpy as np
 from loguru import logger
 from typing import List, Dict
 from config import config
+from ai_engine.batching import MicroBatcher
+from ai_engine.downloads import deeppavlov_download_dirs, load_verified
+from ai_engine.inference import configure_threads, optimize_qa_model
+from ai_engine.qa_tokens import QAWindow, qa_tokenizer
 
 class DeepPavlovEngine:
     def __init__(self):
         self.qa_model = None
+        self.qa_component = None
         self.embedding_model = None
         self.load_models()
+        # Concurrent QA requests share one forward pass per batch
+        self.qa_batcher = MicroBatcher(self._answer_batch, name="qa")
     
     def load_models(self):
         """Load DeepPavlov models"""
         try:
             logger.info("Loading DeepPavlov models...")
+            # Imported here, so the handlers and the KB code load without torch
+            from deeppavlov import build_model, configs
+            configure_threads()
             
-            # Load QA model for Russian
-            self.qa_model = build_model(configs.squad.squad_ru_bert, download=True)
+            # Load QA model for Russian; the download check runs until the files are in the manifest
+            model_config = configs.squad.squad_ru_bert
+            self.qa_model = load_verified(
+                "deeppavlov:squad_ru_bert",
+                lambda download: build_model(model_config, download=download),
+                lambda: deeppavlov_download_dirs(model_config),
+            )
+            self.qa_model = optimize_qa_model(self.qa_model)
+            self.qa_component = self._find_qa_component()
             
             logger.info("DeepPavlov models loaded successfully")
             
@@ -24,6 +40,99 @@ class DeepPavlovEngine:
             logger.error(f"Error loading DeepPavlov models: {e}")
             raise
     
+    def close(self):
+        """Stop the QA batcher; requests already queued are answered first"""
+        self.qa_batcher.close()
+    
+    @property
+    def pretokenized(self) -> bool:
+        """Whether answer_candidates() takes QAWindow contexts, skipping the chain's own tokenizer"""
+        return self.qa_component is not None
+    
+    def _find_qa_component(self):
+        """The chain component holding the torch QA model, like optimize_qa_model() finds it"""
+        for _, _, component in getattr(self.qa_model, "pipe", []):
+            module = getattr(component, "model", None)
+            if module is not None and hasattr(module, "named_modules"):
+                return component
+        logger.warning("No torch QA model in the DeepPavlov chain; contexts will be tokenized per query")
+        return None
+    
+    def _answer_batch(self, pairs: List[tuple]) -> List[tuple]:
+        """Run the QA model once over (context, query) pairs"""
+        results = [None] * len(pairs)
+        tokenized = [i for i, (context, _) in enumerate(pairs) if isinstance(context, QAWindow)]
+        if tokenized:
+            for i, result in zip(tokenized, self._answer_pretokenized([pairs[i] for i in tokenized])):
+                results[i] = result
+        texts = [i for i, (context, _) in enumerate(pairs) if not isinstance(context, QAWindow)]
+        if texts:
+            contexts, queries = zip(*(pairs[i] for i in texts))
+            answers, starts, scores = self.qa_model(list(contexts), list(queries))
+            for i, result in zip(texts, zip(answers, starts, scores)):
+                results[i] = result
+        return results
+    
+    def _answer_pretokenized(self, pairs: List[tuple]) -> List[tuple]:
+        """QA over (QAWindow, query) pairs: only the queries are tokenized, the contexts are stored IDs"""
+        import torch
+        
+        tokenizer = qa_tokenizer()
+        queries = list(dict.fromkeys(query for _, query in pairs))
+        query_ids = {query: ids[:config.QA_MAX_QUERY_TOKENS]
+                     for query, (ids, _) in zip(queries, tokenizer.encode_batch(queries))}
+        
+        # [CLS] query [SEP] context [SEP], padded to the longest row
+        rows = []
+        for window, query in pairs:
+            ids = np.concatenate(([tokenizer.cls_token_id], query_ids[query], [tokenizer.sep_token_id],
+                                  window.ids, [tokenizer.sep_token_id]))
+            rows.append((ids, len(query_ids[query]) + 2))
+        length = max(len(ids) for ids, _ in rows)
+        input_ids = np.full((len(rows), length), tokenizer.pad_token_id, dtype=np.int64)
+        token_type_ids = np.zeros((len(rows), length), dtype=np.int64)
+        attention_mask = np.zeros((len(rows), length), dtype=np.int64)
+        for row, (ids, context_start) in enumerate(rows):
+            input_ids[row, :len(ids)] = ids
+            token_type_ids[row, context_start:len(ids)] = 1
+            attention_mask[row, :len(ids)] = 1
+        
+        component = self.qa_component
+        device = getattr(component, "device", "cpu")
+        with torch.no_grad():
+            outputs = component.model(
+                input_ids=torch.from_numpy(input_ids).to(device),
+                token_type_ids=torch.from_numpy(token_type_ids).to(device),
+                attention_mask=torch.from_numpy(attention_mask).to(device),
+            )
+        start_logits = outputs[0].float().cpu().numpy()
+        end_logits = outputs[1].float().cpu().numpy()
+        
+        # Best span inside the context: start <= end, at most QA_MAX_ANSWER_TOKENS long
+        results = []
+        for row, (window, _) in enumerate(pairs):
+            context_start = rows[row][1]
+            count = len(window.ids)
+            if not count:
+                results.append(("", -1, float("-inf")))
+                continue
+            starts = start_logits[row, context_start:context_start + count]
+            ends = end_logits[row, context_start:context_start + count]
+            spans = starts[:, None] + ends[None, :]
+            allowed = np.triu(np.ones((count, count), dtype=bool))
+            allowed &= ~np.triu(allowed, k=config.QA_MAX_ANSWER_TOKENS)
+            spans[~allowed] = -np.inf
+            start, end = np.unravel_index(int(np.argmax(spans)), spans.shape)
+            char_start, char_end = int(window.offsets[start][0]), int(window.offsets[end][1])
+            results.append((window.text[char_start:char_end], char_start, float(spans[start, end])))
+        return results
+    
+    def answer_candidates(self, contexts: List[str], query: str) -> List[tuple]:
+        """Answer one query against several contexts in a single batched QA pass"""
+        # Submitted together, so the batcher packs them into the same forward pass
+        futures = [self.qa_batcher.submit((context, query)) for context in contexts]
+        return [future.result() for future in futures]
+    
     def process_query(self, query: str, context: str = None) -> str:
         """Process user query and generate response"""
         try:
@@ -32,8 +141,8 @@ class DeepPavlovEngine:
                 return self._generate_fallback_response(query)
             
             # Use QA model with context
-            result = self.qa_model([context], [query])
-            answer = result[0][0] if result[0] else "Извините, я не нашел точного ответа на ваш вопрос в предоставленной информации."
+            answer, _, _ = self.qa_batcher((context, query))
+            answer = answer or "Извините, я не нашел точного ответа на ваш вопрос в предоставленной информации."
             
             return self._format_response(answer, query)
             
@@ -1,6 +1,10 @@
+import asyncio
 import requests
 import logging
-from typing import List, Optional
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from typing import Callable, List, Optional
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -8,11 +12,15 @@ logger = logging.getLogger(__name__)
 class GoMLXClient:
     def __init__(self):
         self.base_url = f"http://{config.GOMLX_HOST}:{config.GOMLX_PORT}"
+        # Reuse keep-alive connections instead of a new TCP handshake per text
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.GOMLX_MAX_CONCURRENCY)
+        self.session.mount("http://", adapter)
         
     def health_check(self) -> bool:
         """Check if GoMLX service is healthy"""
         try:
-            response = requests.get(f"{self.base_url}/health", timeout=5)
+            response = self.session.get(f"{self.base_url}/health", timeout=5)
             return response.status_code == 200
         except Exception as e:
             logger.warning(f"GoMLX health check failed: {e}")
@@ -21,10 +29,10 @@ class GoMLXClient:
     def generate_embedding(self, text: str) -> Optional[List[float]]:
         """Generate embedding using GoMLX"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/embed",
                 json={"text": text},
-                timeout=10
+                timeout=config.GOMLX_TIMEOUT
             )
             
             if response.status_code == 200:
@@ -38,10 +46,30 @@ class GoMLXClient:
             logger.error(f"Error generating embedding with GoMLX: {e}")
             return None
     
+    def generate_embeddings(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Generate embeddings for many texts in one request"""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/embed",
+                json={"texts": texts},
+                timeout=config.GOMLX_TIMEOUT
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data["success"]:
+                    return data["embeddings"]
+            
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error generating embeddings with GoMLX: {e}")
+            return None
+    
     def optimize_model(self, model_path: str) -> Optional[str]:
         """Optimize model using GoMLX"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/optimize",
                 json={"model_path": model_path},
                 timeout=30
@@ -57,3 +85,161 @@ class GoMLXClient:
         except Exception as e:
             logger.error(f"Error optimizing model with GoMLX: {e}")
             return None
+
+class CircuitBreaker:
+    """Stops calling GoMLX after repeated failures until /health passes again"""
+    
+    def __init__(self, threshold: int = config.GOMLX_BREAKER_THRESHOLD,
+                 reset_timeout: float = config.GOMLX_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+    
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+    
+    def probe_due(self) -> bool:
+        """An open circuit may be probed once the reset timeout has passed"""
+        return self.is_open and time.monotonic() - self.opened_at >= self.reset_timeout
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if not self.is_open:
+                logger.warning(f"GoMLX circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+class AsyncGoMLXClient:
+    """Non-blocking GoMLX client with pooling, batching, retries and a local fallback
+    
+    Embedding requests are split into GOMLX_BATCH_SIZE batches and sent
+    concurrently (at most GOMLX_MAX_CONCURRENCY in flight) over keep-alive
+    connections. When the circuit breaker is open, or a batch still fails
+    after its retries, that batch is embedded by the fallback, the local
+    SentenceTransformer unless another callable is given.
+    """
+    
+    def __init__(self, base_url: Optional[str] = None,
+                 fallback: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                 max_concurrency: int = config.GOMLX_MAX_CONCURRENCY,
+                 batch_size: int = config.GOMLX_BATCH_SIZE,
+                 max_retries: int = config.GOMLX_MAX_RETRIES):
+        self.base_url = base_url or f"http://{config.GOMLX_HOST}:{config.GOMLX_PORT}"
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker()
+        self._fallback = fallback
+        self._fallback_lock = threading.Lock()
+        self._session = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+    
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+            
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=config.GOMLX_TIMEOUT),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+    
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    async def health_check(self) -> bool:
+        """Check if GoMLX service is healthy"""
+        try:
+            session = await self._get_session()
+            async with session.get(f"{self.base_url}/health") as response:
+                return response.status == 200
+        except Exception as e:
+            logger.warning(f"GoMLX health check failed: {e}")
+            return False
+    
+    async def _available(self) -> bool:
+        """Closed circuit, or an open one whose health probe now passes"""
+        if not self.breaker.is_open:
+            return True
+        if not self.breaker.probe_due():
+            return False
+        if await self.health_check():
+            logger.info("GoMLX is healthy again, closing circuit")
+            self.breaker.record_success()
+            return True
+        self.breaker.record_failure()
+        return False
+    
+    async def _post(self, path: str, payload: dict) -> dict:
+        session = await self._get_session()
+        delay = 0.1
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    async with session.post(f"{self.base_url}{path}", json=payload) as response:
+                        data = await response.json()
+                        if response.status == 200 and data.get("success"):
+                            self.breaker.record_success()
+                            return data
+                        raise RuntimeError(data.get("error") or f"HTTP {response.status}")
+            except Exception as e:
+                self.breaker.record_failure()
+                if attempt == self.max_retries or self.breaker.is_open:
+                    raise
+                logger.debug(f"GoMLX {path} attempt {attempt + 1} failed: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+    
+    def _local_encode(self, texts: List[str]) -> List[List[float]]:
+        if self._fallback is None:
+            # Concurrent batches fall back together; only the first one loads the model
+            with self._fallback_lock:
+                if self._fallback is None:
+                    from sentence_transformers import SentenceTransformer
+                    
+                    model = SentenceTransformer(config.EMBEDDING_MODEL)
+                    self._fallback = lambda batch: model.encode(batch).tolist()
+        return self._fallback(texts)
+    
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if await self._available():
+            try:
+                data = await self._post("/embed", {"texts": texts})
+                return data["embeddings"]
+            except Exception as e:
+                logger.warning(f"GoMLX embedding failed, using local model: {e}")
+        return await asyncio.to_thread(self._local_encode, texts)
+    
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embed many texts, batched and concurrent"""
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch) for batch in batches))
+        return [embedding for batch in results for embedding in batch]
+    
+    async def generate_embedding(self, text: str) -> List[float]:
+        """Generate embedding for a single text"""
+        return (await self.generate_embeddings([text]))[0]
+    
+    async def optimize_model(self, model_path: str) -> Optional[str]:
+        """Optimize model using GoMLX"""
+        try:
+            data = await self._post("/optimize", {"model_path": model_path})
+            return data["optimized_path"]
+        except Exception as e:
+            logger.error(f"Error optimizing model with GoMLX: {e}")
+            return None
@@ -12,13 +12,15 @@ import (
 )
 
 type EmbeddingRequest struct {
-    Text string `json:"text"`
+    Text  string   `json:"text"`
+    Texts []string `json:"texts,omitempty"`
 }
 
 type EmbeddingResponse struct {
-    Embedding []float64 `json:"embedding"`
-    Success   bool      `json:"success"`
-    Error     string    `json:"error,omitempty"`
+    Embedding  []float64   `json:"embedding,omitempty"`
+    Embeddings [][]float64 `json:"embeddings,omitempty"`
+    Success    bool        `json:"success"`
+    Error      string      `json:"error,omitempty"`
 }
 
 type OptimizationRequest struct {
@@ -87,6 +89,28 @@ func main() {
             return
         }
         
+        // Batch request: one round trip for many texts
+        if len(req.Texts) > 0 {
+            embeddings := make([][]float64, len(req.Texts))
+            for i, text := range req.Texts {
+                embedding, err := connector.GenerateEmbedding(text)
+                if err != nil {
+                    c.JSON(http.StatusInternalServerError, EmbeddingResponse{
+                        Success: false,
+                        Error:   err.Error(),
+                    })
+                    return
+                }
+                embeddings[i] = embedding
+            }
+            
+            c.JSON(http.StatusOK, EmbeddingResponse{
+                Embeddings: embeddings,
+                Success:    true,
+            })
+            return
+        }
+        
         embedding, err := connector.GenerateEmbedding(req.Text)
         if err != nil {
             c.JSON(http.StatusInternalServerError, EmbeddingResponse{
@@ -0,0 +1,88 @@
+"""Local stand-in for the GoMLX connector, for development and load tests
+
+Speaks the same /health, /embed and /optimize protocol as gomlx_connector.go.
+Embeddings are deterministic unit vectors seeded from the text hash, so the
+same text always maps to the same vector.
+
+Usage: python ai_engine/gomlx_stub_server.py --port 8080 --latency-ms 20 --fail-rate 0.05
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sys
+from typing import List, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+
+
+class EmbeddingRequest(BaseModel):
+    text: Optional[str] = None
+    texts: Optional[List[str]] = None
+
+
+class OptimizationRequest(BaseModel):
+    model_path: str
+
+
+def stub_embedding(text: str, dim: int = config.EMBEDDING_DIM) -> List[float]:
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).normal(size=dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def create_app(latency_ms: float = 0.0, fail_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="GoMLX stub")
+
+    async def simulate() -> Optional[JSONResponse]:
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        if random.random() < fail_rate:
+            return JSONResponse(status_code=500, content={"success": False, "error": "injected failure"})
+        return None
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "service": "gomlx_stub"}
+
+    @app.post("/embed")
+    async def embed(request: EmbeddingRequest):
+        failure = await simulate()
+        if failure is not None:
+            return failure
+        if request.texts:
+            return {"embeddings": [stub_embedding(text) for text in request.texts], "success": True}
+        return {"embedding": stub_embedding(request.text or ""), "success": True}
+
+    @app.post("/optimize")
+    async def optimize(request: OptimizationRequest):
+        failure = await simulate()
+        if failure is not None:
+            return failure
+        return {"optimized_path": request.model_path + ".optimized", "success": True}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=config.GOMLX_HOST)
+    parser.add_argument("--port", type=int, default=config.GOMLX_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added delay per request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.latency_ms, args.fail_rate), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import json
+import os
+import shutil
+import zlib
+from typing import Dict, List
+
+import numpy as np
+import psutil
+from loguru import logger
+
+from config import config
+
+BACKENDS = ("torch", "int8", "onnx", "hashing")
+
+
+def resolve_threads(num_threads: int = config.INFERENCE_THREADS) -> int:
+    """Intra-op thread count; 0 means one thread per physical core"""
+    return num_threads or psutil.cpu_count(logical=False) or os.cpu_count() or 1
+
+
+def configure_threads(num_threads: int = config.INFERENCE_THREADS,
+                      interop_threads: int = config.INFERENCE_INTEROP_THREADS):
+    """Apply thread limits to torch; ONNX Runtime takes them per session"""
+    import torch
+
+    torch.set_num_threads(resolve_threads(num_threads))
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Only settable before the first parallel op; keep whatever is active
+        pass
+
+
+def embedding_model_version(backend: str = config.INFERENCE_BACKEND) -> str:
+    """Manifest tag for embeddings, so vectors from different backends are never mixed"""
+    if backend == "torch":
+        return config.EMBEDDING_MODEL
+    return f"{config.EMBEDDING_MODEL}@{backend}"
+
+
+def quantize_dynamic(module):
+    """int8 dynamic quantization of every Linear layer"""
+    import torch
+
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxEmbeddingModel:
+    """SentenceTransformer-compatible encode() over an int8 ONNX Runtime session
+
+    The transformer is exported once from the fp32 SentenceTransformer,
+    quantized and cached under OPTIMIZED_MODELS_DIR together with the
+    tokenizer and pooling settings; later starts load only the artifacts.
+    """
+
+    def __init__(self, model_name: str = config.EMBEDDING_MODEL,
+                 cache_dir: str = config.OPTIMIZED_MODELS_DIR,
+                 num_threads: int = config.INFERENCE_THREADS):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.directory = os.path.join(cache_dir, model_name.replace("/", "__") + ".onnx")
+        if not os.path.exists(os.path.join(self.directory, "settings.json")):
+            self.export(model_name, self.directory)
+
+        with open(os.path.join(self.directory, "settings.json")) as f:
+            settings = json.load(f)
+        self.max_seq_length = settings["max_seq_length"]
+        self.normalize = settings["normalize"]
+        self.tokenizer = AutoTokenizer.from_pretrained(self.directory)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = resolve_threads(num_threads)
+        options.inter_op_num_threads = config.INFERENCE_INTEROP_THREADS
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(self.directory, "model.int8.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+    @staticmethod
+    def export(model_name: str, directory: str):
+        """Export the fp32 transformer to ONNX and quantize its weights to int8"""
+        import torch
+        from onnxruntime.quantization import QuantType, quantize_dynamic as quantize_onnx
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize, Pooling
+
+        logger.info(f"Exporting {model_name} to ONNX int8 in {directory}")
+        model = SentenceTransformer(model_name, device="cpu")
+        pooling = next(module for module in model if isinstance(module, Pooling))
+        if pooling.get_pooling_mode_str() != "mean":
+            raise ValueError(f"Unsupported pooling mode for ONNX export: {pooling.get_pooling_mode_str()}")
+
+        # Build in a scratch directory and rename, so an interrupted export is never loaded
+        tmp_directory = directory + ".tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        transformer = model[0].auto_model.eval()
+        tokenizer = model.tokenizer
+        sample = tokenizer(["пример"], return_tensors="pt")
+        input_names = list(sample.keys())
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        fp32_path = os.path.join(tmp_directory, "model.onnx")
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(sample[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+            )
+        quantize_onnx(fp32_path, os.path.join(tmp_directory, "model.int8.onnx"), weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+
+        tokenizer.save_pretrained(tmp_directory)
+        with open(os.path.join(tmp_directory, "settings.json"), "w") as f:
+            json.dump({
+                "model_name": model_name,
+                "max_seq_length": model.max_seq_length,
+                "normalize": any(isinstance(module, Normalize) for module in model),
+            }, f)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_directory, directory)
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        if not sentences:
+            return np.zeros((0, config.EMBEDDING_DIM), dtype=np.float32)
+
+        # Length-sorted batches pad less, as in SentenceTransformer.encode
+        order = np.argsort([-len(sentence) for sentence in sentences])
+        output = [None] * len(sentences)
+        for start in range(0, len(sentences), batch_size):
+            indices = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [sentences[i] for i in indices], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np",
+            )
+            feeds = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            hidden = self.session.run(["last_hidden_state"], feeds)[0]
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.linalg.norm(pooled, axis=1, keepdims=True)
+            for i, vector in zip(indices, pooled):
+                output[i] = vector
+        embeddings = np.stack(output).astype(np.float32)
+        return embeddings[0] if single else embeddings
+
+
+class HashingEmbeddingModel:
+    """Deterministic model-free embeddings from hashed word unigrams and bigrams
+
+    For benchmarks and offline load tests: texts sharing words land close
+    together, so retrieval still finds plausible hits without any weights.
+    """
+
+    def __init__(self, dim: int = config.EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed(self, sentence: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = sentence.lower().replace("ё", "е").split()
+        for feature in words + [" ".join(pair) for pair in zip(words, words[1:])]:
+            hashed = zlib.crc32(feature.encode())
+            vector[hashed % self.dim] += 1.0 if hashed & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        sentences = list(sentences)
+        if not sentences:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._embed(sentence) for sentence in sentences])
+
+
+def load_embedding_model(backend: str = config.INFERENCE_BACKEND,
+                         num_threads: int = config.INFERENCE_THREADS):
+    """Sentence embedding model for the configured inference backend"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if backend == "hashing":
+        return HashingEmbeddingModel()
+    configure_threads(num_threads)
+    if backend == "onnx":
+        return OnnxEmbeddingModel(num_threads=num_threads)
+
+    from ai_engine.downloads import hub_cache_dirs, hub_offline, load_verified
+
+    def load(download: bool):
+        if not download:
+            hub_offline()
+        from sentence_transformers import SentenceTransformer
+
+        if backend == "int8":
+            # Quantized kernels are CPU-only
+            return quantize_dynamic(SentenceTransformer(config.EMBEDDING_MODEL, device="cpu"))
+        return SentenceTransformer(config.EMBEDDING_MODEL)
+
+    return load_verified(f"hub:{config.EMBEDDING_MODEL}", load, lambda: hub_cache_dirs(config.EMBEDDING_MODEL))
+
+
+def optimize_qa_model(qa_model, backend: str = config.INFERENCE_BACKEND):
+    """Quantize the torch modules inside a DeepPavlov QA chain in place
+
+    The chain calls its torch model directly, so both optimized backends
+    use dynamic int8 quantization here.
+    """
+    if backend == "torch":
+        return qa_model
+    quantized = 0
+    for _, _, component in getattr(qa_model, "pipe", []):
+        module = getattr(component, "model", None)
+        if module is not None and hasattr(module, "named_modules"):
+            component.model = quantize_dynamic(module.to("cpu").eval())
+            component.device = "cpu"
+            quantized += 1
+    logger.info(f"Quantized {quantized} QA component(s) to int8")
+    return qa_model
+
+
+def cosine_drift(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """Row-wise cosine similarity between fp32 and optimized embeddings"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    similarity = (reference * candidate).sum(axis=1)
+    return {"mean_cosine": float(similarity.mean()), "min_cosine": float(similarity.min())}
+
+
+def _answer_tokens(answer: str) -> List[str]:
+    return "".join(char if char.isalnum() else " " for char in answer.lower().replace("ё", "е")).split()
+
+
+def squad_scores(predictions: List[str], references: List[str]) -> Dict[str, float]:
+    """SQuAD exact match and token F1, averaged"""
+    exact, f1 = 0.0, 0.0
+    for prediction, reference in zip(predictions, references):
+        predicted, expected = _answer_tokens(prediction), _answer_tokens(reference)
+        exact += predicted == expected
+        common = sum(min(predicted.count(token), expected.count(token)) for token in set(predicted))
+        if not predicted or not expected:
+            f1 += predicted == expected
+        elif common:
+            precision, recall = common / len(predicted), common / len(expected)
+            f1 += 2 * precision * recall / (precision + recall)
+    count = max(len(references), 1)
+    return {"exact_match": exact / count, "f1": f1 / count}
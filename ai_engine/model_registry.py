@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+import psutil
+from loguru import logger
+
+from config import config
+from ai_engine.query_cache import QueryCache
+
+
+def _build_kb_manager():
+    from uploader import KnowledgeBaseManager
+    return KnowledgeBaseManager()
+
+
+def _warmup_kb_manager(kb_manager):
+    kb_manager.embedding_model.encode([config.WARMUP_QUERY])
+
+
+def _build_ai_engine():
+    from ai_engine.dp_model import DeepPavlovEngine
+    return DeepPavlovEngine()
+
+
+def _warmup_ai_engine(ai_engine):
+    ai_engine.process_query(config.WARMUP_QUERY, context=config.WARMUP_QUERY)
+
+
+class ModelRegistry:
+    """Process-wide, thread-safe holder of the heavy model objects"""
+
+    def __init__(self, warmup: bool = config.WARMUP_ON_STARTUP):
+        self.warmup = warmup
+        self._lock = threading.RLock()
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._warmups: Dict[str, Optional[Callable[[Any], None]]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._process = psutil.Process(os.getpid())
+        self.query_cache = QueryCache()
+        # Set once load_all() has built every model
+        self.ready = threading.Event()
+
+        self.register("kb_manager", _build_kb_manager, _warmup_kb_manager)
+        self.register("ai_engine", _build_ai_engine, _warmup_ai_engine)
+
+    def register(self, name: str, factory: Callable[[], Any],
+                 warmup: Optional[Callable[[Any], None]] = None):
+        """Register a model factory under a name"""
+        with self._lock:
+            self._factories[name] = factory
+            self._warmups[name] = warmup
+
+    def _build(self, name: str) -> Any:
+        """Construct (and optionally warm up) a fresh instance"""
+        rss_before = self._process.memory_info().rss
+        started = time.perf_counter()
+
+        instance = self._factories[name]()
+        load_time = time.perf_counter() - started
+
+        warmup_time = 0.0
+        warmup = self._warmups.get(name)
+        if self.warmup and warmup is not None:
+            started = time.perf_counter()
+            try:
+                warmup(instance)
+            except Exception as e:
+                logger.warning(f"Warmup of {name} failed: {e}")
+            warmup_time = time.perf_counter() - started
+
+        # RSS delta is approximate: other threads may allocate concurrently
+        rss_delta = self._process.memory_info().rss - rss_before
+        self._stats[name] = {
+            "load_time": load_time,
+            "warmup_time": warmup_time,
+            "rss_mb": max(rss_delta, 0) / 1024 / 1024,
+            "loaded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        logger.info(
+            f"Model {name} loaded in {load_time:.2f}s "
+            f"(warmup {warmup_time:.2f}s, +{self._stats[name]['rss_mb']:.0f} MB RSS)"
+        )
+        return instance
+
+    def get(self, name: str) -> Any:
+        """Return the shared instance, building it on first use"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                instance = self._build(name)
+                self._instances[name] = instance
+            return instance
+
+    def load_all(self):
+        """Eagerly build every registered model"""
+        for name in list(self._factories):
+            self.get(name)
+        self.ready.set()
+
+    def warm_up(self):
+        """Run the warmups of loaded models, e.g. in a worker forked from an unwarmed parent"""
+        for name, instance in list(self._instances.items()):
+            warmup = self._warmups.get(name)
+            if warmup is None:
+                continue
+            try:
+                warmup(instance)
+            except Exception as e:
+                logger.warning(f"Warmup of {name} failed: {e}")
+
+    def reload(self, name: Optional[str] = None):
+        """Hot-reload one or all models without interrupting in-flight requests"""
+        names = [name] if name else list(self._factories)
+        for model_name in names:
+            # get() reads without the lock, so handlers keep using the old
+            # instance until the fresh one is swapped in
+            with self._lock:
+                fresh = self._build(model_name)
+                stale = self._instances.get(model_name)
+                self._instances[model_name] = fresh
+            # Its batcher threads would otherwise keep it, and its model, alive for good
+            close = getattr(stale, "close", None)
+            if close is not None:
+                close()
+            logger.info(f"Model {model_name} reloaded")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-model load time and resident memory"""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    @property
+    def kb_manager(self):
+        return self.get("kb_manager")
+
+    @property
+    def ai_engine(self):
+        return self.get("ai_engine")
+
+    @property
+    def pipeline(self):
+        """Answer pipeline bound to the current (possibly hot-reloaded) models"""
+        from ai_engine.pipeline import AnswerPipeline
+        return AnswerPipeline(self.kb_manager, self.ai_engine, self.query_cache)
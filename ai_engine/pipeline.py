@@ -0,0 +1,205 @@
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, List, Optional
+
+import numpy as np
+from loguru import logger
+
+import metrics
+from ai_engine.qa_tokens import QAWindow, windows as token_windows
+from ai_engine.sessions import Turn
+from config import config
+
+
+def window_context(text: str, max_tokens: int, overlap: int = config.QA_WINDOW_OVERLAP) -> List[str]:
+    """Split a chunk into word windows that fit the QA model's token budget"""
+    words = text.split()
+    window_words = max(1, int(max_tokens / config.QA_TOKENS_PER_WORD))
+    if len(words) <= window_words:
+        return [text] if words else []
+
+    step = max(1, window_words - overlap)
+    windows = []
+    for i in range(0, len(words), step):
+        windows.append(' '.join(words[i:i + window_words]))
+        if i + window_words >= len(words):
+            break
+    return windows
+
+
+def _cosine(a, b) -> float:
+    if b is None:
+        return 0.0
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else 0.0
+
+
+class AnswerPipeline:
+    """Query -> semantic search -> similarity filter -> one batched QA pass"""
+
+    def __init__(self, kb_manager, ai_engine, cache=None):
+        self.kb_manager = kb_manager
+        self.ai_engine = ai_engine
+        self.cache = cache
+
+    @staticmethod
+    @contextmanager
+    def _stage(timings: Dict[str, float], name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            timings[name] = elapsed * 1000
+            metrics.observe("query_stage_seconds", elapsed, stage=name)
+
+    @staticmethod
+    def _relevant(hit: Dict) -> bool:
+        # Strong lexical matches (codes, surnames, numbers) pass even with a weak embedding match
+        return (hit["similarity"] >= config.SIMILARITY_THRESHOLD
+                or hit.get("bm25_score", 0.0) >= config.BM25_MIN_SCORE)
+
+    @staticmethod
+    def _log_timings(query: str, timings: Dict[str, float]):
+        stages = ", ".join(f"{name}={ms:.1f}ms" for name, ms in timings.items())
+        logger.info(f"Pipeline timings for {query[:50]!r}: {stages}")
+
+    def answer(self, query: str, previous: Optional[Turn] = None) -> str:
+        return self.finish(self.retrieve(query, previous))
+
+    # Profiled per phase: handlers call retrieve() and finish() separately, often on different threads
+    @metrics.profiled("retrieve")
+    def retrieve(self, query: str, previous: Optional[Turn] = None) -> "Retrieval":
+        """Fast first phase: cache lookups, query embedding, search and filtering
+
+        Returns a final answer when no QA pass is needed (cache hit, nothing
+        relevant found), otherwise the hits for finish(). A follow-up to the
+        chat's previous turn is answered from that turn's chunks, re-scored
+        against the new question, without a search; when none of them passes
+        the relevance filter for it, the question is searched like any other.
+        """
+        timings: Dict[str, float] = {}
+        kb_version = self.kb_manager.kb_version()
+
+        recent = (previous is not None and bool(previous.chunk_ids)
+                  and time.time() - previous.at <= config.SESSION_FOLLOWUP_SECONDS)
+        # "А сколько стоит?" means something else in every chat: never from the shared cache
+        elliptical = recent and len(query.split()) <= config.SESSION_FOLLOWUP_MAX_WORDS
+
+        cached = self.cache.get(query, kb_version) if self.cache and not elliptical else None
+        if cached is not None and cached.answer is not None:
+            metrics.inc("bot_answers_total", source="cache_exact")
+            return Retrieval(query, kb_version, cached.embedding, cached.results, answer=cached.answer)
+
+        with self._stage(timings, "embed"):
+            if cached is not None and cached.embedding is not None:
+                query_embedding = cached.embedding
+            else:
+                query_embedding = self.kb_manager.query_encoder(query)
+
+        if recent and (elliptical or
+                       _cosine(query_embedding, previous.embedding) >= config.SESSION_FOLLOWUP_SIMILARITY):
+            with self._stage(timings, "followup"):
+                # A short question may still open a new topic: keep only the chunks that match it too
+                hits = [hit for hit in self.kb_manager.get_chunks(previous.ids(), query_embedding)
+                        if self._relevant(hit)]
+            # None left: search as for any other question
+            if hits:
+                self._log_timings(query, timings)
+                metrics.inc("session_followups_total")
+                return Retrieval(query, kb_version, query_embedding, hits, followup=True)
+
+        if self.cache and not elliptical:
+            similar = self.cache.get_similar(query_embedding, kb_version)
+            if similar is not None:
+                self._log_timings(query, timings)
+                metrics.inc("bot_answers_total", source="cache_semantic")
+                return Retrieval(query, kb_version, query_embedding, similar.results, answer=similar.answer)
+
+        with self._stage(timings, "search"):
+            if config.HYBRID_SEARCH:
+                hits = self.kb_manager.hybrid_search(query, query_embedding, config.TOP_K_RESULTS)
+            else:
+                hits = self.kb_manager.search_by_embedding(query_embedding, config.TOP_K_RESULTS)
+
+        with self._stage(timings, "filter"):
+            hits = [hit for hit in hits if self._relevant(hit)]
+        self._log_timings(query, timings)
+
+        retrieval = Retrieval(query, kb_version, query_embedding, hits)
+        if not hits:
+            # Nothing relevant: skip QA entirely
+            metrics.inc("bot_answers_total", source="fallback")
+            retrieval.answer = self.ai_engine._generate_fallback_response(query)
+            self._remember(retrieval)
+        return retrieval
+
+    @metrics.profiled("finish")
+    def finish(self, retrieval: "Retrieval") -> str:
+        """Slow second phase: one batched QA pass over the retrieved chunks"""
+        if retrieval.answer is not None:
+            return retrieval.answer
+        timings: Dict[str, float] = {}
+        query = retrieval.query
+
+        with self._stage(timings, "window"):
+            if getattr(self.ai_engine, "pretokenized", False):
+                # Chunks were tokenized at ingest; windows are slices, only the query is tokenized in QA
+                contexts = [window for hit in retrieval.hits for window in self._token_windows(hit["content"])]
+            else:
+                # [CLS] query [SEP] context [SEP]
+                query_tokens = math.ceil(len(query.split()) * config.QA_TOKENS_PER_WORD) + 3
+                budget = max(1, config.MAX_SEQUENCE_LENGTH - query_tokens)
+                contexts = [window for hit in retrieval.hits for window in window_context(hit["content"], budget)]
+
+        with self._stage(timings, "qa"):
+            candidates = self.ai_engine.answer_candidates(contexts, query)
+
+        self._log_timings(query, timings)
+
+        answer, _, score = max(candidates, key=lambda candidate: candidate[2])
+        if not answer:
+            metrics.inc("bot_answers_total", source="fallback")
+            retrieval.answer = self.ai_engine._generate_fallback_response(query)
+        else:
+            metrics.inc("bot_answers_total", source="qa")
+            logger.debug(f"Best QA span scored {score:.3f} out of {len(candidates)} windows")
+            retrieval.answer = self.ai_engine._format_response(answer, query)
+        self._remember(retrieval)
+        return retrieval.answer
+
+    def _token_windows(self, text: str) -> List[QAWindow]:
+        encoding = self.kb_manager.qa_tokens.get(self.kb_manager._content_hash(text), text)
+        return token_windows(text, encoding)
+
+    def _remember(self, retrieval: "Retrieval"):
+        # Follow-up answers depend on the chat they were asked in
+        if self.cache and not retrieval.followup:
+            self.cache.put(retrieval.query, retrieval.kb_version, retrieval.embedding, retrieval.hits,
+                           retrieval.answer)
+
+    @staticmethod
+    def preview(retrieval: "Retrieval", max_chars: int = config.SNIPPET_CHARS) -> str:
+        """The best hit, cut at a word boundary, to show while QA runs"""
+        text = retrieval.hits[0]["content"].strip()
+        if len(text) <= max_chars:
+            return text
+        return text[:max_chars].rsplit(" ", 1)[0] + "…"
+
+
+class Retrieval:
+    """Result of AnswerPipeline.retrieve(); answer is set once it is final"""
+
+    __slots__ = ("query", "kb_version", "embedding", "hits", "answer", "followup")
+
+    def __init__(self, query: str, kb_version: Hashable, embedding: Optional[List[float]] = None,
+                 hits: Optional[List[Dict]] = None, answer: Optional[str] = None, followup: bool = False):
+        self.query = query
+        self.kb_version = kb_version
+        self.embedding = embedding
+        self.hits = hits
+        self.answer = answer
+        self.followup = followup
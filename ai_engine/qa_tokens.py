@@ -0,0 +1,218 @@
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+
+Encoding = Tuple[np.ndarray, np.ndarray]
+
+# Byte positions of a text's slice in ids.bin and offsets.bin, and its token count
+_TOKENS_TABLE = (
+    "CREATE TABLE IF NOT EXISTS tokens (content_hash TEXT, tokenizer TEXT, ids_at INTEGER, offsets_at INTEGER, "
+    "length INTEGER, PRIMARY KEY (content_hash, tokenizer))"
+)
+
+
+class HashingTokenizer:
+    """Whitespace tokenizer with hashed word IDs, for the model-free hashing backend"""
+
+    name = "hashing"
+    cls_token_id, sep_token_id, pad_token_id = 1, 2, 0
+
+    def encode_batch(self, texts: List[str]) -> List[Encoding]:
+        encodings = []
+        for text in texts:
+            ids, offsets, position = [], [], 0
+            for word in text.split():
+                start = text.index(word, position)
+                position = start + len(word)
+                ids.append(zlib.crc32(word.lower().encode()) % 30000 + 3)
+                offsets.append((start, position))
+            encodings.append((np.asarray(ids, dtype=np.int32),
+                              np.asarray(offsets, dtype=np.int32).reshape(-1, 2)))
+        return encodings
+
+
+class BertTokenizer:
+    """Fast Hugging Face tokenizer of the QA model: token IDs with character offsets, no special tokens"""
+
+    def __init__(self, name: str = config.QA_TOKENIZER):
+        from transformers import AutoTokenizer
+
+        self.name = name
+        self._tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+        self.cls_token_id = self._tokenizer.cls_token_id
+        self.sep_token_id = self._tokenizer.sep_token_id
+        self.pad_token_id = self._tokenizer.pad_token_id
+
+    def encode_batch(self, texts: List[str]) -> List[Encoding]:
+        batch = self._tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+        return [
+            (np.asarray(ids, dtype=np.int32), np.asarray(offsets, dtype=np.int32).reshape(-1, 2))
+            for ids, offsets in zip(batch["input_ids"], batch["offset_mapping"])
+        ]
+
+
+@lru_cache(maxsize=1)
+def qa_tokenizer():
+    """Tokenizer matching the QA model of the configured backend"""
+    if config.INFERENCE_BACKEND == "hashing":
+        return HashingTokenizer()
+    return BertTokenizer()
+
+
+class QAWindow:
+    """A slice of a pre-tokenized chunk that fits the QA model next to the question"""
+
+    __slots__ = ("text", "ids", "offsets")
+
+    def __init__(self, text: str, ids: np.ndarray, offsets: np.ndarray):
+        self.text = text
+        self.ids = ids
+        self.offsets = offsets
+
+    def __str__(self) -> str:
+        return self.text[self.offsets[0][0]:self.offsets[-1][1]] if len(self.offsets) else ""
+
+
+def context_budget() -> int:
+    """Context tokens per window: [CLS] question [SEP] context [SEP] within MAX_SEQUENCE_LENGTH"""
+    return config.MAX_SEQUENCE_LENGTH - config.QA_MAX_QUERY_TOKENS - 3
+
+
+def windows(text: str, encoding: Encoding, budget: int = 0,
+            overlap: int = int(config.QA_WINDOW_OVERLAP * config.QA_TOKENS_PER_WORD)) -> List[QAWindow]:
+    """Cut a tokenized chunk into overlapping windows; slicing only, no tokenizer"""
+    ids, offsets = encoding
+    budget = budget or context_budget()
+    if len(ids) <= budget:
+        return [QAWindow(text, ids, offsets)] if len(ids) else []
+    step = max(1, budget - overlap)
+    result = []
+    for start in range(0, len(ids), step):
+        result.append(QAWindow(text, ids[start:start + budget], offsets[start:start + budget]))
+        if start + budget >= len(ids):
+            break
+    return result
+
+
+class QATokenStore:
+    """Chunk texts tokenized once for the QA model, in append-only arrays
+
+    ids.bin holds int32 token IDs and offsets.bin int32 (start, end)
+    character pairs, back to back for every stored text; index.db maps a
+    content hash and tokenizer to its byte position in each file and its
+    token count, so bytes left behind by a failed write are never read and
+    the two files need not stay in step. Keyed by content like the
+    embedding cache, so every snapshot and rebuild shares it. Recently used
+    chunks stay decoded in an LRU.
+    """
+
+    def __init__(self, directory: str = config.QA_TOKENS_DIR, hot_size: int = config.QA_TOKENS_HOT_SIZE):
+        self.directory = directory
+        self.hot_size = hot_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hot: "OrderedDict[str, Encoding]" = OrderedDict()
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def _open(self):
+        # SQLite handles and file descriptors are reopened in each forked worker
+        if self._pid == os.getpid():
+            return
+        self._conn = sqlite3.connect(os.path.join(self.directory, "index.db"), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_TOKENS_TABLE)
+        self._ids = open(os.path.join(self.directory, "ids.bin"), "ab+")
+        self._offsets = open(os.path.join(self.directory, "offsets.bin"), "ab+")
+        self._pid = os.getpid()
+
+    def missing(self, content_hashes: Iterable[str]) -> List[str]:
+        hashes = list(dict.fromkeys(content_hashes))
+        tokenizer = qa_tokenizer().name
+        with self._lock:
+            self._open()
+            found = set()
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT content_hash FROM tokens WHERE tokenizer = ? AND content_hash IN "
+                    f"({','.join('?' * len(part))})", (tokenizer, *part),
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return [content_hash for content_hash in hashes if content_hash not in found]
+
+    def add(self, texts: Dict[str, str]) -> List[Encoding]:
+        """Tokenize and store texts, keyed by content hash; returns their encodings in order"""
+        if not texts:
+            return []
+        tokenizer = qa_tokenizer()
+        encodings = tokenizer.encode_batch(list(texts.values()))
+        with self._lock:
+            self._open()
+            # The write transaction also serializes appends from other processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids_at = os.fstat(self._ids.fileno()).st_size
+                offsets_at = os.fstat(self._offsets.fileno()).st_size
+                rows = []
+                for content_hash, (ids, offsets) in zip(texts, encodings):
+                    rows.append((content_hash, tokenizer.name, ids_at, offsets_at, len(ids)))
+                    ids_at += ids.nbytes
+                    offsets_at += offsets.nbytes
+                self._ids.write(b"".join(ids.tobytes() for ids, _ in encodings))
+                self._offsets.write(b"".join(offsets.tobytes() for _, offsets in encodings))
+                self._ids.flush()
+                self._offsets.flush()
+                self._conn.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return encodings
+
+    def get(self, content_hash: str, text: Optional[str] = None) -> Optional[Encoding]:
+        """Token IDs and offsets of a chunk; with text, a chunk not stored yet is tokenized and stored"""
+        with self._lock:
+            encoding = self._hot.get(content_hash)
+            if encoding is not None:
+                self._hot.move_to_end(content_hash)
+                self.hits += 1
+                return encoding
+            self.misses += 1
+            self._open()
+            row = self._conn.execute(
+                "SELECT ids_at, offsets_at, length FROM tokens WHERE content_hash = ? AND tokenizer = ?",
+                (content_hash, qa_tokenizer().name),
+            ).fetchone()
+            if row is not None:
+                ids_at, offsets_at, length = row
+                ids = np.frombuffer(os.pread(self._ids.fileno(), length * 4, ids_at), dtype=np.int32)
+                offsets = np.frombuffer(os.pread(self._offsets.fileno(), length * 8, offsets_at),
+                                        dtype=np.int32).reshape(-1, 2)
+                encoding = (ids, offsets)
+        if encoding is None:
+            if text is None:
+                return None
+            # Stored before this cache existed: tokenize once, reuse from now on
+            encoding = self.add({content_hash: text})[0]
+        with self._lock:
+            self._hot[content_hash] = encoding
+            if len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+        return encoding
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hot": len(self._hot), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
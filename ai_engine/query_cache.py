@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+import metrics
+from config import config
+
+
+def normalize_query(query: str) -> str:
+    """Cache key: case, ё/е, whitespace and trailing punctuation do not matter"""
+    return " ".join(query.lower().replace("ё", "е").split()).strip(" ?!.,;:")
+
+
+class CacheEntry:
+    __slots__ = ("key", "embedding", "results", "answer", "kb_version", "created_at", "slot")
+
+    def __init__(self, key: str, embedding: Optional[List[float]], results: Optional[List[Dict]],
+                 answer: Optional[str], kb_version: Hashable):
+        self.key = key
+        self.embedding = embedding
+        self.results = results
+        self.answer = answer
+        self.kb_version = kb_version
+        self.created_at = time.monotonic()
+        self.slot: Optional[int] = None
+
+
+class QueryCache:
+    """Two-level cache in front of the answer pipeline
+
+    Level one is an exact LRU on the normalized query text. Level two
+    matches a new query's embedding against every cached answer's
+    embedding and returns the answer when the cosine distance is within
+    semantic_radius. Entries are tagged with the KB version they were
+    computed against; a version change drops the whole cache.
+    """
+
+    def __init__(self, max_entries: int = config.CACHE_MAX_ENTRIES, ttl: float = config.CACHE_TTL_SECONDS,
+                 semantic_radius: float = config.CACHE_SEMANTIC_RADIUS, dim: int = config.EMBEDDING_DIM):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_radius = semantic_radius
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Fixed-size matrix of unit embeddings, one row per slot, so memory is bounded up front
+        self._matrix = np.zeros((max_entries, dim), dtype=np.float32)
+        self._slot_keys: List[Optional[str]] = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._kb_version: Optional[Hashable] = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _check_version(self, kb_version: Hashable):
+        if kb_version != self._kb_version:
+            self._clear()
+            self._kb_version = kb_version
+
+    def _clear(self):
+        self._entries.clear()
+        self._matrix.fill(0)
+        self._slot_keys = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def _evict(self, key: str):
+        entry = self._entries.pop(key)
+        if entry.slot is not None:
+            # A zero row can never fall within the radius
+            self._matrix[entry.slot] = 0
+            self._slot_keys[entry.slot] = None
+            self._free_slots.append(entry.slot)
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl
+
+    def get(self, query: str, kb_version: Hashable) -> Optional[CacheEntry]:
+        """Exact lookup; counts a hit only when the entry carries an answer"""
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version(kb_version)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._evict(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry.answer is not None:
+                    self.exact_hits += 1
+                    metrics.inc("query_cache_lookups_total", result="exact")
+            return entry
+
+    def get_similar(self, embedding: List[float], kb_version: Hashable) -> Optional[CacheEntry]:
+        """Nearest cached answer within the cosine radius"""
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        with self._lock:
+            self._check_version(kb_version)
+            if norm and self._entries:
+                scores = self._matrix @ (query / norm)
+                slot = int(np.argmax(scores))
+                key = self._slot_keys[slot]
+                if key is not None and 1.0 - scores[slot] <= self.semantic_radius:
+                    entry = self._entries[key]
+                    if not self._expired(entry):
+                        self._entries.move_to_end(key)
+                        self.semantic_hits += 1
+                        metrics.inc("query_cache_lookups_total", result="semantic")
+                        return entry
+                    self._evict(key)
+            self.misses += 1
+            metrics.inc("query_cache_lookups_total", result="miss")
+            return None
+
+    def put(self, query: str, kb_version: Hashable, embedding: Optional[List[float]] = None,
+            results: Optional[List[Dict]] = None, answer: Optional[str] = None):
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version(kb_version)
+            if key in self._entries:
+                self._evict(key)
+            while len(self._entries) >= self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+            entry = CacheEntry(key, embedding, results, answer, kb_version)
+            if embedding is not None and answer is not None:
+                vector = np.asarray(embedding, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                if norm:
+                    entry.slot = self._free_slots.pop()
+                    self._matrix[entry.slot] = vector / norm
+                    self._slot_keys[entry.slot] = key
+            self._entries[key] = entry
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,160 @@
+import asyncio
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from config import config
+
+
+class Priority(IntEnum):
+    ADMIN = 0
+    INTERACTIVE = 1
+    BULK = 2
+
+
+class Overloaded(Exception):
+    """The queue is full; the caller should retry later"""
+
+
+class DeadlineExceeded(Exception):
+    """The request waited past its deadline and was dropped before running"""
+
+
+class RateLimiter:
+    """Token bucket per user: rate_per_minute sustained, bursts of up to burst"""
+
+    def __init__(self, rate_per_minute: float = config.RATE_LIMIT_PER_MINUTE,
+                 burst: int = config.RATE_LIMIT_BURST, max_users: int = 10000):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_users = max_users
+        # user -> (tokens, last refill)
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+
+    def acquire(self, user_id: int) -> float:
+        """Take a token; returns 0 when allowed, otherwise seconds until the next token"""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        tokens, last = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return (1 - tokens) / self.rate
+        self._buckets[user_id] = (tokens - 1, now)
+        if len(self._buckets) > self.max_users:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float):
+        # A bucket that has refilled completely is the same as no bucket
+        full_after = self.burst / self.rate
+        self._buckets = {user: bucket for user, bucket in self._buckets.items() if now - bucket[1] < full_after}
+
+
+class _Job:
+    __slots__ = ("call", "future", "priority", "deadline", "enqueued")
+
+    def __init__(self, call: Callable[[], Awaitable[Any]], future: asyncio.Future, priority: Priority,
+                 deadline: Optional[float]):
+        self.call = call
+        self.future = future
+        self.priority = priority
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+
+
+class InferenceScheduler:
+    """Admission control between the handlers and the models
+
+    Jobs wait in one priority queue (admins, then interactive queries, then
+    bulk ingestion embeddings; FIFO within a priority) and at most
+    concurrency of them run at once. Interactive jobs are shed with
+    Overloaded once max_queue are waiting, and dropped with
+    DeadlineExceeded when their deadline passes before they start.
+    """
+
+    def __init__(self, concurrency: int = config.SCHEDULER_CONCURRENCY,
+                 max_queue: int = config.SCHEDULER_MAX_QUEUE,
+                 admin_priority: bool = config.ADMIN_PRIORITY,
+                 limiter: Optional[RateLimiter] = None):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.admin_priority = admin_priority
+        self.limiter = limiter or RateLimiter()
+        self._sequence = itertools.count()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        """Start the runners; call from the event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._run_jobs()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.cancel()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def priority_for(self, user_id: int) -> Priority:
+        if self.admin_priority and user_id in config.ADMIN_IDS:
+            return Priority.ADMIN
+        return Priority.INTERACTIVE
+
+    def admit(self, user_id: int) -> float:
+        """Rate-limit check; returns 0 when admitted, otherwise seconds to wait"""
+        retry_after = self.limiter.acquire(user_id)
+        if retry_after:
+            metrics.inc("scheduler_shed_total", reason="rate_limited")
+        return retry_after
+
+    async def run(self, call: Callable[[], Awaitable[Any]], priority: Priority = Priority.INTERACTIVE,
+                  deadline: Optional[float] = None) -> Any:
+        """Queue call and return its result; deadline is a time.monotonic() value"""
+        # Bulk work is never shed: it waits until interactive traffic leaves room
+        if priority != Priority.BULK and self._queue.qsize() >= self.max_queue:
+            metrics.inc("scheduler_shed_total", reason="busy")
+            raise Overloaded()
+        future = self._loop.create_future()
+        self._queue.put_nowait((priority, next(self._sequence), _Job(call, future, priority, deadline)))
+        metrics.inc("scheduler_queued_total", priority=priority.name.lower())
+        return await future
+
+    def run_threadsafe(self, call: Callable[[], Awaitable[Any]], priority: Priority = Priority.BULK) -> Any:
+        """Blocking run() for worker threads outside the event loop"""
+        return asyncio.run_coroutine_threadsafe(self.run(call, priority), self._loop).result()
+
+    async def _run_jobs(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.future.done():
+                # The handler gave up, e.g. its task was cancelled
+                continue
+            metrics.observe("scheduler_wait_seconds", time.monotonic() - job.enqueued,
+                            priority=job.priority.name.lower())
+            if job.deadline is not None and time.monotonic() > job.deadline:
+                metrics.inc("scheduler_shed_total", reason="deadline")
+                job.future.set_exception(DeadlineExceeded())
+                continue
+            try:
+                result = await job.call()
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
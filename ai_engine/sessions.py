@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from config import config
+
+# Python object headers of a Turn and a Session, on top of their payloads
+TURN_OVERHEAD = 200
+SESSION_OVERHEAD = 400
+
+
+class Turn:
+    """One question of a chat: its text, its embedding and the IDs of the chunks retrieved for it"""
+
+    __slots__ = ("query", "embedding", "chunk_ids", "at")
+
+    def __init__(self, query: str, embedding: Optional[np.ndarray], chunk_ids: bytes, at: float):
+        self.query = query
+        self.embedding = embedding
+        # 16-byte MD5 digests back to back, not 32-character hex strings
+        self.chunk_ids = chunk_ids
+        self.at = at
+
+    @classmethod
+    def from_retrieval(cls, retrieval) -> "Turn":
+        embedding = None
+        if retrieval.embedding is not None:
+            # float16 halves the size; plenty for the follow-up similarity check
+            embedding = np.asarray(retrieval.embedding, dtype=np.float16)
+        chunk_ids = b"".join(bytes.fromhex(hit["id"]) for hit in retrieval.hits or [])
+        return cls(retrieval.query, embedding, chunk_ids, time.time())
+
+    def ids(self) -> List[str]:
+        return [self.chunk_ids[i:i + 16].hex() for i in range(0, len(self.chunk_ids), 16)]
+
+    def nbytes(self) -> int:
+        embedding = self.embedding.nbytes if self.embedding is not None else 0
+        return TURN_OVERHEAD + len(self.query.encode()) + len(self.chunk_ids) + embedding
+
+
+class Session:
+    __slots__ = ("turns", "last_seen", "nbytes")
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.last_seen = 0.0
+        self.nbytes = SESSION_OVERHEAD
+
+
+class SessionStore:
+    """The last few turns of every chat, under one memory cap
+
+    Chats are kept in LRU order. Past max_bytes the least recently active
+    chats leave RAM, and so do chats idle for idle_seconds on sweep(). With
+    a db_path they are spilled to SQLite and loaded back on their next
+    message; without one they are forgotten. Chats idle longer than ttl are
+    forgotten either way.
+    """
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, max_turns: int = config.SESSION_MAX_TURNS,
+                 max_bytes: int = int(config.SESSION_MAX_MEMORY_MB * 1024 * 1024),
+                 ttl: float = config.SESSION_TTL_SECONDS, idle_seconds: float = config.SESSION_IDLE_SECONDS,
+                 db_path: str = config.SESSION_DB):
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._bytes = 0
+        self._swept = time.time()
+        self._conn = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, last_seen REAL, "
+                "turns TEXT, embeddings BLOB)"
+            )
+            self._conn.commit()
+
+    def last_turn(self, chat_id: int) -> Optional[Turn]:
+        with self._lock:
+            session = self._session(chat_id)
+            return session.turns[-1] if session is not None and session.turns else None
+
+    def turns(self, chat_id: int) -> List[Turn]:
+        with self._lock:
+            session = self._session(chat_id)
+            return list(session.turns) if session is not None else []
+
+    def record(self, chat_id: int, turn: Turn):
+        with self._lock:
+            session = self._session(chat_id)
+            if session is None:
+                session = self._sessions[chat_id] = Session(self.max_turns)
+                self._bytes += session.nbytes
+            if len(session.turns) == session.turns.maxlen:
+                self._resize(session, -session.turns[0].nbytes())
+            session.turns.append(turn)
+            session.last_seen = turn.at
+            self._resize(session, turn.nbytes())
+
+            # Least recently active first; the chat just recorded is the last to go
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                evicted.append(self._pop(next(iter(self._sessions))))
+            self._spill(evicted)
+        if turn.at - self._swept >= self.SWEEP_INTERVAL:
+            self.sweep()
+
+    def clear(self, chat_id: int) -> bool:
+        """Forget a chat, in RAM and on disk; False when there was nothing to forget"""
+        with self._lock:
+            found = chat_id in self._sessions
+            if found:
+                self._pop(chat_id)
+            if self._conn is not None:
+                found |= self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,)).rowcount > 0
+                self._conn.commit()
+        return found
+
+    def sweep(self) -> int:
+        """Spill idle chats, forget expired ones; returns how many chats left RAM"""
+        now = time.time()
+        with self._lock:
+            self._swept = now
+            idle = [
+                chat_id for chat_id, session in self._sessions.items()
+                if self.idle_seconds and now - session.last_seen > self.idle_seconds
+            ]
+            evicted = [self._pop(chat_id) for chat_id in idle]
+            self._spill(evicted)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.ttl,))
+                self._conn.commit()
+        if evicted:
+            logger.debug(f"Moved {len(evicted)} idle chats out of RAM")
+        return len(evicted)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            spilled = 0
+            if self._conn is not None:
+                spilled = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {"chats": len(self._sessions), "memory_mb": self._bytes / 1024 / 1024, "spilled": spilled}
+
+    def _resize(self, session: Session, delta: int):
+        session.nbytes += delta
+        self._bytes += delta
+
+    def _pop(self, chat_id: int) -> Tuple[int, Session]:
+        session = self._sessions.pop(chat_id)
+        self._bytes -= session.nbytes
+        return chat_id, session
+
+    def _session(self, chat_id: int) -> Optional[Session]:
+        session = self._sessions.get(chat_id)
+        if session is None:
+            session = self._load(chat_id)
+            if session is None:
+                return None
+            self._sessions[chat_id] = session
+            self._bytes += session.nbytes
+        elif time.time() - session.last_seen > self.ttl:
+            self._pop(chat_id)
+            return None
+        self._sessions.move_to_end(chat_id)
+        return session
+
+    def _spill(self, evicted: List[Tuple[int, Session]]):
+        if self._conn is None or not evicted:
+            return
+        rows = []
+        for chat_id, session in evicted:
+            turns, embeddings = [], []
+            for turn in session.turns:
+                dim = 0 if turn.embedding is None else len(turn.embedding)
+                turns.append([turn.query, turn.chunk_ids.hex(), turn.at, dim])
+                if dim:
+                    embeddings.append(turn.embedding.tobytes())
+            rows.append((chat_id, session.last_seen, json.dumps(turns, ensure_ascii=False), b"".join(embeddings)))
+        self._conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", rows)
+        self._conn.commit()
+
+    def _load(self, chat_id: int) -> Optional[Session]:
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT last_seen, turns, embeddings FROM sessions WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        # Back in RAM, the row would only go stale
+        self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+        self._conn.commit()
+        last_seen, turns, blob = row
+        if time.time() - last_seen > self.ttl:
+            return None
+        session = Session(self.max_turns)
+        session.last_seen = last_seen
+        vectors = np.frombuffer(blob, dtype=np.float16)
+        position = 0
+        for query, chunk_ids, at, dim in json.loads(turns):
+            embedding = vectors[position:position + dim] if dim else None
+            position += dim
+            turn = Turn(query, embedding, bytes.fromhex(chunk_ids), at)
+            session.turns.append(turn)
+            session.nbytes += turn.nbytes()
+        return session
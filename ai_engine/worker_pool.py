@@ -0,0 +1,218 @@
+import asyncio
+import gc
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from loguru import logger
+
+import metrics
+from config import config
+
+Handler = Callable[[Any], Any]
+
+
+def _serve(index: int, handler_factory: Callable[[], Handler], requests, results):
+    """Worker process loop: one request at a time, in arrival order"""
+    # Counts inherited from the parent are already reported there
+    metrics.REGISTRY.drain()
+    handler = handler_factory()
+    logger.info(f"Inference worker {index} ready")
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        request_id, payload = item
+        try:
+            ok, value = True, handler(payload)
+        except Exception as e:
+            # Exceptions may not pickle; the message is enough for the caller's log
+            ok, value = False, f"{type(e).__name__}: {e}"
+        # This request's metrics travel with its result, so the parent's endpoint covers every worker
+        results.put((request_id, ok, value, metrics.REGISTRY.drain()))
+
+
+class InferencePool:
+    """Forked worker processes answering queries, sharded by key so each chat's messages stay in order
+
+    Workers are forked after the models are loaded: the weights are shared
+    copy-on-write and the FAISS/compact indexes through mmap'ed files in the
+    page cache, so each worker adds activations and its BM25 copy only.
+    The parent must not run inference before forking: torch's OpenMP pool
+    does not survive a fork.
+    """
+
+    def __init__(self, handler_factory: Callable[[], Handler], workers: int = config.INFERENCE_WORKERS):
+        self.handler_factory = handler_factory
+        self.workers = max(1, workers)
+        self._context = multiprocessing.get_context("fork")
+        self._results = self._context.Queue()
+        self._requests = [self._context.Queue() for _ in range(self.workers)]
+        self._processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * self.workers
+        self._pending: Dict[int, Tuple[int, Future, float]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._completed = [0] * self.workers
+        self._latencies = deque(maxlen=config.BATCH_LATENCY_WINDOW)
+        self._collector: Optional[threading.Thread] = None
+        self._running = False
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_serve,
+            args=(index, self.handler_factory, self._requests[index], self._results),
+            name=f"inference-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        """Fork the workers and start collecting their results"""
+        self._running = True
+        # Move the loaded models out of the collector's reach: scanning them in a
+        # worker would write to their object headers and unshare the pages
+        gc.freeze()
+        for index in range(self.workers):
+            self._spawn(index)
+        self._collector = threading.Thread(target=self._collect, name="inference-results", daemon=True)
+        self._collector.start()
+        logger.info(f"Started {self.workers} inference workers")
+
+    def shard(self, key: Hashable) -> int:
+        return hash(key) % self.workers
+
+    def submit(self, key: Hashable, payload: Any) -> Future:
+        """Queue payload on the worker owning key; the future resolves to the handler's result"""
+        if not self._running:
+            raise RuntimeError("Inference pool is not running")
+        index = self.shard(key)
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._pending[request_id] = (index, future, time.perf_counter())
+        self._requests[index].put((request_id, payload))
+        return future
+
+    async def answer(self, key: Hashable, payload: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(key, payload))
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while self._running or self._pending:
+            try:
+                request_id, ok, value, delta = self._results.get(timeout=1.0)
+            except queue.Empty:
+                request_id = None
+            if request_id is not None:
+                metrics.REGISTRY.merge(delta)
+                with self._lock:
+                    index, future, enqueued = self._pending.pop(request_id)
+                    self._completed[index] += 1
+                    self._latencies.append(time.perf_counter() - enqueued)
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(value))
+            if time.monotonic() - last_check >= 1.0:
+                last_check = time.monotonic()
+                self._check_workers()
+
+    def _check_workers(self):
+        """Fail the requests of a crashed worker and fork a replacement"""
+        for index, process in enumerate(self._processes):
+            if process is None or process.is_alive():
+                continue
+            with self._lock:
+                lost = [request_id for request_id, entry in self._pending.items() if entry[0] == index]
+                futures = [self._pending.pop(request_id)[1] for request_id in lost]
+            for future in futures:
+                future.set_exception(RuntimeError(f"Inference worker {index} exited"))
+            if self._running:
+                logger.error(f"Inference worker {index} exited with code {process.exitcode}, restarting")
+                self._spawn(index)
+            else:
+                self._processes[index] = None
+
+    def stop(self, timeout: float = 10.0):
+        """Let the workers finish their queues, then stop them"""
+        if not self._running:
+            return
+        for requests in self._requests:
+            requests.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+        self._running = False
+        if self._collector is not None:
+            self._collector.join()
+        logger.info("Inference workers stopped")
+
+    def restart(self):
+        """Fork fresh workers, e.g. after the parent reloaded its models"""
+        self.stop()
+        self._processes = [None] * self.workers
+        self.start()
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-worker queue depth and completed requests, p50/p99 latency over the recent window"""
+        with self._lock:
+            queued = [0] * self.workers
+            for index, _, _ in self._pending.values():
+                queued[index] += 1
+            completed = list(self._completed)
+            latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self._processes if process is not None and process.is_alive()),
+            "queued": queued,
+            "completed": completed,
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+        }
+
+
+def pipeline_handler(registry, workers: int = config.INFERENCE_WORKERS) -> Callable[[], Handler]:
+    """Handler factory running the registry's pipeline inside a forked worker
+
+    Payloads are (method, args): ("retrieve", (query, previous_turn)) and
+    then "finish" when QA is needed; both phases of a chat land on the same
+    worker, since the pool shards by chat.
+    """
+
+    def factory() -> Handler:
+        from ai_engine.inference import configure_threads, resolve_threads
+
+        # Split the cores between workers instead of oversubscribing them
+        configure_threads(max(1, resolve_threads() // workers))
+        kb_manager = registry.kb_manager
+        kb_manager.follow_published(reopen=True)
+        registry.warm_up()
+        last_sync = time.monotonic()
+
+        def handle(payload: Tuple[str, tuple]) -> Any:
+            nonlocal last_sync
+            method, args = payload
+            if time.monotonic() - last_sync >= config.KB_SYNC_INTERVAL:
+                last_sync = time.monotonic()
+                kb_manager.follow_published()
+            return getattr(registry.pipeline, method)(*args)
+
+        return handle
+
+    return factory
@@ -0,0 +1,379 @@
+"""End-to-end throughput and latency of the bot handlers with Telegram stubbed out
+
+Drives the real handlers in bot/handlers.py with synthetic updates: a corpus
+upload through handle_file_upload and background ingestion, semantic_search,
+then handle_message at the chosen concurrency. --models stub swaps in the
+model-free hashing embeddings and a word-overlap QA stand-in, so a run needs
+no weights; --models real loads the configured models. Every run works in
+a scratch data directory and never touches the real knowledge base.
+
+Usage: python benchmarks/e2e_bench.py --models stub --corpus-mb 5 --messages 500 --concurrency 32 --output results/e2e.json
+       python benchmarks/e2e_bench.py --models stub --compare results/e2e.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from config import config
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Assistant", "username": "assistant_bot"}
+
+CITIES = ["Москве", "Санкт-Петербурге", "Казани", "Новосибирске", "Екатеринбурге", "Самаре"]
+PLACES = ["Офис компании", "Склад", "Пункт выдачи", "Сервисный центр", "Шоурум"]
+PRODUCTS = ["ноутбук", "принтер", "монитор", "роутер", "сканер", "планшет", "проектор", "клавиатуру"]
+ACTIONS = [
+    ("восстановления пароля", "нажать «Забыли пароль» на странице входа"),
+    ("возврата товара", "заполнить заявление в личном кабинете"),
+    ("подключения к сети", "ввести ключ доступа из договора"),
+    ("продления гарантии", "обратиться в сервисный центр с чеком"),
+]
+
+
+def synthetic_corpus(size_bytes: int, seed: int = 0) -> str:
+    """Russian FAQ-style paragraphs of facts, about size_bytes of UTF-8"""
+    rng = random.Random(seed)
+    paragraphs, size = [], 0
+    while size < size_bytes:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            kind = rng.randrange(4)
+            if kind == 0:
+                sentences.append(f"{rng.choice(PLACES)} в {rng.choice(CITIES)} работает с понедельника по "
+                                 f"пятницу с {rng.randint(7, 10)}:00 до {rng.randint(17, 21)}:00.")
+            elif kind == 1:
+                sentences.append(f"Стоимость доставки {rng.choice(PRODUCTS)} по {rng.choice(CITIES)} "
+                                 f"составляет {rng.randrange(100, 2000, 50)} рублей.")
+            elif kind == 2:
+                sentences.append(f"Гарантийный срок на {rng.choice(PRODUCTS)} — {rng.choice([6, 12, 24, 36])} месяцев "
+                                 f"с даты покупки.")
+            else:
+                action, step = rng.choice(ACTIONS)
+                sentences.append(f"Для {action} необходимо {step}.")
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph.encode("utf-8")) + 2
+    return "\n\n".join(paragraphs)
+
+
+def synthetic_questions(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    templates = [
+        lambda: f"Когда работает {rng.choice(PLACES).lower()} в {rng.choice(CITIES)}?",
+        lambda: f"Сколько стоит доставка {rng.choice(PRODUCTS)} по {rng.choice(CITIES)}?",
+        lambda: f"Какой гарантийный срок на {rng.choice(PRODUCTS)}?",
+        lambda: f"Что нужно для {rng.choice(ACTIONS)[0]}?",
+    ]
+    return [rng.choice(templates)() for _ in range(n)]
+
+
+class StubTelegramRequest(BaseRequest):
+    """Answers Bot API calls in-process and counts what the handlers send"""
+
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+        self.calls = Counter()
+        self._message_ids = iter(range(1, 1 << 31))
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def message(self, chat_id: int, text: str) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if "/file/bot" in url:
+            return 200, self.files[url.rsplit("/", 1)[-1]]
+
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        result = True
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method == "getFile":
+            result = {"file_id": params["file_id"], "file_unique_id": params["file_id"],
+                      "file_path": params["file_id"]}
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = self.message(int(params["chat_id"]), params["text"])
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class StubQAEngine:
+    """QA stand-in answering with the context sentence sharing most words with the query"""
+
+    def __init__(self):
+        from ai_engine.batching import MicroBatcher
+
+        self.qa_batcher = MicroBatcher(self._answer_batch, name="qa")
+
+    @staticmethod
+    def _answer_batch(pairs: List[tuple]) -> List[tuple]:
+        from chunking import split_sentences
+
+        results = []
+        for context, query in pairs:
+            words = set(query.lower().split())
+            sentences = list(split_sentences(context)) or [""]
+            best = max(sentences, key=lambda sentence: len(words & set(sentence.lower().split())))
+            overlap = len(words & set(best.lower().split()))
+            results.append((best if overlap else "", context.find(best), overlap / max(len(words), 1)))
+        return results
+
+    def answer_candidates(self, contexts: List[str], query: str) -> List[tuple]:
+        futures = [self.qa_batcher.submit((context, query)) for context in contexts]
+        return [future.result() for future in futures]
+
+    def process_query(self, query: str, context: str = None) -> str:
+        if not context:
+            return self._generate_fallback_response(query)
+        answer, _, _ = self.qa_batcher((context, query))
+        return self._format_response(answer, query)
+
+    def _generate_fallback_response(self, query: str) -> str:
+        return "Недостаточно информации для ответа."
+
+    def _format_response(self, answer: str, original_query: str) -> str:
+        return f"Ответ: {answer}"
+
+
+def isolate_data_dir(root: str):
+    """Point every data path in config under root"""
+    data_dir = config.DATA_DIR
+    for name in dir(config):
+        value = getattr(config, name)
+        # Exported ONNX models are expensive to rebuild and safe to share
+        if name != "OPTIMIZED_MODELS_DIR" and isinstance(value, str) and value.startswith(data_dir):
+            setattr(config, name, root + value[len(data_dir):])
+
+
+def summarize(latencies: List[float], elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return round(1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2)
+
+    return {
+        "requests": len(latencies),
+        "qps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+async def run_concurrently(n: int, concurrency: int, call) -> dict:
+    """Await call(i) for i in range(n), at most concurrency at a time; latency per call"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def bench(args) -> dict:
+    from telegram.ext import Application, ContextTypes
+
+    from ai_engine.model_registry import ModelRegistry
+    from ai_engine.scheduler import InferenceScheduler, RateLimiter
+    from ai_engine.sessions import SessionStore
+    import metrics
+    from bot.handlers import handle_file_upload, handle_message
+    from ingestion import IngestionQueue
+
+    request = StubTelegramRequest()
+    application = Application.builder().token("123456:stub").request(request).get_updates_request(request).build()
+    await application.initialize()
+
+    registry = ModelRegistry(warmup=args.models == "real")
+    if args.models == "stub":
+        registry.register("ai_engine", StubQAEngine)
+    started = time.perf_counter()
+    registry.load_all()
+    load_time = time.perf_counter() - started
+    if args.no_cache:
+        registry.query_cache = None
+    scheduler = InferenceScheduler(limiter=RateLimiter(args.rate_limit))
+    scheduler.start()
+    ingestion = IngestionQueue(registry, scheduler=scheduler)
+    ingestion.start(application.bot)
+    application.bot_data.update(registry=registry, ingestion=ingestion, scheduler=scheduler,
+                                sessions=SessionStore())
+    results: Dict[str, dict] = {"models": {"mode": args.models, "vector_backend": config.VECTOR_BACKEND,
+                                           "load_s": round(load_time, 2)}}
+
+    def update(message: dict) -> Update:
+        return Update.de_json({"update_id": next(update_ids), "message": message}, application.bot)
+
+    def context_for(update_: Update):
+        return ContextTypes.DEFAULT_TYPE.from_update(update_, application)
+
+    update_ids = iter(range(1, 1 << 31))
+    admin = {"id": config.ADMIN_IDS[0], "is_bot": False, "first_name": "Admin"}
+
+    # Ingestion: upload handler, download, background job until the chunks are committed
+    corpus = synthetic_corpus(int(args.corpus_mb * 1024 * 1024), args.seed).encode("utf-8")
+    request.files["corpus"] = corpus
+    config.MAX_FILE_SIZE = max(config.MAX_FILE_SIZE, len(corpus))
+    upload = update({
+        "message_id": 1, "date": int(time.time()), "chat": {"id": admin["id"], "type": "private"}, "from": admin,
+        "document": {"file_id": "corpus", "file_unique_id": "corpus", "file_name": "corpus.txt",
+                     "file_size": len(corpus)},
+    })
+    started = time.perf_counter()
+    await handle_file_upload(upload, context_for(upload))
+    while ingestion.store.unfinished():
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    kb_info = registry.kb_manager.get_knowledge_base_info()
+    results["ingestion"] = {
+        "corpus_mb": round(len(corpus) / 1024 / 1024, 2),
+        "chunks": kb_info["chunk_count"],
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(len(corpus) / 1024 / 1024 / elapsed, 2),
+    }
+
+    questions = synthetic_questions(max(args.searches, args.messages), args.seed + 1)
+
+    async def search(i: int):
+        await asyncio.to_thread(registry.kb_manager.semantic_search, questions[i])
+
+    results["semantic_search"] = {"concurrency": args.concurrency,
+                                  **await run_concurrently(args.searches, args.concurrency, search)}
+
+    async def message(i: int):
+        user = {"id": 10_000 + i % args.chats, "is_bot": False, "first_name": "User"}
+        text_update = update({"message_id": 100 + i, "date": int(time.time()),
+                              "chat": {"id": user["id"], "type": "private"}, "from": user,
+                              "text": questions[i]})
+        await handle_message(text_update, context_for(text_update))
+
+    results["handle_message"] = {"concurrency": args.concurrency, "chats": args.chats,
+                                 **await run_concurrently(args.messages, args.concurrency, message)}
+    if registry.query_cache is not None:
+        results["handle_message"]["cache_hit_rate"] = round(registry.query_cache.stats()["hit_rate"], 3)
+
+    # Time to the first reply and to the final answer; equal unless replies are progressive
+    for phase, key in (("first_byte", "ttfb"), ("final_answer", "ttfa")):
+        for q in (0.50, 0.95):
+            value = metrics.REGISTRY.quantile("reply_latency_seconds", q, phase=phase)
+            results["handle_message"][f"{key}_p{int(q * 100)}_ms"] = round(value * 1000, 2) if value else None
+    results["handle_message"]["followups"] = metrics.REGISTRY.value("session_followups_total")
+    results["handle_message"]["budget_exceeded"] = metrics.REGISTRY.value("progressive_edits_total",
+                                                                          outcome="budget_exceeded")
+    results["handle_message"]["shed"] = {
+        reason: metrics.REGISTRY.value("scheduler_shed_total", reason=reason)
+        for reason in ("rate_limited", "busy", "deadline")
+    }
+
+    await ingestion.stop()
+    await scheduler.stop()
+    await application.shutdown()
+    # ru_maxrss is in kilobytes on Linux; children count once they have exited
+    results["memory"] = {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    results["telegram_calls"] = dict(request.calls)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict):
+    """One JSON line per numeric metric present in both runs"""
+    for stage, metrics in current["results"].items():
+        for name, value in metrics.items():
+            before = previous["results"].get(stage, {}).get(name)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)) and not isinstance(value, bool):
+                change = round(100 * (value - before) / before, 1) if before else None
+                print(json.dumps({"stage": stage, "metric": name, "before": before, "after": value,
+                                  "change_pct": change}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", choices=["stub", "real"], default="stub")
+    parser.add_argument("--vector-backend", choices=["chroma", "faiss", "compact"], default=config.VECTOR_BACKEND)
+    parser.add_argument("--corpus-mb", type=float, default=2.0)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--searches", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--chats", type=int, default=50, help="Distinct chats the messages come from")
+    parser.add_argument("--no-cache", action="store_true", help="Answer every message without the query cache")
+    parser.add_argument("--single-reply", action="store_true", help="Disable progressive replies")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Messages per user per minute; 0 = unlimited")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="Scratch data directory; a temporary one by default")
+    parser.add_argument("--output", help="Write the run as JSON here")
+    parser.add_argument("--compare", help="Earlier --output file to print per-metric changes against")
+    args = parser.parse_args()
+
+    config.VECTOR_BACKEND = args.vector_backend
+    config.PROGRESSIVE_REPLIES = not args.single_reply
+    if args.models == "stub":
+        # Set before the project modules are imported: their defaults bind at import time
+        config.INFERENCE_BACKEND = "hashing"
+    with tempfile.TemporaryDirectory() as scratch:
+        isolate_data_dir(args.data_dir or scratch)
+        results = asyncio.run(bench(args))
+
+    run = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "args": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "results": results,
+    }
+    for stage, metrics in results.items():
+        print(json.dumps({"stage": stage, **metrics}, ensure_ascii=False))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == "__main__":
+    main()
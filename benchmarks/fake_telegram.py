@@ -0,0 +1,187 @@
+"""Offline load test: a fake Telegram Bot API that feeds the bot synthetic messages
+
+Set TELEGRAM_API_URL = "http://127.0.0.1:8081/bot" in config.py, start this
+server, then start the bot. Updates are pushed to the webhook the bot
+registers with setWebhook (RUN_MODE = "webhook", WEBHOOK_URL pointing at the
+local listener) or served through getUpdates in polling mode.
+
+Usage: python benchmarks/fake_telegram.py --chats 50 --messages 20 --port 8081
+
+Chats are groups, so the bot's replies quote the question; the server checks
+each chat gets its answers in the order it asked and prints one JSON line.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Assistant", "username": "assistant_bot"}
+QUESTIONS = [
+    "Когда открыт офис?",
+    "Сколько стоит доставка по Москве?",
+    "Какой гарантийный срок на оборудование?",
+    "Как восстановить пароль?",
+    "Что находится в базе знаний?",
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class FakeTelegram:
+    def __init__(self, chats: int, messages: int, timeout: float):
+        self.chats = chats
+        self.messages = messages
+        self.timeout = timeout
+        self.webhook_url: Optional[str] = None
+        self.secret: Optional[str] = None
+        self.started = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.update_ids = iter(range(1, 1 << 31))
+        self.message_ids = iter(range(1, 1 << 31))
+        # Per chat: (message_id, sent_at) of questions still waiting for an answer
+        self.waiting: Dict[int, Deque[Tuple[int, float]]] = defaultdict(deque)
+        self.latencies: List[float] = []
+        self.replies = 0
+        self.out_of_order = 0
+        self.first_sent: Optional[float] = None
+        self.last_reply: Optional[float] = None
+
+    def message(self, chat_id: int, text: str, **extra) -> dict:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": f"Load test {chat_id}"},
+            "text": text,
+            **extra,
+        }
+
+    async def api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        result = True
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "setWebhook":
+            self.webhook_url = params.get("url") or None
+            self.secret = params.get("secret_token")
+            if self.webhook_url:
+                self.started.set()
+        elif method == "deleteWebhook":
+            self.webhook_url = None
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "getUpdates":
+            self.started.set()
+            result = await self.poll(float(params.get("timeout", 0) or 0))
+        elif method in ("sendMessage", "editMessageText"):
+            result = self.reply(params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def poll(self, timeout: float) -> List[dict]:
+        try:
+            batch = [await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01))]
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty() and len(batch) < 100:
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def reply(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        reply_to = params.get("reply_to_message_id")
+        now = time.perf_counter()
+        waiting = self.waiting[chat_id]
+        if waiting:
+            message_id, sent_at = waiting.popleft()
+            if reply_to is not None and int(reply_to) != message_id:
+                self.out_of_order += 1
+            self.latencies.append(now - sent_at)
+            self.replies += 1
+            self.last_reply = now
+            if self.replies == self.chats * self.messages:
+                self.finished.set()
+        return self.message(chat_id, params.get("text", ""), **{"from": BOT_USER})
+
+    async def send_chat(self, session: ClientSession, chat_id: int):
+        """One chat asks its questions in order, as fast as the bot accepts them"""
+        for i in range(self.messages):
+            message = self.message(chat_id, f"{QUESTIONS[i % len(QUESTIONS)]} #{i}",
+                                   **{"from": {"id": chat_id, "is_bot": False, "first_name": "User"}})
+            update = {"update_id": next(self.update_ids), "message": message}
+            self.waiting[chat_id].append((message["message_id"], time.perf_counter()))
+            if self.webhook_url:
+                headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret} if self.secret else {}
+                async with session.post(self.webhook_url, json=update, headers=headers) as response:
+                    response.raise_for_status()
+            else:
+                await self.updates.put(update)
+                await asyncio.sleep(0)
+
+    async def load(self):
+        await self.started.wait()
+        # Give the bot a moment to finish starting after its first call
+        await asyncio.sleep(1.0)
+        self.first_sent = time.perf_counter()
+        async with ClientSession() as session:
+            await asyncio.gather(*(self.send_chat(session, -1000 - chat) for chat in range(self.chats)))
+        try:
+            await asyncio.wait_for(self.finished.wait(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def result(self) -> dict:
+        elapsed = (self.last_reply or time.perf_counter()) - (self.first_sent or time.perf_counter())
+        return {
+            "delivery": "webhook" if self.webhook_url else "polling",
+            "chats": self.chats,
+            "updates": self.chats * self.messages,
+            "replies": self.replies,
+            "out_of_order": self.out_of_order,
+            "replies_per_s": round(self.replies / elapsed, 1) if elapsed > 0 else 0.0,
+            "p50_ms": round(1000 * percentile(self.latencies, 0.50), 1),
+            "p95_ms": round(1000 * percentile(self.latencies, 0.95), 1),
+            "p99_ms": round(1000 * percentile(self.latencies, 0.99), 1),
+        }
+
+
+async def run(args):
+    fake = FakeTelegram(args.chats, args.messages, args.timeout)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake.api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Fake Bot API on http://{args.host}:{args.port}/bot, waiting for the bot...", flush=True)
+    try:
+        await fake.load()
+    finally:
+        await runner.cleanup()
+    print(json.dumps(fake.result()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20, help="Messages per chat")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for the last reply")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
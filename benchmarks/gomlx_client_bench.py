@@ -0,0 +1,60 @@
+"""Throughput of the GoMLX clients against a running connector or stub
+
+Start the stub first: python ai_engine/gomlx_stub_server.py --latency-ms 5
+Usage: python benchmarks/gomlx_client_bench.py --texts 5000 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_engine.gomlx_client import AsyncGoMLXClient, GoMLXClient
+
+
+def bench_sync(texts) -> dict:
+    client = GoMLXClient()
+    started = time.perf_counter()
+    for text in texts:
+        client.generate_embedding(text)
+    elapsed = time.perf_counter() - started
+    return {"client": "sync_single", "texts": len(texts), "texts_per_s": round(len(texts) / elapsed, 1)}
+
+
+async def bench_async(texts, concurrency: int, batch_size: int) -> dict:
+    def no_fallback(batch):
+        raise RuntimeError("GoMLX unavailable during benchmark")
+
+    async with AsyncGoMLXClient(fallback=no_fallback, max_concurrency=concurrency, batch_size=batch_size) as client:
+        started = time.perf_counter()
+        embeddings = await client.generate_embeddings(texts)
+        elapsed = time.perf_counter() - started
+    assert len(embeddings) == len(texts)
+    return {
+        "client": "async_batched",
+        "texts": len(texts),
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "texts_per_s": round(len(texts) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--skip-sync", action="store_true")
+    args = parser.parse_args()
+
+    texts = [f"Тестовый запрос номер {i}" for i in range(args.texts)]
+    if not args.skip_sync:
+        print(json.dumps(bench_sync(texts)))
+    print(json.dumps(asyncio.run(bench_async(texts, args.concurrency, args.batch_size))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Parity and speed of an optimized inference backend against the fp32 models
+
+Usage: python benchmarks/inference_parity.py --backend onnx --texts corpus.txt --qa squad_ru.json
+
+--qa takes a JSON list of {"context", "question", "answer"} objects; without
+it a few built-in examples are used.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_engine.inference import cosine_drift, load_embedding_model, optimize_qa_model, squad_scores
+
+SAMPLE_TEXTS = [
+    "Что находится в базе знаний?",
+    "Офис открыт с понедельника по пятницу с 9:00 до 18:00.",
+    "Для восстановления пароля нажмите «Забыли пароль» на странице входа.",
+    "Стоимость доставки по Москве составляет 300 рублей, бесплатно от 5000 рублей.",
+    "Гарантийный срок на оборудование — 24 месяца с даты покупки.",
+    "Как подключить принтер к беспроводной сети?",
+]
+
+SAMPLE_QA = [
+    {"context": "Офис компании открыт с понедельника по пятницу с 9:00 до 18:00. В субботу офис закрыт.",
+     "question": "Когда открыт офис?", "answer": "с понедельника по пятницу с 9:00 до 18:00"},
+    {"context": "Гарантийный срок на оборудование составляет 24 месяца с даты покупки.",
+     "question": "Какой гарантийный срок?", "answer": "24 месяца"},
+    {"context": "Доставка по Москве стоит 300 рублей. При заказе от 5000 рублей доставка бесплатна.",
+     "question": "Сколько стоит доставка по Москве?", "answer": "300 рублей"},
+]
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def embedding_parity(backend: str, texts) -> dict:
+    reference_model = load_embedding_model("torch")
+    candidate_model = load_embedding_model(backend)
+    # One warm-up call each so lazy initialization is not timed
+    reference_model.encode(texts[:1])
+    candidate_model.encode(texts[:1])
+
+    reference, reference_time = timed(reference_model.encode, texts)
+    candidate, candidate_time = timed(candidate_model.encode, texts)
+    return {
+        "model": "embedding",
+        "backend": backend,
+        "texts": len(texts),
+        **cosine_drift(reference, candidate),
+        "fp32_ms_per_text": round(1000 * reference_time / len(texts), 2),
+        "optimized_ms_per_text": round(1000 * candidate_time / len(texts), 2),
+    }
+
+
+def qa_parity(backend: str, examples) -> dict:
+    from deeppavlov import build_model, configs
+
+    reference_model = build_model(configs.squad.squad_ru_bert, download=True)
+    candidate_model = optimize_qa_model(copy.deepcopy(reference_model), backend)
+    contexts = [example["context"] for example in examples]
+    questions = [example["question"] for example in examples]
+
+    (reference, _, _), reference_time = timed(reference_model, contexts, questions)
+    (candidate, _, _), candidate_time = timed(candidate_model, contexts, questions)
+    gold = [example["answer"] for example in examples]
+    return {
+        "model": "qa",
+        "backend": backend,
+        "examples": len(examples),
+        "agreement": squad_scores(candidate, reference),
+        "fp32_vs_gold": squad_scores(reference, gold),
+        "optimized_vs_gold": squad_scores(candidate, gold),
+        "fp32_ms_per_example": round(1000 * reference_time / len(examples), 2),
+        "optimized_ms_per_example": round(1000 * candidate_time / len(examples), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["int8", "onnx"], default="onnx")
+    parser.add_argument("--texts", help="File with one text per line")
+    parser.add_argument("--qa", help="JSON list of context/question/answer objects")
+    parser.add_argument("--skip-qa", action="store_true")
+    args = parser.parse_args()
+
+    texts = SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    print(json.dumps(embedding_parity(args.backend, texts), ensure_ascii=False))
+
+    if not args.skip_qa:
+        examples = SAMPLE_QA
+        if args.qa:
+            with open(args.qa, encoding="utf-8") as f:
+                examples = json.load(f)
+        print(json.dumps(qa_parity(args.backend, examples), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
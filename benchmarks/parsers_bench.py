@@ -0,0 +1,114 @@
+"""Throughput benchmark for the streaming parsers in parsers.py
+
+Usage: python benchmarks/parsers_bench.py --size-mb 50
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import iter_sentences, iter_token_chunks
+from parsers import PARSERS
+
+WORDS = (
+    "база знаний документ вопрос ответ система пользователь модель поиск "
+    "текст данные файл загрузка обработка договор клиент оплата доставка"
+).split()
+
+
+def _sentence(rng: random.Random, length: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def generate_file(ext: str, size_mb: float, directory: str) -> str:
+    """Write a synthetic Russian file of roughly size_mb megabytes"""
+    rng = random.Random(42)
+    path = os.path.join(directory, f"synthetic{ext}")
+    target = int(size_mb * 1024 * 1024)
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if ext == ".txt":
+            while f.tell() < target:
+                f.write(_sentence(rng) + ".\n")
+        elif ext == ".csv":
+            writer = csv.writer(f)
+            writer.writerow(["id", "title", "body", "price"])
+            row_id = 0
+            while f.tell() < target:
+                writer.writerow([row_id, _sentence(rng, 3), _sentence(rng), rng.randint(1, 10000)])
+                row_id += 1
+        elif ext == ".json":
+            f.write("[")
+            row_id = 0
+            while f.tell() < target:
+                if row_id:
+                    f.write(",")
+                record = {"id": row_id, "title": _sentence(rng, 3), "body": _sentence(rng)}
+                f.write(json.dumps(record, ensure_ascii=False))
+                row_id += 1
+            f.write("]")
+    return path
+
+
+def _run(ext: str, path: str):
+    records = 0
+    chunks = 0
+
+    def counted():
+        nonlocal records
+        for record in PARSERS[ext](path):
+            records += 1
+            yield record
+
+    # Word counts: the parsers are measured here, not the embedding tokenizer
+    for _ in iter_token_chunks(iter_sentences(counted()), count=lambda text: len(text.split())):
+        chunks += 1
+    return records, chunks
+
+
+def bench_parser(ext: str, path: str) -> dict:
+    size_mb = os.path.getsize(path) / 1024 / 1024
+
+    started = time.perf_counter()
+    records, chunks = _run(ext, path)
+    elapsed = time.perf_counter() - started
+
+    # Separate pass: tracemalloc slows allocation-heavy code several times over
+    tracemalloc.start()
+    _run(ext, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "parser": ext,
+        "size_mb": round(size_mb, 2),
+        "records": records,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(records / elapsed),
+        "mb_per_s": round(size_mb / elapsed, 2),
+        "peak_mem_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=20.0)
+    parser.add_argument("--formats", nargs="+", default=sorted(PARSERS))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for ext in args.formats:
+            path = generate_file(ext, args.size_mb, directory)
+            print(json.dumps(bench_parser(ext, path), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
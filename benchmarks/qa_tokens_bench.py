@@ -0,0 +1,115 @@
+"""Per-query tokenization time saved by the pre-tokenized QA contexts in ai_engine/qa_tokens.py
+
+Compares the QA chain tokenizing the question with every retrieved window
+against tokenizing only the question and reading the chunks' stored IDs,
+once from disk (cold) and once from the in-RAM LRU (hot).
+
+Usage: python benchmarks/qa_tokens_bench.py --chunks 5000 --queries 500
+       python benchmarks/qa_tokens_bench.py --tokenizer hashing
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+
+WORDS = (
+    "база знаний документ вопрос ответ система пользователь модель поиск "
+    "текст данные файл загрузка обработка договор клиент оплата доставка"
+).split()
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(length)) + "."
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _summary(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-words", type=int, default=60, help="Roughly CHUNK_MAX_TOKENS of MiniLM")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=config.TOP_K_RESULTS, help="Chunks sent to QA per query")
+    parser.add_argument("--tokenizer", choices=["bert", "hashing"], default="bert",
+                        help="hashing: whitespace stand-in, no model download")
+    args = parser.parse_args()
+
+    if args.tokenizer == "hashing":
+        config.INFERENCE_BACKEND = "hashing"
+    from ai_engine.pipeline import window_context
+    from ai_engine.qa_tokens import QATokenStore, qa_tokenizer, windows
+
+    rng = random.Random(42)
+    tokenizer = qa_tokenizer()
+    chunks = [_sentence(rng, args.chunk_words) for _ in range(args.chunks)]
+    queries = [(_sentence(rng, rng.randint(4, 12)), rng.sample(chunks, args.top_k)) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = QATokenStore(directory, hot_size=0)
+        started = time.perf_counter()
+        store.add({_content_hash(chunk): chunk for chunk in chunks})
+        ingest_seconds = time.perf_counter() - started
+        store_mb = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1024 / 1024
+
+        def per_query(tokenize):
+            samples = []
+            for query, hits in queries:
+                started = time.perf_counter()
+                tokenize(query, hits)
+                samples.append(time.perf_counter() - started)
+            return samples
+
+        def chain(query, hits):
+            # What the DeepPavlov preprocessor does: tokenize the question with every window
+            contexts = [window for hit in hits for window in window_context(hit, config.MAX_SEQUENCE_LENGTH)]
+            tokenizer.encode_batch([f"{query} {context}" for context in contexts])
+
+        def stored(query, hits):
+            tokenizer.encode_batch([query])
+            for hit in hits:
+                windows(hit, store.get(_content_hash(hit)))
+
+        baseline = per_query(chain)
+        cold = per_query(stored)
+        store.hot_size = len(chunks)
+        per_query(stored)
+        hot = per_query(stored)
+
+    results = {
+        "tokenizer": tokenizer.name,
+        "chunks": args.chunks,
+        "queries": args.queries,
+        "top_k": args.top_k,
+        "ingest_tokenize_s": round(ingest_seconds, 3),
+        "store_mb": round(store_mb, 2),
+        "per_query_tokenize": _summary(baseline),
+        "per_query_stored_cold": _summary(cold),
+        "per_query_stored_hot": _summary(hot),
+        "saved_ms_per_query_cold": round((statistics.fmean(baseline) - statistics.fmean(cold)) * 1000, 3),
+        "saved_ms_per_query_hot": round((statistics.fmean(baseline) - statistics.fmean(hot)) * 1000, 3),
+    }
+    print(json.dumps(results, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Recall@k and QPS of the vector store backends on a synthetic corpus
+
+Usage: python benchmarks/vector_store_bench.py --corpus 200000 --queries 1000
+
+disk_mb for the compact store is mostly the cold float32 file; only the hot
+file is scanned per query.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from vector_store import ChromaVectorStore, CompactVectorStore, FaissVectorStore
+
+
+def synthetic_corpus(n: int, dim: int, n_clusters: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to real sentence embeddings than pure noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, size=n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def directory_mb(directory: str) -> float:
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()) / 1024 / 1024
+
+
+def bench_store(name: str, store, directory: str, corpus: np.ndarray, queries: np.ndarray,
+                truth: np.ndarray, k: int, batch_size: int) -> dict:
+    ids = [hashlib.md5(str(i).encode()).hexdigest() for i in range(len(corpus))]
+    position = {chunk_id: i for i, chunk_id in enumerate(ids)}
+
+    started = time.perf_counter()
+    for start in range(0, len(corpus), batch_size):
+        end = start + batch_size
+        store.upsert(
+            ids[start:end],
+            corpus[start:end],
+            [f"chunk {i}" for i in range(start, min(end, len(corpus)))],
+            [{"chunk_index": i} for i in range(start, min(end, len(corpus)))],
+        )
+    store.persist()
+    ingest_time = time.perf_counter() - started
+
+    hits = 0
+    started = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        found = {position[result["id"]] for result in store.query(query, k)}
+        hits += len(found & set(expected.tolist()))
+    search_time = time.perf_counter() - started
+
+    return {
+        "backend": name,
+        "corpus": len(corpus),
+        f"recall@{k}": round(hits / (len(queries) * k), 4),
+        "qps": round(len(queries) / search_time, 1),
+        "ingest_vectors_per_s": round(len(corpus) / ingest_time),
+        "disk_mb": round(directory_mb(directory), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=config.TOP_K_RESULTS)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--backends", nargs="+",
+                        default=["chroma", "flat", "ivf", "hnsw", "compact_int8", "compact_float16"])
+    args = parser.parse_args()
+
+    dim = config.EMBEDDING_DIM
+    corpus = synthetic_corpus(args.corpus, dim, n_clusters=max(10, args.corpus // 1000))
+    queries = synthetic_corpus(args.queries, dim, n_clusters=max(10, args.corpus // 1000), seed=1)
+    truth = exact_top_k(corpus, queries, args.k)
+
+    # Roughly sqrt(N) lists, capped so small corpora still train
+    config.FAISS_IVF_NLIST = max(1, min(4 * int(math.sqrt(args.corpus)), args.corpus // config.FAISS_IVF_MIN_POINTS_PER_LIST))
+
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as directory:
+            if backend == "chroma":
+                store = ChromaVectorStore(path=directory, name="bench")
+            elif backend.startswith("compact_"):
+                store = CompactVectorStore(directory=directory, dtype=backend.split("_", 1)[1], dim=dim)
+            else:
+                store = FaissVectorStore(directory=directory, index_type=backend, dim=dim)
+            print(json.dumps(bench_store(backend, store, directory, corpus, queries, truth, args.k, args.batch_size)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Throughput of the inference worker pool against its worker count
+
+A CPU-bound stand-in handler replaces the models, so the numbers show how
+the pool itself scales; per-chat answer order is checked on every run.
+
+Usage: python benchmarks/worker_pool_bench.py --workers 1 2 4 8 --requests 2000 --work-ms 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_engine.worker_pool import InferencePool
+
+
+def burner(work_ms: float):
+    def factory():
+        def handle(payload):
+            chat_id, sequence = payload
+            deadline = time.process_time() + work_ms / 1000
+            while time.process_time() < deadline:
+                pass
+            return chat_id, sequence
+        return handle
+    return factory
+
+
+async def bench(workers: int, requests: int, chats: int, work_ms: float) -> dict:
+    pool = InferencePool(burner(work_ms), workers)
+    pool.start()
+    answered = {chat_id: [] for chat_id in range(chats)}
+
+    async def ask(chat_id: int, sequence: int):
+        _, answered_sequence = await pool.answer(chat_id, (chat_id, sequence))
+        answered[chat_id].append(answered_sequence)
+
+    # Warm-up round trip per worker, so process start-up is not timed
+    await asyncio.gather(*(pool.answer(index, (index, -1)) for index in range(workers)))
+    started = time.perf_counter()
+    await asyncio.gather(*(ask(i % chats, i // chats) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    stats = pool.stats()
+    pool.stop()
+
+    return {
+        "workers": workers,
+        "requests": requests,
+        "work_ms": work_ms,
+        "requests_per_s": round(requests / elapsed, 1),
+        "in_order": all(sequence == sorted(sequence) for sequence in answered.values()),
+        "p50_ms": round(stats["p50_ms"], 1),
+        "p99_ms": round(stats["p99_ms"], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=64)
+    parser.add_argument("--work-ms", type=float, default=5.0, help="CPU time per request")
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        result = asyncio.run(bench(workers, args.requests, args.chats, args.work_ms))
+        baseline = baseline or result["requests_per_s"] / workers
+        result["scaling_efficiency"] = round(result["requests_per_s"] / (baseline * workers), 2)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,49 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ContextTypes
+from telegram.ext import ApplicationHandlerStop, ContextTypes
 from config import config
 from loguru import logger
+import metrics
+from ai_engine.pipeline import AnswerPipeline
+from ai_engine.scheduler import DeadlineExceeded, Overloaded
+from ai_engine.sessions import Turn
 import psutil
 import os
+import asyncio
+import math
+import time
+import weakref
 from datetime import datetime
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
     return user_id in config.ADMIN_IDS
 
+def get_registry(context: ContextTypes.DEFAULT_TYPE):
+    """Get the shared model registry created at startup"""
+    return context.bot_data["registry"]
+
+def chat_lock(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> asyncio.Lock:
+    """Per-chat lock, so a chat's replies are sent in the order it asked"""
+    locks = context.bot_data.setdefault("chat_locks", weakref.WeakValueDictionary())
+    lock = locks.get(chat_id)
+    if lock is None:
+        lock = locks[chat_id] = asyncio.Lock()
+    return lock
+
+async def loading_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ask users to wait while the models load; /start and /help work right away"""
+    if get_registry(context).ready.is_set():
+        return
+    message = update.effective_message
+    if update.callback_query is not None:
+        await update.callback_query.answer("⏳ Бот запускается, повторите через минуту.")
+    elif message is not None:
+        command = (message.text or "").split("@")[0].split()[:1]
+        if command in (["/start"], ["/help"]):
+            return
+        await message.reply_text("⏳ Бот запускается и загружает модели. Повторите запрос через минуту.")
+    raise ApplicationHandlerStop
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user_id = update.effective_user.id
@@ -23,6 +57,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Приветственное сообщение\n"
         "/help - Инструкция по использованию\n"
         "/status - Проверка состояния системы\n"
+        "/reset - Очистить историю диалога\n"
     )
     
     # Add admin commands if user is admin
@@ -30,7 +65,11 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         welcome_text += (
             "\n⚙️ Команды администратора:\n"
             "/upload_base - Загрузить базу знаний\n"
-            "/reset - Очистить память и перезагрузить базу\n"
+            "/reset kb - Очистить базу знаний\n"
+            "/rebuild - Пересобрать базу знаний без простоя\n"
+            "/rollback - Вернуть предыдущую версию базы\n"
+            "/reload - Перезагрузить модели без перезапуска\n"
+            "/cancel <id> - Отменить обработку загруженного файла\n"
         )
     
     keyboard = [
@@ -53,7 +92,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "1. Загрузите базу знаний (только для администраторов)\n"
         "2. Задавайте вопросы в естественной форме\n"
         "3. Я найду наиболее релевантную информацию\n"
-        "4. Используйте кнопки для быстрого доступа к функциям\n\n"
+        "4. Уточняющие вопросы («а сколько стоит?») задавайте следом — я помню предыдущий вопрос\n"
+        "5. /reset очищает историю диалога\n"
+        "6. Используйте кнопки для быстрого доступа к функциям\n\n"
         "Поддерживаемые форматы файлов:\n"
         "• .txt - текстовые файлы\n"
         "• .csv - табличные данные\n"
@@ -80,47 +121,234 @@ async def upload_base_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     logger.info(f"Admin {user_id} initiated knowledge base upload")
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /reset command"""
+    """Handle /reset command: forget this chat's conversation; /reset kb clears the knowledge base"""
     user_id = update.effective_user.id
     
+    if not context.args or context.args[0].lower() not in ("kb", "base"):
+        await clear_conversation(context, update.effective_chat.id)
+        await update.message.reply_text("🧹 История диалога очищена. Следующий вопрос я рассмотрю отдельно.")
+        logger.info(f"User {user_id} cleared the conversation in chat {update.effective_chat.id}")
+        return
+    
     if not is_admin(user_id):
         await update.message.reply_text("❌ Эта команда доступна только администраторам.")
         return
     
-    # Import here to avoid circular imports
-    from uploader import KnowledgeBaseManager
-    
-    kb_manager = KnowledgeBaseManager()
-    success = kb_manager.reset_knowledge_base()
+    kb_manager = get_registry(context).kb_manager
+    success = await asyncio.to_thread(kb_manager.reset_knowledge_base)
     
     if success:
-        await update.message.reply_text("✅ Память очищена. База знаний перезагружена.")
+        await update.message.reply_text(
+            "✅ База знаний очищена.\n"
+            "Предыдущая версия доступна через /rollback"
+        )
         logger.info(f"Admin {user_id} reset the knowledge base")
     else:
         await update.message.reply_text("❌ Ошибка при очистке памяти.")
 
+async def clear_conversation(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    """Forget a chat's previous questions, so the next one is not taken as a follow-up"""
+    sessions = context.bot_data.get("sessions")
+    if sessions is not None:
+        await asyncio.to_thread(sessions.clear, chat_id)
+
+async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /reload command"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return
+    
+    await update.message.reply_text("🔄 Перезагружаю модели...")
+    
+    try:
+        # Rebuild off the event loop; handlers keep using the old models meanwhile
+        await asyncio.to_thread(get_registry(context).reload)
+        inference = context.bot_data.get("inference")
+        if inference is not None:
+            # Workers hold forked copies of the old models
+            await asyncio.to_thread(inference.restart)
+        await update.message.reply_text("✅ Модели перезагружены.")
+        logger.info(f"Admin {user_id} reloaded models")
+    except Exception as e:
+        logger.error(f"Error reloading models: {e}")
+        await update.message.reply_text("❌ Ошибка при перезагрузке моделей.")
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /cancel <job_id> command"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Использование: /cancel <id задачи>")
+        return
+    
+    job_id = context.args[0]
+    if context.bot_data["ingestion"].cancel(job_id):
+        await update.message.reply_text(f"🛑 Задача {job_id} отменяется.")
+    else:
+        await update.message.reply_text(f"❌ Активная задача {job_id} не найдена.")
+
+async def rebuild_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /rebuild command"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return
+    
+    status_message = await update.message.reply_text(
+        "🔄 Пересобираю базу знаний в новой версии. Текущая версия продолжает отвечать."
+    )
+    
+    # Queries keep hitting the current snapshot until the new one is swapped in
+    kb_manager = get_registry(context).kb_manager
+    # With inference workers the bot process must not run torch: its threads would not survive their next fork
+    embed_fn = context.bot_data["ingestion"].embed if config.INFERENCE_WORKERS > 0 else None
+    result = await asyncio.to_thread(kb_manager.rebuild_knowledge_base, embed_fn=embed_fn)
+    
+    if result["success"]:
+        await status_message.edit_text(
+            f"✅ База знаний пересобрана и опубликована.\n"
+            f"🏷 Версия: {result['version']}\n"
+            f"📄 Файлов: {result['files']}\n"
+            f"🔢 Чанков: {result['chunks_created']}"
+        )
+        logger.info(f"Admin {user_id} rebuilt the knowledge base into {result['version']}")
+    else:
+        await status_message.edit_text(f"❌ Ошибка при пересборке базы: {result['error']}")
+
+async def rollback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /rollback command"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return
+    
+    kb_manager = get_registry(context).kb_manager
+    version = await asyncio.to_thread(kb_manager.rollback_knowledge_base)
+    
+    if version:
+        await update.message.reply_text(f"⏪ Восстановлена предыдущая версия базы знаний: {version}")
+        logger.info(f"Admin {user_id} rolled the knowledge base back to {version}")
+    else:
+        await update.message.reply_text("❌ Нет предыдущей версии для восстановления.")
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command"""
     user_id = update.effective_user.id
     
-    # Get system info
+    # Everything below is read from in-memory counters; no model or index work
     memory = psutil.virtual_memory()
     disk = psutil.disk_usage('/')
-    
-    # Get knowledge base info
-    from uploader import KnowledgeBaseManager
-    kb_manager = KnowledgeBaseManager()
-    kb_info = kb_manager.get_knowledge_base_info()
+    registry = get_registry(context)
+    kb_info = registry.kb_manager.get_knowledge_base_info()
+    rss = metrics.REGISTRY.gauge("process_resident_memory_bytes").get("", 0)
     
     status_text = (
         "📊 Статус системы:\n\n"
-        f"💾 Использование RAM: {memory.percent}%\n"
+        f"💾 Использование RAM: {memory.percent}% (бот {rss / 1024 / 1024:.0f} МБ)\n"
         f"💿 Использование диска: {disk.percent}%\n"
         f"🔢 Загружено документов: {kb_info['document_count']}\n"
         f"📝 Общее количество чанков: {kb_info['chunk_count']}\n"
         f"📅 Последнее обновление: {kb_info['last_update']}\n"
+        f"🏷 Версия базы: {kb_info['version']}\n"
     )
     
+    answers = {source: metrics.REGISTRY.value("bot_answers_total", source=source)
+               for source in ("qa", "cache_exact", "cache_semantic", "fallback")}
+    status_text += (
+        f"\n💬 Сообщений: {metrics.REGISTRY.value('bot_messages_total'):.0f} "
+        f"(ошибок {metrics.REGISTRY.value('bot_messages_total', outcome='error'):.0f})\n"
+        f"• ответов QA: {answers['qa']:.0f}, "
+        f"из кэша: {answers['cache_exact'] + answers['cache_semantic']:.0f}, "
+        f"без ответа: {answers['fallback']:.0f}\n"
+        f"• отклонено: лимит {metrics.REGISTRY.value('scheduler_shed_total', reason='rate_limited'):.0f}, "
+        f"перегрузка {metrics.REGISTRY.value('scheduler_shed_total', reason='busy'):.0f}, "
+        f"таймаут {metrics.REGISTRY.value('scheduler_shed_total', reason='deadline'):.0f}\n"
+    )
+    
+    def stage_lines(name: str, label: str) -> str:
+        lines = ""
+        for labels in sorted(metrics.REGISTRY.series(name), key=lambda labels: labels[label]):
+            p50 = metrics.REGISTRY.quantile(name, 0.50, **labels)
+            p95 = metrics.REGISTRY.quantile(name, 0.95, **labels)
+            lines += f"• {labels[label]}: p50 {p50 * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс\n"
+        return lines or "• —\n"
+    
+    status_text += "\n⚡ Время ответа:\n" + stage_lines("reply_latency_seconds", "phase")
+    status_text += (
+        f"• дополнено ответом QA: {metrics.REGISTRY.value('progressive_edits_total', outcome='edited'):.0f}, "
+        f"не уложилось в бюджет: {metrics.REGISTRY.value('progressive_edits_total', outcome='budget_exceeded'):.0f}\n"
+    )
+    status_text += "\n⏱ Этапы ответа:\n" + stage_lines("query_stage_seconds", "stage")
+    status_text += "\n📥 Этапы загрузки:\n" + stage_lines("ingest_stage_seconds", "stage")
+    status_text += "\n📤 Telegram API:\n" + stage_lines("telegram_request_seconds", "method")
+    
+    queues = metrics.REGISTRY.gauge("queue_depth")
+    if queues:
+        status_text += "\n📬 Очереди: " + ", ".join(f"{name} {depth:.0f}" for name, depth in queues.items()) + "\n"
+    
+    # Counted where the lookups and batches run, so forked inference workers are included
+    inference = context.bot_data.get("inference")
+    if registry.query_cache is not None:
+        lookups = {result: metrics.REGISTRY.value("query_cache_lookups_total", result=result)
+                   for result in ("exact", "semantic", "miss")}
+        total = sum(lookups.values())
+        # The workers' caches cannot be counted from here
+        entries = f"{registry.query_cache.stats()['entries']} записей, " if inference is None else ""
+        status_text += (
+            f"\n🗂 Кэш запросов: {entries}"
+            f"попаданий {(lookups['exact'] + lookups['semantic']) / total if total else 0:.0%} "
+            f"(точных {lookups['exact']:.0f}, похожих {lookups['semantic']:.0f}, "
+            f"промахов {lookups['miss']:.0f})\n"
+        )
+    
+    status_text += "\n⚡ Батчинг:\n"
+    sizes = {}
+    for labels in metrics.REGISTRY.series("batches_total"):
+        sizes.setdefault(labels["batcher"], {})[int(labels["size"])] = metrics.REGISTRY.value("batches_total", **labels)
+    for name, histogram in sorted(sizes.items()):
+        batches = sum(histogram.values())
+        p50 = metrics.REGISTRY.quantile("batch_latency_seconds", 0.50, batcher=name) or 0.0
+        p99 = metrics.REGISTRY.quantile("batch_latency_seconds", 0.99, batcher=name) or 0.0
+        status_text += (
+            f"• {name}: батч {sum(size * n for size, n in histogram.items()) / batches:.1f}, "
+            f"p50 {p50 * 1000:.0f} мс, p99 {p99 * 1000:.0f} мс\n"
+            f"  размеры: {' '.join(f'{size}:{n:.0f}' for size, n in sorted(histogram.items()))}\n"
+        )
+    if not sizes:
+        status_text += "• —\n"
+    
+    model_stats = registry.stats()
+    if model_stats:
+        status_text += "\n🧠 Модели:\n"
+        for name, stats in model_stats.items():
+            status_text += (
+                f"• {name}: загрузка {stats['load_time']:.1f} с, "
+                f"{stats['rss_mb']:.0f} МБ, с {stats['loaded_at']}\n"
+            )
+    
+    sessions = context.bot_data.get("sessions")
+    if sessions is not None:
+        stats = sessions.stats()
+        status_text += (
+            f"\n🗂 Диалоги: {stats['chats']} в памяти ({stats['memory_mb']:.1f} МБ), "
+            f"{stats['spilled']} на диске, уточнений: {metrics.REGISTRY.value('session_followups_total'):.0f}\n"
+        )
+    
+    if inference is not None:
+        stats = inference.stats()
+        status_text += (
+            f"\n🧵 Процессы ответов: {stats['alive']}/{stats['workers']}, "
+            f"в очереди {sum(stats['queued'])}, p50 {stats['p50_ms']:.0f} мс, p99 {stats['p99_ms']:.0f} мс\n"
+        )
+    
     await update.message.reply_text(status_text)
     logger.info(f"User {user_id} requested status")
 
@@ -131,15 +359,80 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     logger.info(f"User {user_id} sent message: {user_message}")
     
-    # Process message with AI engine
-    from ai_engine.dp_model import DeepPavlovEngine
-    ai_engine = DeepPavlovEngine()
+    # Past this point the user has most likely given up waiting
+    deadline = time.monotonic() + config.REQUEST_DEADLINE
+    scheduler = context.bot_data.get("scheduler")
+    if scheduler is not None:
+        retry_after = scheduler.admit(user_id)
+        if retry_after:
+            metrics.inc("bot_messages_total", outcome="rate_limited")
+            await update.message.reply_text(
+                f"⏳ Слишком много запросов. Повторите через {math.ceil(retry_after)} с."
+            )
+            return
+    
+    # Retrieve context from the knowledge base and answer with the QA model
+    inference = context.bot_data.get("inference")
+    pipeline = get_registry(context).pipeline if inference is None else None
+    sessions = context.bot_data.get("sessions")
+    chat_id = update.effective_chat.id
+    received = time.perf_counter()
+    
+    async def run(method: str, *args):
+        def call():
+            if inference is not None:
+                return inference.answer(chat_id, (method, args))
+            # Off the event loop, so concurrent messages can share a model batch
+            return asyncio.to_thread(getattr(pipeline, method), *args)
+        if scheduler is not None:
+            return await scheduler.run(call, scheduler.priority_for(user_id), deadline)
+        return await call()
+    
+    def replied(*phases: str):
+        for phase in phases:
+            metrics.observe("reply_latency_seconds", time.perf_counter() - received, phase=phase)
     
     try:
-        response = ai_engine.process_query(user_message)
-        await update.message.reply_text(response)
+        # Updates run concurrently; the lock is taken before the first await, in arrival order
+        async with chat_lock(context, chat_id):
+            # Read under the lock, so it is the turn this chat asked just before; may load a spilled chat
+            previous = await asyncio.to_thread(sessions.last_turn, chat_id) if sessions is not None else None
+            retrieval = await run("retrieve", user_message, previous)
+            if sessions is not None:
+                await asyncio.to_thread(sessions.record, chat_id, Turn.from_retrieval(retrieval))
+            
+            if retrieval.answer is not None:
+                await update.message.reply_text(retrieval.answer)
+                replied("first_byte", "final_answer")
+            elif not config.PROGRESSIVE_REPLIES:
+                await update.message.reply_text(await run("finish", retrieval))
+                replied("first_byte", "final_answer")
+            else:
+                # The best passage now, the extracted answer edited in once QA is done
+                message = await update.message.reply_text(
+                    f"📄 Из базы знаний:\n\n{AnswerPipeline.preview(retrieval)}"
+                )
+                replied("first_byte")
+                budget = received + config.QA_LATENCY_BUDGET - time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(run("finish", retrieval), max(0.0, budget))
+                except (asyncio.TimeoutError, DeadlineExceeded, Overloaded):
+                    # The passage stands as the reply; a QA pass already running still fills the cache
+                    metrics.inc("progressive_edits_total", outcome="budget_exceeded")
+                else:
+                    await message.edit_text(response)
+                    replied("final_answer")
+                    metrics.inc("progressive_edits_total", outcome="edited")
+        metrics.inc("bot_messages_total", outcome="ok")
+    except Overloaded:
+        metrics.inc("bot_messages_total", outcome="busy")
+        await update.message.reply_text("⏳ Сейчас слишком много запросов. Повторите вопрос через минуту.")
+    except DeadlineExceeded:
+        metrics.inc("bot_messages_total", outcome="expired")
+        await update.message.reply_text("⌛ Запрос не успел обработаться вовремя. Пожалуйста, задайте его ещё раз.")
     except Exception as e:
         logger.error(f"Error processing message: {e}")
+        metrics.inc("bot_messages_total", outcome="error")
         await update.message.reply_text("❌ Произошла ошибка при обработке запроса. Попробуйте позже.")
 
 async def handle_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -167,29 +460,23 @@ async def handle_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text(f"❌ Размер файла превышает {config.MAX_FILE_SIZE // 1024 // 1024} МБ")
         return
     
-    # Download and process file
-    from uploader import KnowledgeBaseManager
-    
-    kb_manager = KnowledgeBaseManager()
+    # Download file and hand it to the background ingestion queue
+    ingestion = context.bot_data["ingestion"]
     
     try:
         # Download file
         file = await document.get_file()
-        file_path = os.path.join(config.KNOWLEDGE_BASE_DIR, file_name)
+        file_path = os.path.join(get_registry(context).kb_manager.files_dir, file_name)
         await file.download_to_drive(file_path)
         
-        # Process file
-        await update.message.reply_text("🔄 Обрабатываю файл...")
-        result = kb_manager.process_uploaded_file(file_path)
-        
-        if result["success"]:
-            await update.message.reply_text(
-                f"✅ Файл успешно обработан!\n"
-                f"📄 Документов: {result['documents_processed']}\n"
-                f"🔢 Чанков: {result['chunks_created']}"
-            )
-        else:
-            await update.message.reply_text(f"❌ Ошибка при обработке файла: {result['error']}")
+        # Progress is reported by editing this message
+        status_message = await update.message.reply_text("🔄 Файл поставлен в очередь на обработку...")
+        job_id = ingestion.submit(file_path, status_message.chat_id, status_message.message_id, user_id)
+        await status_message.edit_text(
+            f"🔄 Файл поставлен в очередь на обработку.\n"
+            f"🆔 Задача: {job_id}\n"
+            f"Отмена: /cancel {job_id}"
+        )
             
     except Exception as e:
         logger.error(f"Error processing uploaded file: {e}")
@@ -216,10 +503,5 @@ async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text("💭 Задайте ваш вопрос в виде обычного сообщения.")
     
     elif action == "restart":
-        if is_admin(user_id):
-            from uploader import KnowledgeBaseManager
-            kb_manager = KnowledgeBaseManager()
-            kb_manager.reset_knowledge_base()
-            await query.edit_message_text("✅ Система перезапущена. Память очищена.")
-        else:
-            await query.edit_message_text("❌ Эта функция доступна только администраторам.")
+        await clear_conversation(context, query.message.chat_id)
+        await query.edit_message_text("✅ Диалог начат заново. История очищена.")
@@ -0,0 +1,13 @@
+from telegram.request import HTTPXRequest
+
+import metrics
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API call's duration by method"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        # File downloads carry a path instead of a method name
+        api_method = "file" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        with metrics.timer("telegram_request_seconds", method=api_method):
+            return await super().do_request(url, method, *args, **kwargs)
@@ -0,0 +1,357 @@
+"""Bulk-load a directory or a .zip/.tar(.gz) archive into a new knowledge base snapshot
+
+For seeding large corpora outside Telegram: no MAX_FILE_SIZE limit, any
+extension with a registered parser. Files are parsed and chunked in a
+process pool that streams each file's chunks back in bounded batches,
+while this process embeds them in large batches and writes each batch to
+the indexes at once. Finished files are checkpointed,
+so an interrupted run resumes where it stopped when started again with
+the same path. Unless --replace is given, the files of the current KB are
+carried over (their embeddings come from the cache). The snapshot is
+published at the end: inference workers switch to it within
+KB_SYNC_INTERVAL, a single-process bot on /reload.
+
+Usage: python bulk_ingest.py /data/corpus.tar.gz --workers 4 --embed-batch 1024
+       python bulk_ingest.py /data/docs --replace --report-every 30
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from loguru import logger
+
+from config import config
+from ingestion import _produce_batches
+from parsers import PARSERS
+
+
+def source_name(path: str) -> str:
+    """Flat file name for a path inside the corpus, unique within it: docs/faq/a.txt -> docs__faq__a.txt"""
+    return "__".join(part for part in path.replace("\\", "/").split("/") if part not in ("", ".", ".."))
+
+
+def _supported(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in PARSERS
+
+
+def _place(file_path: str, target: str):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(file_path, target)
+    except OSError:
+        shutil.copy2(file_path, target)
+
+
+def iter_corpus(path: str, files_dir: str, skip: Set[str]) -> Iterator[Tuple[str, str]]:
+    """Yield (source, file path) for every parseable file, placed in the snapshot's files_dir
+
+    Archives are read in a single streaming pass, extracting each member as
+    it is reached, so a .tar.gz is never decompressed twice.
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                source = source_name(os.path.relpath(file_path, path))
+                if _supported(name) and source not in skip:
+                    target = os.path.join(files_dir, source)
+                    _place(file_path, target)
+                    yield source, target
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                source = source_name(info.filename)
+                if info.is_dir() or not _supported(info.filename) or source in skip:
+                    continue
+                target = os.path.join(files_dir, source)
+                with archive.open(info) as member, open(target, "wb") as f:
+                    shutil.copyfileobj(member, f, 1 << 20)
+                yield source, target
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, "r|*") as archive:
+            for info in archive:
+                source = source_name(info.name)
+                if not info.isfile() or not _supported(info.name) or source in skip:
+                    continue
+                target = os.path.join(files_dir, source)
+                with archive.extractfile(info) as member, open(target, "wb") as f:
+                    shutil.copyfileobj(member, f, 1 << 20)
+                yield source, target
+    else:
+        raise ValueError(f"{path} is neither a directory nor a .zip/.tar archive")
+
+
+def iter_existing(files_dir: str, target_dir: str, skip: Set[str]) -> Iterator[Tuple[str, str]]:
+    """Source files of the current KB not replaced by the corpus"""
+    for name in sorted(os.listdir(files_dir)):
+        file_path = os.path.join(files_dir, name)
+        if os.path.isfile(file_path) and _supported(name) and name not in skip:
+            target = os.path.join(target_dir, name)
+            _place(file_path, target)
+            yield name, target
+
+
+def _init_worker(backend: str):
+    # Chunk boundaries follow the backend's tokenizer; a spawned worker must use the parent's
+    config.INFERENCE_BACKEND = backend
+
+
+class Checkpoint:
+    """The snapshot being filled and the sources fully written to it, saved atomically"""
+
+    def __init__(self, path: str, corpus: str):
+        self.path = path
+        self.corpus = corpus
+        self.snapshot: Optional[str] = None
+        self.done: Set[str] = set()
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        if state["corpus"] == corpus:
+            self.snapshot = state["snapshot"]
+            self.done = set(state["done"])
+        else:
+            logger.warning(f"Checkpoint {path} is for {state['corpus']}, starting over")
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"corpus": self.corpus, "snapshot": self.snapshot, "done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Throughput:
+    """Running totals for the progress lines"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.embed_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def report(self, **extra) -> dict:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            "files": self.files,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "seconds": round(elapsed, 1),
+            "files_per_s": round(self.files / elapsed, 2),
+            "chunks_per_s": round(self.chunks / elapsed, 1),
+            "mb_per_s": round(self.bytes / 1024 / 1024 / elapsed, 2),
+            "embedded": self.embedded,
+            # Embedding model speed on its own, and how much of the run it took
+            "embed_chunks_per_s": round(self.embedded / self.embed_seconds, 1) if self.embed_seconds else None,
+            "embed_share": round(self.embed_seconds / elapsed, 2),
+            "index_write_share": round((self.write_seconds - self.embed_seconds) / elapsed, 2),
+            **extra,
+        }
+
+
+def ingest(args) -> dict:
+    from uploader import KnowledgeBaseManager
+
+    kb_manager = KnowledgeBaseManager()
+    snapshots = kb_manager.snapshots
+    checkpoint = Checkpoint(args.checkpoint, os.path.abspath(args.path))
+    if checkpoint.snapshot and os.path.isdir(os.path.join(snapshots.root, checkpoint.snapshot)):
+        snapshot = snapshots.open(checkpoint.snapshot)
+        logger.info(f"Resuming into snapshot {snapshot.name}: {len(checkpoint.done)} files already done")
+    else:
+        snapshot = snapshots.create(staging=True)
+        checkpoint.snapshot, checkpoint.done = snapshot.name, set()
+        checkpoint.save()
+
+    stats = Throughput()
+    produced: Set[str] = set()
+
+    def sources() -> Iterator[Tuple[str, str]]:
+        for source, file_path in iter_corpus(args.path, snapshot.files_dir, checkpoint.done):
+            produced.add(source)
+            yield source, file_path
+        if not args.replace:
+            yield from iter_existing(kb_manager.files_dir, snapshot.files_dir, checkpoint.done | produced)
+
+    def embed(documents: List[str]) -> np.ndarray:
+        started = time.perf_counter()
+        vectors = kb_manager._encode_documents(documents)
+        stats.embed_seconds += time.perf_counter() - started
+        stats.embedded += len(documents)
+        return vectors
+
+    # Per source: chunks received, chunks buffered but not yet written, IDs of every chunk seen
+    chunk_counts: Dict[str, int] = {}
+    remaining: Dict[str, int] = {}
+    seen: Dict[str, Set[str]] = {}
+    parsed: Set[str] = set()
+    buffer: List[Tuple[str, int, str]] = []
+
+    def finish(source: str):
+        kb_manager.finalize_source(source, seen.pop(source, set()), snapshot, persist=False)
+        remaining.pop(source, None)
+        parsed.discard(source)
+        checkpoint.done.add(source)
+        stats.files += 1
+
+    def discard(source: str):
+        # Chunks written before the parser failed must not outlive the file
+        buffer[:] = [item for item in buffer if item[0] != source]
+        chunk_counts.pop(source, None)
+        remaining.pop(source, None)
+        seen.pop(source, None)
+        kb_manager.finalize_source(source, set(), snapshot, persist=False)
+
+    def flush(limit: int):
+        while buffer and len(buffer) >= limit:
+            batch = buffer[:args.embed_batch]
+            del buffer[:args.embed_batch]
+            started = time.perf_counter()
+            kb_manager.add_chunks(batch, embed, snapshot)
+            stats.write_seconds += time.perf_counter() - started
+            stats.chunks += len(batch)
+            for source, _, _ in batch:
+                remaining[source] -= 1
+            for source in {source for source, _, _ in batch}:
+                if not remaining[source] and source in parsed:
+                    finish(source)
+
+    def next_batch(batches, future) -> Optional[List[str]]:
+        while True:
+            try:
+                return batches.get(True, 0.5)
+            except queue.Empty:
+                if future.done():
+                    # Raises the parser's error; otherwise it ended without its None
+                    future.result()
+                    raise RuntimeError("Parser stopped before the end of the file")
+
+    def save_checkpoint():
+        # Done sources are only recorded once the indexes holding them are on disk
+        snapshot.store.persist()
+        snapshot.bm25.persist()
+        checkpoint.save()
+
+    context = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        # spawn: this process holds the embedding model's threads
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(config.INFERENCE_BACKEND,),
+    )
+    # Queues a pool task can be handed
+    manager = context.Manager()
+    stop = manager.Event()
+    in_flight = deque()
+    pending = sources()
+    last_report = last_checkpoint = time.monotonic()
+    published = False
+    try:
+        while True:
+            # Keep the parsers a few files ahead of the embedder. Each streams its chunks
+            # through a queue of two batches, so no file is ever held whole in either process
+            while len(in_flight) < args.workers * 2:
+                item = next(pending, None)
+                if item is None:
+                    break
+                source, file_path = item
+                batches = manager.Queue(maxsize=2)
+                future = pool.submit(_produce_batches, file_path, args.embed_batch, batches, stop)
+                in_flight.append((source, os.path.getsize(file_path), batches, future))
+            if not in_flight:
+                break
+
+            # Files are consumed in order: the oldest one's parser is always running
+            source, size, batches, future = in_flight[0]
+            try:
+                chunks = next_batch(batches, future)
+            except Exception as e:
+                in_flight.popleft()
+                logger.error(f"Skipping {source}: {e}")
+                discard(source)
+                stats.failed += 1
+                continue
+
+            if chunks is None:
+                in_flight.popleft()
+                stats.bytes += size
+                parsed.add(source)
+                if not chunk_counts.pop(source, 0):
+                    logger.warning(f"No documents extracted from {source}")
+                if not remaining.get(source):
+                    finish(source)
+            else:
+                start = chunk_counts.get(source, 0)
+                chunk_counts[source] = start + len(chunks)
+                seen.setdefault(source, set()).update(
+                    kb_manager._generate_document_id(f"{source}:{kb_manager._content_hash(chunk)}") for chunk in chunks
+                )
+                remaining[source] = remaining.get(source, 0) + len(chunks)
+                buffer.extend((source, start + index, chunk) for index, chunk in enumerate(chunks))
+                flush(args.embed_batch)
+
+            if time.monotonic() - last_report >= args.report_every:
+                last_report = time.monotonic()
+                print(json.dumps(stats.report(in_flight=len(in_flight), buffered=len(buffer))), flush=True)
+            if time.monotonic() - last_checkpoint >= args.checkpoint_every:
+                last_checkpoint = time.monotonic()
+                save_checkpoint()
+
+        flush(1)
+        save_checkpoint()
+        if not checkpoint.done:
+            raise RuntimeError(f"No files with a supported extension ({', '.join(sorted(PARSERS))}) in {args.path}")
+        snapshots.publish(snapshot.name)
+        published = True
+        checkpoint.clear()
+    finally:
+        # Parsers blocked on a full queue give up once stop is set
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        manager.shutdown()
+        if not published:
+            save_checkpoint()
+            logger.warning(f"Stopped before publishing; run again to resume into snapshot {snapshot.name}")
+
+    return stats.report(snapshot=snapshot.name, kb_files=len(checkpoint.done))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="Directory, .zip or .tar/.tar.gz archive")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parse and chunk processes")
+    parser.add_argument("--embed-batch", type=int, default=1024, help="Chunks per embedding call and index write")
+    parser.add_argument("--replace", action="store_true", help="Do not carry over the current KB's files")
+    parser.add_argument("--checkpoint", default=os.path.join(config.DATA_DIR, "bulk_ingest.json"))
+    parser.add_argument("--checkpoint-every", type=float, default=60.0, help="Seconds between checkpoints")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    print(json.dumps({"done": True, **ingest(args)}))
+
+
+if __name__ == "__main__":
+    main()
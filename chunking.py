@@ -0,0 +1,253 @@
+import hashlib
+import math
+import re
+import zlib
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from config import config
+
+# Sentence end: terminal punctuation (plus closing quotes/brackets) before a capitalized
+# word or a digit, or a blank line
+_SENTENCE_END = re.compile(r'[.!?…]+["»”)\]]*(?=\s+["«„(\[]?[A-ZА-ЯЁ0-9])|\n\s*\n')
+_ABBREVIATIONS = {
+    "т.е.", "т.д.", "т.п.", "т.к.", "т.н.", "др.", "пр.", "см.", "напр.", "рис.", "табл.", "стр.",
+    "г.", "гг.", "в.", "вв.", "ул.", "д.", "кв.", "им.", "руб.", "коп.", "тыс.", "млн.", "млрд.",
+    "проф.", "акад.", "доц.", "н.э.", "и.о.", "тел.", "ст.", "п.", "пп.", "ч.",
+}
+_INITIAL = re.compile(r"^[А-ЯЁA-Z]\.$")
+_NUMBER = re.compile(r"\S*\d\S*")
+# Mersenne prime for the MinHash permutations; products stay below 2**62
+_PRIME = (1 << 31) - 1
+_MAX_BUCKET_CHECKS = 32
+
+
+def _is_abbreviation(sentence: str) -> bool:
+    words = sentence.split()
+    if not words:
+        return False
+    last = words[-1].lower().lstrip("(«\"")
+    return last in _ABBREVIATIONS or bool(_INITIAL.match(words[-1]))
+
+
+def split_sentences(text: str) -> Iterator[str]:
+    """Split Russian text into sentences, keeping abbreviations and initials intact"""
+    start, pending = 0, ""
+    for match in _SENTENCE_END.finditer(text):
+        sentence = pending + text[start:match.end()]
+        start = match.end()
+        if _is_abbreviation(sentence) and not match.group().startswith("\n"):
+            pending = sentence
+            continue
+        pending = ""
+        sentence = " ".join(sentence.split())
+        if sentence:
+            yield sentence
+    sentence = " ".join((pending + text[start:]).split())
+    if sentence:
+        yield sentence
+
+
+def iter_sentences(records: Iterable[str]) -> Iterator[str]:
+    """Flatten parser records into sentences"""
+    for record in records:
+        yield from split_sentences(record)
+
+
+@lru_cache(maxsize=1)
+def _tokenizer():
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(config.EMBEDDING_MODEL)
+
+
+@lru_cache(maxsize=config.CHUNK_TOKEN_CACHE_SIZE)
+def _word_tokens(word: str) -> int:
+    return len(_tokenizer().tokenize(word))
+
+
+def count_tokens(text: str) -> int:
+    """Exact token count for the embedding model's tokenizer, excluding special tokens
+
+    Both SentencePiece and WordPiece pre-split on whitespace, so the count
+    is the sum over words; per-word counts are memoized.
+    """
+    if config.INFERENCE_BACKEND == "hashing":
+        # No model tokenizer to match: the conservative per-word estimate
+        return math.ceil(len(text.split()) * config.QA_TOKENS_PER_WORD)
+    return sum(_word_tokens(word) for word in text.split())
+
+
+def _fit(sentence: str, max_tokens: int, count: Callable[[str], int]) -> Iterator[Tuple[str, int]]:
+    """Yield the sentence whole, or split at word boundaries when it exceeds max_tokens"""
+    tokens = count(sentence)
+    if tokens <= max_tokens:
+        yield sentence, tokens
+        return
+    words: List[str] = []
+    total = 0
+    for word in sentence.split():
+        word_tokens = count(word)
+        if words and total + word_tokens > max_tokens:
+            yield " ".join(words), total
+            words, total = [], 0
+        words.append(word)
+        total += word_tokens
+    if words:
+        yield " ".join(words), total
+
+
+def iter_token_chunks(sentences: Iterable[str], max_tokens: int = config.CHUNK_MAX_TOKENS,
+                      overlap_tokens: int = config.CHUNK_OVERLAP_TOKENS,
+                      count: Optional[Callable[[str], int]] = None) -> Iterator[str]:
+    """Pack whole sentences into chunks of at most max_tokens model tokens
+
+    Consecutive chunks share trailing sentences worth up to overlap_tokens.
+    Only the current window of sentences is kept in memory.
+    """
+    count = count or count_tokens
+    window: Deque[Tuple[str, int]] = deque()
+    total = 0
+    # Sentences in the window not yet part of an emitted chunk
+    fresh = 0
+    for sentence in sentences:
+        for piece, tokens in _fit(sentence, max_tokens, count):
+            if fresh and total + tokens > max_tokens:
+                yield " ".join(text for text, _ in window)
+                fresh = 0
+                while window and (total > overlap_tokens or total + tokens > max_tokens):
+                    total -= window.popleft()[1]
+            window.append((piece, tokens))
+            total += tokens
+            fresh += 1
+    if fresh:
+        yield " ".join(text for text, _ in window)
+
+
+class NearDuplicateFilter:
+    """MinHash signatures over word shingles, indexed with LSH banding
+
+    A text is a near-duplicate when one of the last window texts kept
+    shares at least one band of its signature and their estimated Jaccard
+    similarity reaches threshold. Hashing is seeded, so re-running an
+    ingestion keeps the same texts.
+
+    Memory stays bounded however long the stream: older signatures are
+    forgotten, so a repeat further back than window kept texts is kept
+    again. Boilerplate (headers, disclaimers, signatures) recurs every few
+    pages and stays well within it.
+
+    With match_numbers, texts are only compared with texts holding the same
+    numbers in the same order: table rows that differ in a code, a price or
+    a date are never duplicates, however similar the rest of the row.
+    """
+
+    def __init__(self, num_perm: int = config.DEDUP_NUM_PERM, bands: int = config.DEDUP_BANDS,
+                 threshold: float = config.DEDUP_THRESHOLD, shingle_size: int = config.DEDUP_SHINGLE_SIZE,
+                 window: int = config.DEDUP_WINDOW, match_numbers: bool = False, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.window = window
+        self.match_numbers = match_numbers
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        # Signature and bucket key prefix of the last window texts kept, by number;
+        # _first is the oldest one's
+        self._signatures: Dict[int, Tuple[np.ndarray, bytes]] = {}
+        self._first = 0
+        self._next = 0
+        self.duplicates = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        words = text.lower().replace("ё", "е").split()
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) % _PRIME for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def _keys(self, signature: np.ndarray, prefix: bytes) -> List[bytes]:
+        return [prefix + signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(len(self._buckets))]
+
+    def is_duplicate(self, text: str) -> bool:
+        """Check text against the recent texts kept and remember it when new"""
+        signature = self.signature(text)
+        # Texts with other numbers land in other buckets and are never candidates
+        prefix = b""
+        if self.match_numbers:
+            prefix = hashlib.blake2b(" ".join(_NUMBER.findall(text)).encode(), digest_size=8).digest()
+        keys = self._keys(signature, prefix)
+        checked = set()
+        for buckets, key in zip(self._buckets, keys):
+            # A crowded bucket keeps only its newest entries, bounding the work per text
+            for candidate in reversed(buckets.get(key, ())):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if (self._signatures[candidate][0] == signature).mean() >= self.threshold:
+                    self.duplicates += 1
+                    return True
+
+        self._signatures[self._next] = signature, prefix
+        for buckets, key in zip(self._buckets, keys):
+            bucket = buckets.setdefault(key, [])
+            bucket.append(self._next)
+            if len(bucket) > _MAX_BUCKET_CHECKS:
+                del bucket[0]
+        self._next += 1
+        if len(self._signatures) > self.window:
+            self._forget_oldest()
+        return False
+
+    def _forget_oldest(self):
+        # Numbers only grow, so the oldest text heads each of its buckets it was not trimmed from
+        for buckets, key in zip(self._buckets, self._keys(*self._signatures.pop(self._first))):
+            bucket = buckets.get(key)
+            if bucket and bucket[0] == self._first:
+                del bucket[0]
+                if not bucket:
+                    del buckets[key]
+        self._first += 1
+
+
+def dedupe(texts: Iterable[str], duplicate_filter: Optional[NearDuplicateFilter] = None,
+           min_words: int = config.DEDUP_MIN_WORDS) -> Iterator[str]:
+    """Drop texts that near-duplicate one of the last window texts kept from the same stream
+
+    Texts shorter than min_words always pass: short repeats ("Да.", a
+    bare value) are usually content, not boilerplate.
+    """
+    duplicate_filter = duplicate_filter or NearDuplicateFilter()
+    for text in texts:
+        if len(text.split()) < min_words or not duplicate_filter.is_duplicate(text):
+            yield text
+    if duplicate_filter.duplicates:
+        logger.info(f"Skipped {duplicate_filter.duplicates} near-duplicate texts")
+
+
+def dedupe_exact(texts: Iterable[str], window: int = config.DEDUP_WINDOW) -> Iterator[str]:
+    """Drop texts identical to one of the last window texts kept; only a digest of each is kept"""
+    seen = set()
+    recent: Deque[bytes] = deque()
+    duplicates = 0
+    for text in texts:
+        digest = hashlib.blake2b(" ".join(text.split()).encode(), digest_size=16).digest()
+        if digest in seen:
+            duplicates += 1
+            continue
+        seen.add(digest)
+        recent.append(digest)
+        if len(recent) > window:
+            seen.discard(recent.popleft())
+        yield text
+    if duplicates:
+        logger.info(f"Skipped {duplicates} duplicate records")
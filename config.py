@@ -6,27 +6,173 @@ class Config:
     # Telegram Bot Configuration
     BOT_TOKEN = "8220943151:AAEn4NUhoRU4GiTduA13DZffhlet0OjW8JE"
     ADMIN_IDS = [1206716741, 7807660296, 6910167987, 495779404]
+    TELEGRAM_API_URL = "https://api.telegram.org/bot"  # point at benchmarks/fake_telegram.py for offline load tests
+    
+    # Update Delivery
+    RUN_MODE = "polling"  # "polling" or "webhook"
+    WEBHOOK_LISTEN = "0.0.0.0"
+    WEBHOOK_PORT = 8443
+    WEBHOOK_PATH = "telegram"
+    WEBHOOK_URL = ""  # public URL Telegram posts to, e.g. https://bot.example.com/telegram
+    WEBHOOK_SECRET = ""  # checked against X-Telegram-Bot-Api-Secret-Token
+    
+    # Admission Control
+    RATE_LIMIT_PER_MINUTE = 20  # sustained messages per user; 0 disables rate limiting
+    RATE_LIMIT_BURST = 5  # messages a user may send at once
+    ADMIN_PRIORITY = True  # admins' queries run ahead of everyone else's
+    SCHEDULER_CONCURRENCY = 8  # model jobs running at once
+    SCHEDULER_MAX_QUEUE = 200  # waiting queries before new ones get a "busy" reply
+    REQUEST_DEADLINE = 30.0  # seconds a query may wait before it is dropped unanswered
+    
+    # Progressive Replies
+    PROGRESSIVE_REPLIES = True  # send the best passage at once, then edit the QA answer into it
+    QA_LATENCY_BUDGET = 10.0  # seconds after the question; past it the passage stays as the reply
+    SNIPPET_CHARS = 400  # length of the passage sent first
+    
+    # Inference Workers
+    INFERENCE_WORKERS = 0  # forked answer processes; 0 = answer in the bot process
+    KB_SYNC_INTERVAL = 5.0  # seconds between a worker's checks for a newly published KB
     
     # Paths
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     DATA_DIR = os.path.join(BASE_DIR, "data")
     KNOWLEDGE_BASE_DIR = os.path.join(DATA_DIR, "knowledge_base")
     EMBEDDINGS_DB = os.path.join(DATA_DIR, "embeddings.db")
+    JOBS_DB = os.path.join(DATA_DIR, "jobs.db")
+    
+    # KB Snapshots
+    KB_VERSIONS_DIR = os.path.join(DATA_DIR, "kb_versions")
+    KB_KEEP_VERSIONS = 3  # published versions kept on disk for rollback
+    
+    # Metrics
+    METRICS_HOST = "127.0.0.1"
+    METRICS_PORT = 9108  # Prometheus /metrics endpoint; 0 disables it
+    PROFILE_EVERY = 0  # cProfile one retrieve and one QA pass in N; 0 disables profiling
+    PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
     
     # DeepPavlov Configuration
     DEEPPAVLOV_MODEL = "ru_bert"
     MAX_SEQUENCE_LENGTH = 512
     
+    # QA Token Cache
+    QA_TOKENIZER = "DeepPavlov/rubert-base-cased"  # vocabulary of squad_ru_bert
+    QA_TOKENS_DIR = os.path.join(DATA_DIR, "qa_tokens")  # chunk token IDs and offsets, shared by all snapshots
+    QA_TOKENS_HOT_SIZE = 4096  # tokenized chunks kept in RAM
+    QA_MAX_QUERY_TOKENS = 64  # longer questions are cut, so every window fits next to the question
+    QA_MAX_ANSWER_TOKENS = 30  # longest answer span
+    
+    # Model Registry
+    WARMUP_ON_STARTUP = True
+    WARMUP_QUERY = "Что находится в базе знаний?"
+    
+    # Startup
+    BACKGROUND_MODEL_LOADING = True  # start answering /start and /help while the models load; not with INFERENCE_WORKERS
+    MODEL_MANIFEST = os.path.join(DATA_DIR, "model_manifest.json")  # checksums of downloaded model files
+    MODELS_OFFLINE = False  # never download; fail if model files are missing or differ from the manifest
+    
+    # Embeddings
+    EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    
+    # Inference Backend
+    INFERENCE_BACKEND = "torch"  # "torch" (fp32), "int8" (dynamic quantization), "onnx" (ONNX Runtime int8) or "hashing" (model-free, for benchmarks)
+    INFERENCE_THREADS = 0  # intra-op threads per model; 0 = one per physical core
+    INFERENCE_INTEROP_THREADS = 1
+    OPTIMIZED_MODELS_DIR = os.path.join(DATA_DIR, "optimized_models")
+    
     # GoMLX Configuration
     GOMLX_HOST = "localhost"
     GOMLX_PORT = 8080
+    GOMLX_BATCH_SIZE = 64  # texts per /embed request
+    GOMLX_MAX_CONCURRENCY = 8  # in-flight requests per client
+    GOMLX_MAX_RETRIES = 3
+    GOMLX_TIMEOUT = 10  # seconds
+    GOMLX_BREAKER_THRESHOLD = 5  # consecutive failures before the circuit opens
+    GOMLX_BREAKER_RESET = 30  # seconds before an open circuit is probed via /health
     
     # File Upload Settings
     MAX_FILE_SIZE = 20 * 1024 * 1024  # 20 MB
     ALLOWED_EXTENSIONS = {'.txt', '.csv', '.json'}
     
+    # Background Ingestion
+    INGEST_WORKERS = 2
+    INGEST_BATCH_SIZE = 64
+    INGEST_PROGRESS_INTERVAL = 2.0  # seconds between status message edits
+    
+    # Streaming Parsers
+    PARSER_BLOCK_SIZE = 64 * 1024  # characters read per TXT/JSON block
+    CSV_CHUNK_ROWS = 10000
+    
+    # Chunking
+    CHUNK_MAX_TOKENS = 126  # MiniLM truncates at 128 tokens including the two special tokens
+    CHUNK_OVERLAP_TOKENS = 24
+    CHUNK_TOKEN_CACHE_SIZE = 200000  # memoized per-word token counts
+    DEDUP_ENABLED = True
+    DEDUP_NUM_PERM = 64
+    DEDUP_BANDS = 8  # 8 bands of 8 rows: candidates start near 0.77 Jaccard
+    DEDUP_THRESHOLD = 0.9  # estimated Jaccard similarity of word shingles
+    DEDUP_SHINGLE_SIZE = 3
+    DEDUP_TABULAR_THRESHOLD = 0.95  # CSV rows and JSON records, compared only with those holding the same numbers
+    DEDUP_MIN_WORDS = 6  # shorter sentences are never dropped
+    DEDUP_WINDOW = 10000  # sentences remembered per file, ~2 KB each; repeats further back are kept
+    
+    # Dynamic Micro-Batching
+    BATCH_MAX_SIZE = 32
+    BATCH_MAX_WAIT_MS = 5
+    BATCH_LATENCY_WINDOW = 1000  # requests kept for p50/p99
+    CONCURRENT_UPDATES = 64  # updates PTB may handle at once
+    
+    # Vector Store
+    VECTOR_BACKEND = "chroma"  # "chroma", "faiss" or "compact"
+    EMBEDDING_DIM = 384
+    FAISS_DIR = os.path.join(DATA_DIR, "faiss")
+    FAISS_INDEX_TYPE = "hnsw"  # "flat", "ivf" or "hnsw"
+    FAISS_IVF_NLIST = 1024
+    FAISS_IVF_NPROBE = 16
+    FAISS_IVF_MIN_POINTS_PER_LIST = 39  # IVF falls back to flat until it has this much training data
+    FAISS_HNSW_M = 32
+    FAISS_HNSW_EF_SEARCH = 64
+    FAISS_MAX_TOMBSTONE_RATIO = 0.1  # HNSW is rebuilt once this share of vectors is deleted
+    
+    # Compact Vector Store
+    COMPACT_DIR = os.path.join(DATA_DIR, "compact")
+    COMPACT_DTYPE = "int8"  # hot matrix: "int8" (scaled per row) or "float16" (slower: NumPy casts half in software)
+    COMPACT_RESCORE_FACTOR = 10  # candidates per result re-scored on the float32 vectors
+    COMPACT_SCAN_ROWS = 4096  # rows dequantized per block; small blocks stay in cache
+    COMPACT_MAX_DEAD_RATIO = 0.2  # files are compacted on persist past this share of dead rows
+    
+    # Hybrid BM25 Retrieval
+    HYBRID_SEARCH = True
+    BM25_INDEX_PATH = os.path.join(DATA_DIR, "bm25.idx")
+    BM25_K1 = 1.5
+    BM25_B = 0.75
+    BM25_STEM_CACHE_SIZE = 100000
+    BM25_COMPACT_RATIO = 0.25  # compact postings once this share of documents is deleted
+    BM25_JOURNAL_RATIO = 0.5  # rewrite the whole index once its journal of changes reaches this share of it
+    BM25_MIN_SCORE = 5.0  # lexical hits above this pass the pipeline even below SIMILARITY_THRESHOLD
+    RRF_K = 60
+    HYBRID_CANDIDATES = 20  # candidates taken from each retriever before fusion
+    
+    # Query Cache
+    CACHE_MAX_ENTRIES = 10000
+    CACHE_TTL_SECONDS = 3600
+    CACHE_SEMANTIC_RADIUS = 0.05  # max cosine distance for a near-duplicate hit
+    
+    # Conversation Memory
+    SESSION_MAX_TURNS = 5  # turns remembered per chat
+    SESSION_MAX_MEMORY_MB = 32  # all chats together; the least recently active leave RAM past it
+    SESSION_TTL_SECONDS = 24 * 3600  # chats idle longer are forgotten
+    SESSION_IDLE_SECONDS = 600  # chats idle longer are moved out of RAM; 0 = only past the memory cap
+    SESSION_DB = os.path.join(DATA_DIR, "sessions.db")  # where chats leaving RAM go; "" forgets them
+    SESSION_FOLLOWUP_SECONDS = 300  # a question this soon after the previous one may be a follow-up
+    SESSION_FOLLOWUP_MAX_WORDS = 3  # shorter follow-ups ("а сколько стоит?") reuse the previous chunks
+    SESSION_FOLLOWUP_SIMILARITY = 0.75  # so do questions this close to the previous one
+    
     # Semantic Search
     TOP_K_RESULTS = 3
     SIMILARITY_THRESHOLD = 0.7
+    
+    # Answer Pipeline
+    QA_TOKENS_PER_WORD = 2.0  # conservative WordPiece estimate for Russian
+    QA_WINDOW_OVERLAP = 32  # words shared by consecutive QA windows
 
 config = Config()
@@ -0,0 +1,340 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+import metrics
+from config import config
+from parsers import batched
+
+# Per-process embedding model, loaded once by the pool initializer
+_worker_model = None
+
+
+def _init_worker(backend: str, num_threads: int):
+    """Load the embedding model once in each worker process"""
+    global _worker_model
+    from ai_engine.inference import load_embedding_model
+
+    _worker_model = load_embedding_model(backend, num_threads)
+
+
+def _embed_batch(documents: List[str]) -> np.ndarray:
+    # An ndarray pickles as one buffer back to the parent, unlike a list of floats
+    return np.asarray(_worker_model.encode(documents), dtype=np.float32)
+
+
+def _init_parser(backend: str):
+    # Chunk boundaries follow the backend's tokenizer; a spawned worker must use the parent's
+    config.INFERENCE_BACKEND = backend
+
+
+def _produce_batches(file_path: str, batch_size: int, batches, stop) -> dict:
+    """Parser worker: stream a file's chunk batches into a bounded queue, None when done
+
+    Returns the parse and chunk timings for the parent to merge.
+    """
+    from uploader import iter_documents
+
+    metrics.REGISTRY.drain()
+    for batch in chain(batched(iter_documents(file_path), batch_size), [None]):
+        # The queue is bounded, so parsing stays a few batches ahead of the embedder
+        while True:
+            if stop.is_set():
+                return metrics.REGISTRY.drain()
+            try:
+                batches.put(batch, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+    return metrics.REGISTRY.drain()
+
+
+class JobStore:
+    """SQLite-backed persistent record of ingestion jobs"""
+
+    ACTIVE_STATUSES = ("queued", "running")
+
+    def __init__(self, db_path: str = config.JOBS_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                source TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total_chunks INTEGER,
+                committed_chunks INTEGER NOT NULL DEFAULT 0,
+                chat_id INTEGER,
+                message_id INTEGER,
+                user_id INTEGER,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def create(self, file_path: str, chat_id: int, message_id: int, user_id: int) -> str:
+        job_id = uuid.uuid4().hex[:8]
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, file_path, source, status, chat_id, message_id, user_id, "
+                "created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, file_path, os.path.basename(file_path), chat_id, message_id, user_id, now, now),
+            )
+            self._conn.commit()
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                self.ACTIVE_STATUSES,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class IngestionQueue:
+    """Background ingestion of uploaded files, off the event loop"""
+
+    def __init__(self, registry, max_workers: int = config.INGEST_WORKERS,
+                 batch_size: int = config.INGEST_BATCH_SIZE, scheduler=None):
+        self.registry = registry
+        # Embedding batches queue behind interactive queries when a scheduler is given
+        self.scheduler = scheduler
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.store = JobStore()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._parser: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._cancelled = set()
+        self._bot = None
+
+    def start(self, bot):
+        """Start the consumer and re-enqueue jobs interrupted by a restart"""
+        self._bot = bot
+        threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+        context = multiprocessing.get_context("spawn")
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            # spawn: forking a process that already holds torch threads can deadlock
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(config.INFERENCE_BACKEND, threads),
+        )
+        # Parsing gets its own process: it is CPU-bound and must not hold the bot's GIL,
+        # and a producer blocked on a full queue must not take an embedding worker
+        self._parser = ProcessPoolExecutor(
+            max_workers=1, mp_context=context, initializer=_init_parser, initargs=(config.INFERENCE_BACKEND,),
+        )
+        # Queues a pool task can be handed
+        self._manager = context.Manager()
+        self._queue = asyncio.Queue()
+        for job in self.store.unfinished():
+            logger.info(f"Resuming ingestion job {job['id']} ({job['committed_chunks']} chunks committed)")
+            self._queue.put_nowait(job["id"])
+        self._task = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._parser:
+            self._parser.shutdown(wait=False, cancel_futures=True)
+        if self._manager:
+            self._manager.shutdown()
+
+    def submit(self, file_path: str, chat_id: int, message_id: int, user_id: int) -> str:
+        """Persist a new job and queue it; returns the job ID"""
+        job_id = self.store.create(file_path, chat_id, message_id, user_id)
+        self._queue.put_nowait(job_id)
+        logger.info(f"Queued ingestion job {job_id} for {file_path}")
+        return job_id
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def embed(self, documents: List[str]) -> np.ndarray:
+        """Embed in a pool worker, blocking the calling thread; never call it from the event loop"""
+        if self.scheduler is None:
+            return self._pool.submit(_embed_batch, documents).result()
+        return self.scheduler.run_threadsafe(
+            lambda: asyncio.wrap_future(self._pool.submit(_embed_batch, documents))
+        )
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.store.get(job_id)
+        if not job or job["status"] not in JobStore.ACTIVE_STATUSES:
+            return False
+        self._cancelled.add(job_id)
+        self.store.update(job_id, status="cancelled")
+        logger.info(f"Ingestion job {job_id} cancelled")
+        return True
+
+    async def _consume(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = self.store.get(job_id)
+                if job and job["status"] in JobStore.ACTIVE_STATUSES:
+                    await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} failed: {e}")
+                self.store.update(job_id, status="failed", error=str(e))
+                metrics.inc("ingest_jobs_total", status="failed")
+                await self._report(job_id, f"❌ Ошибка при обработке файла: {e}")
+            finally:
+                self._cancelled.discard(job_id)
+                self._queue.task_done()
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        kb_manager = self.registry.kb_manager
+        # The whole file lands in one snapshot even if another is published meanwhile
+        snapshot = kb_manager.snapshot
+
+        self.store.update(job_id, status="running")
+
+        # A resumed job re-parses from the start: chunks committed before the
+        # restart are found in the manifest and skipped without re-embedding,
+        # and seeing every chunk lets finalize_source drop stale ones safely
+        batches = self._manager.Queue(maxsize=self.max_workers * 2)
+        stop = self._manager.Event()
+        producer = asyncio.wrap_future(
+            self._parser.submit(_produce_batches, job["file_path"], self.batch_size, batches, stop)
+        )
+        committed = 0
+        seen_ids = set()
+        last_report = 0.0
+        pending = deque()
+
+        async def next_batch() -> Optional[List[str]]:
+            while True:
+                try:
+                    return await asyncio.to_thread(batches.get, True, 0.5)
+                except queue.Empty:
+                    if producer.done():
+                        # Raises the parser's error; otherwise it ended without its None
+                        await producer
+                        raise RuntimeError("Parser stopped before the end of the file")
+
+        async def commit_next():
+            nonlocal committed, last_report
+            batch_start, batch, future = pending.popleft()
+            seen_ids.update(await future)
+            committed = batch_start + len(batch)
+            self.store.update(job_id, committed_chunks=committed)
+            if time.monotonic() - last_report >= config.INGEST_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await self._report(job_id, self._progress_text(job_id, committed))
+
+        batch_start = committed
+        try:
+            while job_id not in self._cancelled:
+                batch = await next_batch()
+                if batch is None:
+                    break
+                future = asyncio.ensure_future(asyncio.to_thread(
+                    kb_manager._add_documents_to_kb, batch, job["source"], batch_start, self.embed, snapshot
+                ))
+                pending.append((batch_start, batch, future))
+                batch_start += len(batch)
+                # Keep every worker busy while advancing committed_chunks strictly in order
+                if len(pending) >= self.max_workers:
+                    await commit_next()
+
+            if job_id not in self._cancelled:
+                while pending:
+                    await commit_next()
+        finally:
+            stop.set()
+            # Batches already handed to threads cannot be interrupted; let them land before the job ends
+            await asyncio.gather(*(future for _, _, future in pending), return_exceptions=True)
+            try:
+                metrics.REGISTRY.merge(await producer)
+            except Exception:
+                # A parser error has already surfaced through next_batch()
+                pass
+
+        if job_id in self._cancelled:
+            metrics.inc("ingest_jobs_total", status="cancelled")
+            await self._report(job_id, f"🛑 Задача {job_id} отменена. Сохранено чанков: {committed}")
+            return
+
+        if not committed:
+            self.store.update(job_id, status="failed", error="No documents extracted")
+            metrics.inc("ingest_jobs_total", status="failed")
+            await self._report(job_id, "❌ Ошибка при обработке файла: No documents extracted")
+            return
+
+        await asyncio.to_thread(kb_manager.finalize_source, job["source"], seen_ids, snapshot)
+        self.store.update(job_id, status="done", total_chunks=committed)
+        metrics.inc("ingest_jobs_total", status="done")
+        await self._report(
+            job_id,
+            f"✅ Файл успешно обработан!\n"
+            f"📄 Документов: {committed}\n"
+            f"🔢 Чанков: {committed}"
+        )
+
+    @staticmethod
+    def _progress_text(job_id: str, committed: int) -> str:
+        return (
+            f"🔄 Обрабатываю файл...\n"
+            f"🔢 Сохранено чанков: {committed}\n"
+            f"Отмена: /cancel {job_id}"
+        )
+
+    async def _report(self, job_id: str, text: str):
+        """Edit the job's status message in place"""
+        job = self.store.get(job_id)
+        if not job or not self._bot or not job["message_id"]:
+            return
+        try:
+            await self._bot.edit_message_text(
+                text, chat_id=job["chat_id"], message_id=job["message_id"]
+            )
+        except Exception as e:
+            logger.debug(f"Could not update status message for job {job_id}: {e}")
@@ -0,0 +1,398 @@
+import heapq
+import math
+import os
+import pickle
+import re
+import struct
+import threading
+import zlib
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from ai_engine.dp_model import RussianTextProcessor
+from config import config
+
+_VOWELS = "аеиоуыэюя"
+# Letters, digits and codes such as "AB-1234" or "12.5" stay single tokens
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+(?:[-./][0-9a-zа-я]+)*")
+
+
+def _suffixes(*groups: str) -> List[str]:
+    return sorted((s for group in groups for s in group.split()), key=len, reverse=True)
+
+
+_PERFECTIVE_1 = _suffixes("в вши вшись")
+_PERFECTIVE_2 = _suffixes("ив ивши ившись ыв ывши ывшись")
+_REFLEXIVE = _suffixes("ся сь")
+_ADJECTIVE = _suffixes("ее ие ые ое ими ыми ей ий ый ой ем им ым ом его ого ему ому их ых ую юю ая яя ою ею")
+_PARTICIPLE_1 = _suffixes("ем нн вш ющ щ")
+_PARTICIPLE_2 = _suffixes("ивш ывш ующ")
+_VERB_1 = _suffixes("ла на ете йте ли й л ем н ло но ет ют ны ть ешь нно")
+_VERB_2 = _suffixes(
+    "ила ыла ена ейте уйте ите или ыли ей уй ил ыл им ым ен ило ыло ено ят ует уют ит ыт ены ить ыть ишь ую ю"
+)
+_NOUN = _suffixes(
+    "а ев ов ие ье е иями ями ами еи ии и ией ей ой ий й иям ям ием ем ам ом о у ах иях ях ы ь ию ью ю ия ья я"
+)
+_SUPERLATIVE = _suffixes("ейш ейше")
+_DERIVATIONAL = _suffixes("ост ость")
+
+
+def _strip(rv: str, group_1: List[str], group_2: Optional[List[str]] = None) -> Optional[str]:
+    """Remove the longest matching ending; group_1 endings must follow а or я"""
+    candidates = [(s, True) for s in group_1] + [(s, False) for s in group_2 or []]
+    for suffix, needs_a in sorted(candidates, key=lambda c: len(c[0]), reverse=True):
+        if rv.endswith(suffix):
+            stem = rv[:-len(suffix)]
+            if needs_a and not stem.endswith(("а", "я")):
+                continue
+            return stem
+    return None
+
+
+def _region_start(word: str, start: int = 0) -> int:
+    """Index after the first non-vowel that follows a vowel (Snowball R1/R2)"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+@lru_cache(maxsize=config.BM25_STEM_CACHE_SIZE)
+def stem(word: str) -> str:
+    """Snowball Russian stemmer, memoized per word form"""
+    rv_start = next((i + 1 for i, char in enumerate(word) if char in _VOWELS), len(word))
+    r2_start = _region_start(word, _region_start(word))
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Step 1
+    stripped = _strip(rv, _PERFECTIVE_1, _PERFECTIVE_2)
+    if stripped is not None:
+        rv = stripped
+    else:
+        reflexive = _strip(rv, [], _REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        adjective = _strip(rv, [], _ADJECTIVE)
+        if adjective is not None:
+            participle = _strip(adjective, _PARTICIPLE_1, _PARTICIPLE_2)
+            rv = participle if participle is not None else adjective
+        else:
+            verb = _strip(rv, _VERB_1, _VERB_2)
+            if verb is not None:
+                rv = verb
+            else:
+                noun = _strip(rv, [], _NOUN)
+                if noun is not None:
+                    rv = noun
+
+    # Step 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Step 3: derivational endings only inside R2
+    for suffix in _DERIVATIONAL:
+        if rv.endswith(suffix) and rv_start + len(rv) - len(suffix) >= r2_start:
+            rv = rv[:-len(suffix)]
+            break
+
+    # Step 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        superlative = _strip(rv, [], _SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith("нн") else superlative
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def analyze(text: str) -> List[str]:
+    """Normalize, tokenize and stem text; numbers and latin codes are kept verbatim"""
+    text = RussianTextProcessor.preprocess_text(text).lower().replace("ё", "е")
+    terms = []
+    for token in _TOKEN_RE.findall(text):
+        if token.isalpha() and all("а" <= char <= "я" for char in token):
+            terms.append(stem(token))
+        else:
+            terms.append(token)
+    return terms
+
+
+# Journal record header: payload length and CRC32
+_RECORD = struct.Struct("<II")
+# Random ID shared by a full index write and the journal started after it
+_JOURNAL_ID_SIZE = 8
+
+
+class InvertedIndex:
+    """Incremental BM25 index with array-backed postings lists
+
+    Postings hold internal document numbers (array 'I') and term
+    frequencies (array 'H'). Removal only clears a document's live flag;
+    postings are compacted once dead documents pass BM25_COMPACT_RATIO.
+
+    persist() appends the adds and removes made since the last call to a
+    journal next to the index file; the full index is only rewritten once
+    the journal outgrows BM25_JOURNAL_RATIO of it. Loading replays the
+    journal over the last full write. Each full write gets a new ID, which
+    the journal started after it begins with: a journal whose ID does not
+    match the index is already folded into it and is skipped.
+    """
+
+    def __init__(self, path: str = config.BM25_INDEX_PATH, k1: float = config.BM25_K1, b: float = config.BM25_B):
+        self.path = path
+        self.journal_path = path + ".log"
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        # Operations not yet in the journal: ("add", chunk_id, terms) or ("remove", chunk_ids)
+        self._pending: List[tuple] = []
+        self._clear()
+        self._load()
+
+    def _clear(self):
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_ids: List[Optional[str]] = []
+        self.doc_numbers: Dict[str, int] = {}
+        self.doc_lengths = array("I")
+        self.live_docs = 0
+        self.total_length = 0
+
+    def _load(self):
+        self._index_stat = self._stat(self.path)
+        self._journal_id: Optional[bytes] = None
+        self._journal_offset = 0
+        if self._index_stat is not None:
+            try:
+                with open(self.path, "rb") as f:
+                    state = pickle.load(f)
+                self._journal_id = state.get("journal_id")
+                self.postings = state["postings"]
+                self.doc_ids = state["doc_ids"]
+                self.doc_lengths = state["doc_lengths"]
+                self.doc_numbers = {chunk_id: n for n, chunk_id in enumerate(self.doc_ids) if chunk_id is not None}
+                self.live_docs = len(self.doc_numbers)
+                self.total_length = sum(self.doc_lengths[n] for n in self.doc_numbers.values())
+            except Exception as e:
+                logger.error(f"Error loading BM25 index, starting empty: {e}")
+                self._clear()
+                self._journal_id = None
+        replayed = self._replay()
+        if self.doc_ids:
+            logger.info(f"Loaded BM25 index with {self.live_docs} documents and {len(self.postings)} terms"
+                        f"{f' ({replayed} journal operations)' if replayed else ''}")
+
+    @staticmethod
+    def _stat(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def refresh(self):
+        """Catch up with another process writing to the same files
+
+        Only the journal records added since the last read are applied; the
+        whole index is reloaded only after the writer has rewritten it.
+        """
+        with self._lock:
+            if self._stat(self.path) != self._index_stat:
+                self._clear()
+                self._load()
+            else:
+                self._replay()
+
+    def _replay(self) -> int:
+        """Apply journal records past the last one read; returns how many operations"""
+        try:
+            f = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            return 0
+        applied = 0
+        with f:
+            # Written before the index's last full write, or not begun yet: nothing to apply
+            if self._journal_id is None or f.read(_JOURNAL_ID_SIZE) != self._journal_id:
+                self._journal_offset = 0
+                return 0
+            if not _JOURNAL_ID_SIZE <= self._journal_offset <= os.fstat(f.fileno()).st_size:
+                self._journal_offset = _JOURNAL_ID_SIZE
+            f.seek(self._journal_offset)
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                length, checksum = _RECORD.unpack(header)
+                payload = f.read(length)
+                # A torn or half-written tail ends the journal; the writer truncates it on its next append
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                for operation in pickle.loads(payload):
+                    if operation[0] == "add":
+                        self._add(operation[1], operation[2])
+                    else:
+                        self._remove_many(operation[1])
+                    applied += 1
+                self._journal_offset = f.tell()
+        return applied
+
+    def add(self, chunk_id: str, text: str):
+        terms = Counter(analyze(text))
+        with self._lock:
+            self._add(chunk_id, terms)
+            self._pending.append(("add", chunk_id, terms))
+
+    def _add(self, chunk_id: str, terms: Counter):
+        if chunk_id in self.doc_numbers:
+            self._remove(chunk_id)
+        doc_number = len(self.doc_ids)
+        self.doc_ids.append(chunk_id)
+        self.doc_numbers[chunk_id] = doc_number
+        length = sum(terms.values())
+        self.doc_lengths.append(length)
+        self.live_docs += 1
+        self.total_length += length
+        for term, tf in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("I"), array("H"))
+            postings[0].append(doc_number)
+            postings[1].append(min(tf, 0xFFFF))
+
+    def _remove(self, chunk_id: str):
+        doc_number = self.doc_numbers.pop(chunk_id)
+        self.doc_ids[doc_number] = None
+        self.live_docs -= 1
+        self.total_length -= self.doc_lengths[doc_number]
+
+    def remove(self, chunk_ids: Iterable[str]):
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            self._remove_many(chunk_ids)
+            self._pending.append(("remove", chunk_ids))
+
+    def _remove_many(self, chunk_ids: List[str]):
+        for chunk_id in chunk_ids:
+            if chunk_id in self.doc_numbers:
+                self._remove(chunk_id)
+        dead = len(self.doc_ids) - self.live_docs
+        if dead and dead > config.BM25_COMPACT_RATIO * len(self.doc_ids):
+            self._compact()
+
+    def _compact(self):
+        """Renumber live documents and drop dead postings"""
+        remap = {}
+        doc_ids, doc_lengths = [], array("I")
+        for old, chunk_id in enumerate(self.doc_ids):
+            if chunk_id is not None:
+                remap[old] = len(doc_ids)
+                doc_ids.append(chunk_id)
+                doc_lengths.append(self.doc_lengths[old])
+
+        postings = {}
+        for term, (numbers, freqs) in self.postings.items():
+            new_numbers, new_freqs = array("I"), array("H")
+            for number, tf in zip(numbers, freqs):
+                if number in remap:
+                    new_numbers.append(remap[number])
+                    new_freqs.append(tf)
+            if new_numbers:
+                postings[term] = (new_numbers, new_freqs)
+
+        self.postings = postings
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.doc_numbers = {chunk_id: n for n, chunk_id in enumerate(doc_ids)}
+        logger.info(f"Compacted BM25 index to {len(doc_ids)} documents")
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """BM25 top_k as (chunk_id, score), reading only the query terms' postings"""
+        terms = set(analyze(query))
+        with self._lock:
+            if not self.live_docs:
+                return []
+            avg_length = self.total_length / self.live_docs
+            scores: Dict[int, float] = {}
+            for term in terms:
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                numbers, freqs = postings
+                # df counts dead documents until compaction; close enough for ranking
+                df = len(numbers)
+                idf = math.log(1 + (self.live_docs - df + 0.5) / (df + 0.5))
+                for number, tf in zip(numbers, freqs):
+                    if self.doc_ids[number] is None:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[number] / avg_length)
+                    scores[number] = scores.get(number, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [(self.doc_ids[number], score) for number, score in best]
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+            self._checkpoint()
+
+    def persist(self):
+        """Journal the changes since the last call; rewrite the whole index once the journal is large"""
+        with self._lock:
+            if self._journal_id is None or not os.path.exists(self.path):
+                self._checkpoint()
+                return
+            if not self._pending:
+                return
+            payload = pickle.dumps(self._pending, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(self.journal_path, "ab") as f:
+                if not self._journal_offset:
+                    # No journal for this index yet, or a stale one left by a crash mid-checkpoint
+                    f.truncate(0)
+                    f.write(self._journal_id)
+                else:
+                    # Drop a torn tail left by a crash, so new records follow the last good one
+                    f.truncate(self._journal_offset)
+                f.write(_RECORD.pack(len(payload), zlib.crc32(payload)) + payload)
+                self._journal_offset = f.tell()
+            self._pending = []
+            if self._journal_offset > config.BM25_JOURNAL_RATIO * os.path.getsize(self.path):
+                self._checkpoint()
+
+    def _checkpoint(self):
+        """Write the full index atomically and start an empty journal"""
+        journal_id = os.urandom(_JOURNAL_ID_SIZE)
+        state = {"postings": self.postings, "doc_ids": self.doc_ids, "doc_lengths": self.doc_lengths,
+                 "journal_id": journal_id}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Until the journal is restarted below, readers of the new index skip the old one by its ID
+        os.replace(tmp_path, self.path)
+        self._index_stat = self._stat(self.path)
+        with open(self.journal_path, "wb") as f:
+            f.write(journal_id)
+        self._journal_id = journal_id
+        self._journal_offset = _JOURNAL_ID_SIZE
+        self._pending = []
+
+    def __len__(self) -> int:
+        return self.live_docs
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.doc_numbers
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = config.RRF_K) -> Dict[str, float]:
+    """Fuse ranked ID lists: score = sum of 1 / (k + rank)"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return fused
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Sequence, Set
+
+import numpy as np
+
+from config import config
+
+
+class ChunkManifest:
+    """SQLite record of every stored chunk plus a content-addressed embedding cache
+
+    With cache_path the embedding cache lives in that separate database,
+    attached to this one, so several manifests can share it.
+    """
+
+    def __init__(self, db_path: str = config.EMBEDDINGS_DB, cache_path: Optional[str] = None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._embeddings = "embeddings"
+        if cache_path and os.path.abspath(cache_path) != os.path.abspath(db_path):
+            self._conn.execute("ATTACH DATABASE ? AS cache", (cache_path,))
+            self._conn.execute("PRAGMA cache.journal_mode = WAL")
+            self._embeddings = "cache.embeddings"
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self._embeddings} (
+                content_hash TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (content_hash, model_version)
+            )
+            """
+        )
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+
+            CREATE TABLE IF NOT EXISTS sources (
+                source TEXT PRIMARY KEY,
+                chunk_count INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+
+            -- Counters kept up to date by triggers so reads are O(1)
+            CREATE TABLE IF NOT EXISTS stats (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            INSERT OR IGNORE INTO stats VALUES ('chunk_count', 0);
+            INSERT OR IGNORE INTO stats VALUES ('document_count', 0);
+            INSERT OR IGNORE INTO stats VALUES ('last_update', NULL);
+            INSERT OR IGNORE INTO stats VALUES ('kb_version', 0);
+            INSERT OR IGNORE INTO stats VALUES ('generation', 0);
+
+            CREATE TRIGGER IF NOT EXISTS chunks_insert AFTER INSERT ON chunks BEGIN
+                UPDATE stats SET value = value + 1 WHERE key = 'chunk_count';
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_delete AFTER DELETE ON chunks BEGIN
+                UPDATE stats SET value = value - 1 WHERE key = 'chunk_count';
+            END;
+            CREATE TRIGGER IF NOT EXISTS sources_insert AFTER INSERT ON sources BEGIN
+                UPDATE stats SET value = value + 1 WHERE key = 'document_count';
+            END;
+            CREATE TRIGGER IF NOT EXISTS sources_delete AFTER DELETE ON sources BEGIN
+                UPDATE stats SET value = value - 1 WHERE key = 'document_count';
+            END;
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _touch(self):
+        self._conn.execute("UPDATE stats SET value = ? WHERE key = 'last_update'", (self._now(),))
+        self._conn.execute("UPDATE stats SET value = value + 1 WHERE key = 'kb_version'")
+
+    def current_ids(self, chunk_ids: Sequence[str], model_version: str) -> Set[str]:
+        """Chunk IDs already stored with embeddings from model_version"""
+        if not chunk_ids:
+            return set()
+        placeholders = ", ".join("?" * len(chunk_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT chunk_id FROM chunks WHERE model_version = ? AND chunk_id IN ({placeholders})",
+                (model_version, *chunk_ids),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def cached_embeddings(self, content_hashes: Sequence[str], model_version: str) -> Dict[str, np.ndarray]:
+        """Embeddings already computed for identical chunk text, from any source"""
+        if not content_hashes:
+            return {}
+        placeholders = ", ".join("?" * len(content_hashes))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT content_hash, vector FROM {self._embeddings} "
+                f"WHERE model_version = ? AND content_hash IN ({placeholders})",
+                (model_version, *content_hashes),
+            ).fetchall()
+        return {content_hash: np.frombuffer(blob, dtype=np.float32) for content_hash, blob in rows}
+
+    def record_chunks(self, rows: Iterable[Dict[str, Any]], model_version: str):
+        """Upsert chunks and cache their embeddings
+
+        Each row holds chunk_id, source, chunk_index, content_hash and embedding.
+        """
+        now = self._now()
+        with self._lock:
+            for row in rows:
+                self._conn.execute(
+                    "INSERT INTO chunks (chunk_id, source, chunk_index, content_hash, model_version, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (chunk_id) DO UPDATE SET chunk_index = excluded.chunk_index, "
+                    "model_version = excluded.model_version, updated_at = excluded.updated_at",
+                    (row["chunk_id"], row["source"], row["chunk_index"], row["content_hash"], model_version, now),
+                )
+                self._conn.execute(
+                    f"INSERT OR IGNORE INTO {self._embeddings} (content_hash, model_version, vector) VALUES (?, ?, ?)",
+                    (row["content_hash"], model_version,
+                     np.asarray(row["embedding"], dtype=np.float32).tobytes()),
+                )
+            self._touch()
+            self._conn.commit()
+
+    def source_chunk_ids(self, source: str) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,)).fetchall()
+        return {row[0] for row in rows}
+
+    def remove_chunks(self, chunk_ids: Iterable[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", ((chunk_id,) for chunk_id in chunk_ids))
+            self._touch()
+            self._conn.commit()
+
+    def finalize_source(self, source: str):
+        """Refresh the per-source summary after a complete ingestion pass"""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE source = ?", (source,)).fetchone()[0]
+            if count:
+                self._conn.execute(
+                    "INSERT INTO sources (source, chunk_count, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (source) DO UPDATE SET chunk_count = excluded.chunk_count, "
+                    "updated_at = excluded.updated_at",
+                    (source, count, self._now()),
+                )
+            else:
+                self._conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+            self._touch()
+            self._conn.execute("UPDATE stats SET value = value + 1 WHERE key = 'generation'")
+            self._conn.commit()
+
+    def clear(self):
+        """Forget all chunks and sources; the embedding cache is kept for re-uploads"""
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM sources")
+            self._touch()
+            self._conn.execute("UPDATE stats SET value = value + 1 WHERE key = 'generation'")
+            self._conn.commit()
+
+    def version(self) -> int:
+        """Counter bumped on every change to the stored chunks"""
+        with self._lock:
+            return int(self._conn.execute("SELECT value FROM stats WHERE key = 'kb_version'").fetchone()[0])
+
+    def generation(self) -> int:
+        """Counter bumped only when a source is complete and persisted, so readers in
+        other processes can reopen the indexes at a consistent point"""
+        with self._lock:
+            return int(self._conn.execute("SELECT value FROM stats WHERE key = 'generation'").fetchone()[0])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = dict(self._conn.execute("SELECT key, value FROM stats").fetchall())
+        return {
+            "document_count": int(rows["document_count"]),
+            "chunk_count": int(rows["chunk_count"]),
+            "last_update": rows["last_update"] or "Never",
+        }
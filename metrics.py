@@ -0,0 +1,303 @@
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from config import config
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Every metric is declared here: name -> (type, help)
+METRICS = {
+    "bot_messages_total": ("counter", "Text messages handled, by outcome"),
+    "bot_answers_total": ("counter", "Answers by source: qa, cache_exact, cache_semantic or fallback"),
+    "ingest_jobs_total": ("counter", "Finished ingestion jobs, by status"),
+    "ingest_chunks_total": ("counter", "Chunks written to the knowledge base"),
+    "ingest_stage_seconds": ("histogram", "Ingestion stages: parse and chunk per file, embed, qa_tokenize and index_write per batch"),
+    "query_cache_lookups_total": ("counter", "Query cache lookups by result: exact, semantic or miss"),
+    "batches_total": ("counter", "Micro-batches run, by batcher and batch size"),
+    "batch_latency_seconds": ("histogram", "Time from submit to result of each micro-batched item, by batcher"),
+    "session_followups_total": ("counter", "Questions answered from the previous turn's chunks instead of a new search"),
+    "query_stage_seconds": ("histogram", "Answer pipeline stages per query"),
+    "reply_latency_seconds": ("histogram", "Time from a message to its first_byte reply and to its final_answer"),
+    "progressive_edits_total": ("counter", "Progressive replies by outcome: edited or budget_exceeded"),
+    "telegram_request_seconds": ("histogram", "Bot API calls, by method"),
+    "scheduler_queued_total": ("counter", "Jobs admitted to the scheduler queue, by priority"),
+    "scheduler_shed_total": ("counter", "Requests refused or dropped: rate_limited, busy or deadline"),
+    "scheduler_wait_seconds": ("histogram", "Time jobs spent in the scheduler queue, by priority"),
+    "queue_depth": ("gauge", "Items waiting, by queue"),
+    "model_memory_bytes": ("gauge", "RSS growth measured while loading each model"),
+    "process_resident_memory_bytes": ("gauge", "Resident memory of the bot process"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class MetricsRegistry:
+    """In-process counters, latency histograms and callback gauges
+
+    Updates take one lock and touch a few floats, so they are cheap enough
+    for every query. Forked workers drain() their updates and the parent
+    merge()s them, so one endpoint covers all processes.
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # name, labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Dict[str, float]]]] = {}
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        assert METRICS[name][0] == "counter", name
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        assert METRICS[name][0] == "histogram", name
+        key = (name, _labels(labels))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_gauge(self, name: str, label: str, read: Callable[[], Dict[str, float]]):
+        """Gauge read on demand: read() maps each label value to the current value"""
+        assert METRICS[name][0] == "gauge", name
+        with self._lock:
+            self._gauges[name] = (label, read)
+
+    def value(self, name: str, **labels) -> float:
+        """Counter total; without labels, summed over every label combination"""
+        wanted = set(_labels(labels))
+        with self._lock:
+            return sum(value for (metric, series), value in self._counters.items()
+                       if metric == name and wanted <= set(series))
+
+    def gauge(self, name: str) -> Dict[str, float]:
+        entry = self._gauges.get(name)
+        if entry is None:
+            return {}
+        try:
+            return entry[1]()
+        except Exception as e:
+            logger.debug(f"Gauge {name} failed: {e}")
+            return {}
+
+    def quantile(self, name: str, q: float, **labels) -> Optional[float]:
+        """Estimate from the histogram buckets, interpolating linearly inside a bucket"""
+        with self._lock:
+            series = self._histograms.get((name, _labels(labels)))
+            if series is None or not series[2]:
+                return None
+            counts, _, count = list(series[0]), series[1], series[2]
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def series(self, name: str) -> List[Dict[str, str]]:
+        """Label sets recorded so far for a counter or a histogram"""
+        with self._lock:
+            keys = self._histograms if METRICS[name][0] == "histogram" else self._counters
+            return [dict(labels) for metric, labels in keys if metric == name]
+
+    def drain(self) -> dict:
+        """Hand over and reset counters and histograms, for merge() in another process"""
+        with self._lock:
+            delta = {"counters": self._counters, "histograms": self._histograms}
+            self._counters, self._histograms = {}, {}
+        return delta
+
+    def merge(self, delta: dict):
+        with self._lock:
+            for key, value in delta["counters"].items():
+                self._counters[key] = self._counters.get(key, 0.0) + value
+            for key, (counts, total, count) in delta["histograms"].items():
+                series = self._histograms.get(key)
+                if series is None:
+                    series = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(series[0]), series[1], series[2]) for key, series in self._histograms.items()}
+            gauges = dict(self._gauges)
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            elif kind == "histogram":
+                for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                        cumulative += bucket_count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            elif name in gauges:
+                label = gauges[name][0]
+                for label_value, value in self.gauge(name).items():
+                    lines.append(f"{name}{_format_labels(((label, label_value),) if label else ())} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+class TimedIterator:
+    """Iterator wrapper adding the time spent inside next() to a histogram once exhausted
+
+    With exclude, the time spent in an inner TimedIterator is subtracted, so
+    nested generator stages (parse inside chunk) are timed separately.
+    """
+
+    def __init__(self, iterable: Iterable, name: str, exclude: Optional["TimedIterator"] = None, **labels):
+        self._iterator = iter(iterable)
+        self.name = name
+        self.labels = labels
+        self.exclude = exclude
+        self.elapsed = 0.0
+        self._observed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self.elapsed += time.perf_counter() - started
+            if not self._observed:
+                self._observed = True
+                own = self.elapsed - (self.exclude.elapsed if self.exclude else 0.0)
+                observe(self.name, max(own, 0.0), **self.labels)
+            raise
+        finally:
+            if not self._observed:
+                self.elapsed += time.perf_counter() - started
+
+
+class RequestProfiler:
+    """cProfile one call in every N of each name; writes a .prof file and logs the top functions
+
+    Only the calling thread is profiled: time spent in the batcher threads
+    shows up as waiting on their futures. profiled(name) also works as a
+    decorator.
+    """
+
+    def __init__(self, every: int = config.PROFILE_EVERY, directory: str = config.PROFILE_DIR):
+        self.every = every
+        self.directory = directory
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, name: str) -> Iterator[None]:
+        if not self.every:
+            yield
+            return
+        with self._lock:
+            self._counts[name] += 1
+            sampled = self._counts[name] % self.every == 0
+        if not sampled:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{name}-{os.getpid()}-{int(time.time() * 1000)}.prof")
+            profile.dump_stats(path)
+            report = io.StringIO()
+            pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(15)
+            logger.info(f"Profiled {name} into {path}:\n{report.getvalue()}")
+
+
+profiled = RequestProfiler()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int = config.METRICS_PORT, host: str = config.METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics from a daemon thread; port 0 disables the endpoint"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,179 @@
+import json
+import os
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set, Tuple
+
+from config import config
+
+# Registry of streaming parsers: extension -> generator of text records
+PARSERS: Dict[str, Callable[[str], Iterator[str]]] = {}
+# Extensions whose parser yields one structured record (a row) per item
+TABULAR: Set[str] = set()
+
+
+def register_parser(*extensions: str, tabular: bool = False):
+    """Register a generator function as the parser for the given extensions"""
+    def decorator(func):
+        for ext in extensions:
+            PARSERS[ext.lower()] = func
+            if tabular:
+                TABULAR.add(ext.lower())
+        return func
+    return decorator
+
+
+def get_parser(file_path: str) -> Callable[[str], Iterator[str]]:
+    """Return the parser registered for the file's extension"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext not in PARSERS:
+        raise ValueError(f"No parser registered for {file_ext}")
+    return PARSERS[file_ext]
+
+
+def is_tabular(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in TABULAR
+
+
+@register_parser('.txt')
+def parse_txt(file_path: str, block_size: int = config.PARSER_BLOCK_SIZE) -> Iterator[str]:
+    """Read text in fixed-size blocks, cutting each block at the last line break or whitespace"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        tail = ""
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            block = tail + block
+            # Prefer a line break so sentences are rarely split across blocks
+            cut = block.rfind("\n")
+            if cut == -1:
+                cut = max(block.rfind(" "), block.rfind("\t"))
+            if cut == -1:
+                # A single word longer than the block: keep accumulating it
+                tail = block
+                continue
+            tail = block[cut + 1:]
+            yield block[:cut + 1]
+        if tail:
+            yield tail
+
+
+@register_parser('.csv', tabular=True)
+def parse_csv(file_path: str, chunk_rows: int = config.CSV_CHUNK_ROWS) -> Iterator[str]:
+    """Stream CSV rows as space-joined text, one pandas chunk at a time"""
+    import pandas as pd
+
+    for frame in pd.read_csv(file_path, chunksize=chunk_rows):
+        for row in frame.itertuples(index=False, name=None):
+            yield " ".join(str(cell) for cell in row)
+
+
+class _JsonStream:
+    """Minimal pull reader that decodes one JSON value at a time from a file"""
+
+    def __init__(self, f, block_size: int):
+        self.f = f
+        self.block_size = block_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        # Grow the read size so a large value is not re-parsed once per block
+        block = self.f.read(max(self.block_size, len(self.buf) - self.pos))
+        if not block:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Invalid JSON: expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A scalar that ends exactly at the buffer edge may continue in the next block
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def items(self, open_char: str, close_char: str) -> Iterator[None]:
+        """Iterate over the members of the container the reader is positioned at"""
+        self.expect(open_char)
+        if self.peek() == close_char:
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == close_char:
+                return
+            if char != ",":
+                raise ValueError(f"Invalid JSON: unexpected {char!r} at offset {self.pos}")
+
+
+def iter_json_records(file_path: str, block_size: int = config.PARSER_BLOCK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """Yield (path, value) per top-level array element or top-level object path
+
+    Arrays directly under a top-level object are streamed element by element,
+    so neither ``[{...}, ...]`` nor ``{"items": [{...}, ...]}`` is ever fully
+    loaded into memory.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, block_size)
+        first = stream.peek()
+        if first == "[":
+            for i, _ in enumerate(stream.items("[", "]")):
+                yield f"[{i}]", stream.value()
+        elif first == "{":
+            for _ in stream.items("{", "}"):
+                key = stream.value()
+                stream.expect(":")
+                if stream.peek() == "[":
+                    for i, _ in enumerate(stream.items("[", "]")):
+                        yield f"{key}[{i}]", stream.value()
+                else:
+                    yield key, stream.value()
+        elif first:
+            yield "", stream.value()
+
+
+@register_parser('.json', tabular=True)
+def parse_json(file_path: str) -> Iterator[str]:
+    """Stream JSON records as text"""
+    for path, value in iter_json_records(file_path):
+        text = json.dumps(value, ensure_ascii=False)
+        yield f"{path}: {text}" if path and not path.startswith("[") else text
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Group an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
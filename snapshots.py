@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from config import config
+from inverted_index import InvertedIndex
+from manifest import ChunkManifest
+from vector_store import create_vector_store
+
+LEGACY = "legacy"
+# Marks a version another process is still writing; garbage collection skips it
+STAGING_MARKER = "STAGING"
+_VERSION_RE = re.compile(r"^v(\d+)$")
+
+
+class KnowledgeSnapshot:
+    """One version of the knowledge base: vector store, BM25 index, manifest and source files
+
+    The legacy snapshot serves the pre-versioning layout from the configured
+    default paths, so an existing KB keeps answering after the upgrade.
+    """
+
+    def __init__(self, name: str, directory: Optional[str] = None, bm25: Optional[InvertedIndex] = None):
+        self.name = name
+        self.directory = directory
+        if directory is None:
+            self.files_dir = config.KNOWLEDGE_BASE_DIR
+            self.store = create_vector_store()
+            self.bm25 = bm25 or InvertedIndex()
+            self.manifest = ChunkManifest()
+        else:
+            self.files_dir = os.path.join(directory, "files")
+            self.store = create_vector_store(directory=os.path.join(directory, "vectors"))
+            self.bm25 = bm25 or InvertedIndex(path=os.path.join(directory, "bm25.idx"))
+            # Embeddings stay in the shared cache, so rebuilds reuse them
+            self.manifest = ChunkManifest(db_path=os.path.join(directory, "manifest.db"),
+                                          cache_path=config.EMBEDDINGS_DB)
+        os.makedirs(self.files_dir, exist_ok=True)
+        self.generation = self.manifest.generation()
+        self._lock = threading.Lock()
+        self._readers = 0
+
+    @contextmanager
+    def reading(self):
+        """Mark a query in flight so garbage collection leaves this snapshot alone"""
+        with self._lock:
+            self._readers += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._readers -= 1
+
+    @property
+    def in_use(self) -> bool:
+        return self._readers > 0
+
+    def is_stale(self, current: str) -> bool:
+        """True once another process published a different snapshot or finished writing to this one"""
+        return current != self.name or self.manifest.generation() != self.generation
+
+    def version(self) -> Tuple[str, int]:
+        """Changes on every write and on every swap to another snapshot"""
+        return self.name, self.manifest.version()
+
+
+class SnapshotManager:
+    """Numbered KB versions under KB_VERSIONS_DIR, published through an atomic CURRENT pointer"""
+
+    def __init__(self, root: str = config.KB_VERSIONS_DIR, keep: int = config.KB_KEEP_VERSIONS):
+        self.root = root
+        self.keep = keep
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _write_atomic(self, name: str, content: str):
+        tmp_path = self._path(name + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(name))
+
+    def history(self) -> List[str]:
+        """Published versions, oldest first; the last one is current"""
+        try:
+            with open(self._path("HISTORY")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def current(self) -> str:
+        try:
+            with open(self._path("CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            # No version published yet: keep serving the pre-versioning layout
+            return LEGACY
+
+    def versions(self) -> List[str]:
+        return sorted(
+            (name for name in os.listdir(self.root) if _VERSION_RE.match(name)),
+            key=lambda name: int(name[1:]),
+        )
+
+    def open(self, name: str, bm25: Optional[InvertedIndex] = None) -> KnowledgeSnapshot:
+        """Open a version; bm25 reuses an index already loaded from its directory"""
+        if name == LEGACY:
+            return KnowledgeSnapshot(LEGACY, bm25=bm25)
+        return KnowledgeSnapshot(name, self._path(name), bm25=bm25)
+
+    def create(self, staging: bool = False) -> KnowledgeSnapshot:
+        """Allocate an empty, unpublished version; staging ones survive other processes' GC until published"""
+        with self._lock:
+            # Numbers are never reused, even after old versions are collected
+            try:
+                with open(self._path("SEQUENCE")) as f:
+                    number = int(f.read()) + 1
+            except FileNotFoundError:
+                versions = self.versions()
+                number = int(versions[-1][1:]) + 1 if versions else 1
+            self._write_atomic("SEQUENCE", str(number))
+            name = f"v{number:04d}"
+            os.makedirs(self._path(name))
+            if staging:
+                open(os.path.join(self._path(name), STAGING_MARKER), "w").close()
+        logger.info(f"Created KB snapshot {name}")
+        return self.open(name)
+
+    def publish(self, name: str):
+        """Point CURRENT at the version; the rename is the atomic switch"""
+        with self._lock:
+            history = self.history()
+            if not history:
+                history.append(self.current())
+            history.append(name)
+            self._write_atomic("HISTORY", json.dumps(history))
+            self._write_atomic("CURRENT", name)
+            try:
+                os.remove(os.path.join(self._path(name), STAGING_MARKER))
+            except FileNotFoundError:
+                pass
+        logger.info(f"Published KB snapshot {name}")
+
+    def rollback(self) -> Optional[str]:
+        """Re-publish the previous version; None when there is nothing to go back to"""
+        with self._lock:
+            history = self.history()
+            if len(history) < 2:
+                return None
+            history.pop()
+            self._write_atomic("HISTORY", json.dumps(history))
+            self._write_atomic("CURRENT", history[-1])
+        logger.info(f"Rolled KB back to snapshot {history[-1]}")
+        return history[-1]
+
+    def collect_garbage(self, in_use: Iterable[str] = ()) -> List[str]:
+        """Delete versions that are neither among the last keep published nor being read"""
+        with self._lock:
+            history = self.history()
+            protected = set(history[-self.keep:]) | set(in_use) | {self.current()}
+            removed = [name for name in self.versions() if name not in protected
+                       and not os.path.exists(os.path.join(self._path(name), STAGING_MARKER))]
+            for name in removed:
+                shutil.rmtree(self._path(name), ignore_errors=True)
+            # Forget removed versions so rollback never points at a deleted directory
+            if removed:
+                self._write_atomic("HISTORY", json.dumps([name for name in history if name not in removed]))
+        if removed:
+            logger.info(f"Removed old KB snapshots: {', '.join(removed)}")
+        return removed
@@ -0,0 +1,84 @@
+import builtins
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+
+class StartupProfile:
+    """Where the time between process start and the first answer goes
+
+    install() wraps __import__ and times the first import of each top-level
+    package; imports made while another timed import runs count towards the
+    outer one, so the figures add up. Only the main thread is timed.
+    """
+
+    def __init__(self):
+        self.process_started = psutil.Process().create_time()
+        self.imports: Dict[str, float] = {}
+        # phase -> seconds since the process started, in the order reached
+        self.phases: List[Tuple[str, float]] = []
+        self._original = None
+        self._active = False
+        self._main = threading.main_thread().ident
+
+    def install(self):
+        if self._original is not None:
+            return
+        self._original = original = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            top = name.partition(".")[0]
+            if level or self._active or top in sys.modules or threading.get_ident() != self._main:
+                return original(name, globals, locals, fromlist, level)
+            self._active = True
+            started = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                self._active = False
+                self.imports[top] = self.imports.get(top, 0.0) + time.perf_counter() - started
+
+        builtins.__import__ = timed_import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def elapsed(self) -> float:
+        return time.time() - self.process_started
+
+    def mark(self, phase: str):
+        """Record that startup reached phase now"""
+        self.phases.append((phase, self.elapsed()))
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{phase} {at:.1f}s" for phase, at in self.phases)
+        return f"Startup: {phases} ({sum(self.imports.values()):.1f}s in imports)"
+
+    def report(self, model_stats: Optional[Dict[str, Dict]] = None, top: int = 15) -> str:
+        """Plain-text breakdown: phase timeline, slowest imports, model loads"""
+        lines = ["Startup timeline (seconds since process start):"]
+        previous = 0.0
+        for phase, at in self.phases:
+            lines.append(f"  {at:8.2f}  +{at - previous:7.2f}  {phase}")
+            previous = at
+
+        imports = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+        lines.append(f"Imports ({sum(self.imports.values()):.2f}s in {len(imports)} top-level packages):")
+        for name, seconds in imports[:top]:
+            lines.append(f"  {seconds:8.2f}  {name}")
+
+        if model_stats:
+            # Load times include the imports the model factories trigger
+            lines.append("Model loads:")
+            for name, stats in model_stats.items():
+                lines.append(f"  {stats['load_time']:8.2f}  {name} (warmup {stats['warmup_time']:.2f}s, "
+                             f"+{stats['rss_mb']:.0f} MB RSS)")
+        return "\n".join(lines)
+
+
+profile = StartupProfile()
@@ -0,0 +1,46 @@
+import functools
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import config  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Point every data path in config under a temporary directory
+
+    Only code reading config at call time sees it; pass paths explicitly
+    to classes whose defaults were bound at import.
+    """
+    for name in dir(config):
+        value = getattr(config, name)
+        if isinstance(value, str) and value.startswith(config.DATA_DIR) and name != "DATA_DIR":
+            monkeypatch.setattr(config, name, str(tmp_path) + value[len(config.DATA_DIR):])
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def hashing_kb(data_dir, monkeypatch):
+    """Let KnowledgeBaseManager run under data_dir with hashing embeddings and the compact store"""
+    import snapshots
+    import uploader
+    from ai_engine.inference import HashingEmbeddingModel
+    from inverted_index import InvertedIndex
+    from manifest import ChunkManifest
+
+    monkeypatch.setattr(config, "INFERENCE_BACKEND", "hashing")
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "compact")
+    # Defaults bound at import still point at the real data directory
+    monkeypatch.setattr(uploader, "load_embedding_model", HashingEmbeddingModel)
+    monkeypatch.setattr(uploader, "SnapshotManager",
+                        functools.partial(snapshots.SnapshotManager, root=config.KB_VERSIONS_DIR))
+    monkeypatch.setattr(snapshots, "ChunkManifest", functools.partial(ChunkManifest, db_path=config.EMBEDDINGS_DB))
+    monkeypatch.setattr(snapshots, "InvertedIndex", functools.partial(InvertedIndex, path=config.BM25_INDEX_PATH))
+    monkeypatch.setattr(uploader, "QATokenStore", functools.partial(uploader.QATokenStore, config.QA_TOKENS_DIR))
+    return data_dir
@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+
+import pytest
+
+import bulk_ingest
+import uploader
+
+WORDS = "база знаний документ вопрос ответ система модель поиск договор клиент оплата доставка".split()
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def corpus(hashing_kb):
+    rng = random.Random(3)
+    path = hashing_kb / "corpus"
+    for folder in ("a", "b"):
+        os.makedirs(path / folder)
+        for n in range(4):
+            sentences = (" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + "." for _ in range(150))
+            (path / folder / f"f{n}.txt").write_text(" ".join(sentences), encoding="utf-8")
+    return path
+
+
+def run(path, data_dir, embed_batch=16) -> dict:
+    return bulk_ingest.ingest(argparse.Namespace(
+        path=str(path), workers=1, embed_batch=embed_batch, replace=True,
+        checkpoint=str(data_dir / "bulk_ingest.json"), checkpoint_every=3600.0, report_every=3600.0,
+    ))
+
+
+def published_chunks() -> dict:
+    kb_manager = uploader.KnowledgeBaseManager()
+    try:
+        sources = sorted(os.listdir(kb_manager.files_dir))
+        return {source: kb_manager.manifest.source_chunk_ids(source) for source in sources}
+    finally:
+        kb_manager.close()
+
+
+def test_interrupted_run_resumes_without_redoing_finished_files(corpus, data_dir, monkeypatch):
+    encode = uploader.KnowledgeBaseManager._encode_documents
+    calls = []
+
+    def failing_encode(self, documents):
+        calls.append(documents)
+        if len(calls) > 6:
+            raise Interrupted()
+        return encode(self, documents)
+
+    monkeypatch.setattr(uploader.KnowledgeBaseManager, "_encode_documents", failing_encode)
+    with pytest.raises(Interrupted):
+        run(corpus, data_dir)
+    checkpoint = bulk_ingest.Checkpoint(str(data_dir / "bulk_ingest.json"), str(corpus))
+    assert checkpoint.snapshot and 0 < len(checkpoint.done) < 8
+    interrupted_in = checkpoint.snapshot
+
+    written = []
+
+    def recording_add_chunks(self, chunks, embed_fn=None, snapshot=None):
+        written.extend(source for source, _, _ in chunks)
+        return add_chunks(self, chunks, embed_fn, snapshot)
+
+    add_chunks = uploader.KnowledgeBaseManager.add_chunks
+    monkeypatch.setattr(uploader.KnowledgeBaseManager, "_encode_documents", encode)
+    monkeypatch.setattr(uploader.KnowledgeBaseManager, "add_chunks", recording_add_chunks)
+    report = run(corpus, data_dir)
+
+    assert report["snapshot"] == interrupted_in
+    assert report["kb_files"] == 8
+    assert not set(written) & checkpoint.done
+    assert not os.path.exists(data_dir / "bulk_ingest.json")
+
+    # Same chunks as a run that was never interrupted
+    resumed = published_chunks()
+    run(corpus, data_dir, embed_batch=1000)
+    assert resumed == published_chunks()
+    assert len(resumed) == 8 and all(resumed.values())
+
+
+def test_checkpoint_of_another_corpus_starts_over(tmp_path):
+    checkpoint = bulk_ingest.Checkpoint(str(tmp_path / "bulk_ingest.json"), "/data/a")
+    checkpoint.snapshot, checkpoint.done = "v0003", {"x.txt"}
+    checkpoint.save()
+
+    assert bulk_ingest.Checkpoint(str(tmp_path / "bulk_ingest.json"), "/data/a").done == {"x.txt"}
+    other = bulk_ingest.Checkpoint(str(tmp_path / "bulk_ingest.json"), "/data/b")
+    assert other.snapshot is None and not other.done
@@ -0,0 +1,40 @@
+from chunking import NearDuplicateFilter, dedupe, dedupe_exact
+
+BOILERPLATE = "Все права защищены, перепечатка материалов возможна только с письменного согласия редакции"
+
+
+def sentences(count: int):
+    return [f"Раздел {i} описывает условия доставки товара номер {i} в город {i * 7}" for i in range(count)]
+
+
+def test_repeats_within_the_window_are_dropped():
+    texts = [BOILERPLATE, *sentences(5), BOILERPLATE.replace("редакции", "редакции журнала")]
+    assert list(dedupe(texts, NearDuplicateFilter(threshold=0.7, window=10))) == texts[:-1]
+
+
+def test_window_bounds_the_remembered_texts():
+    duplicate_filter = NearDuplicateFilter(window=3)
+    for text in sentences(50):
+        assert not duplicate_filter.is_duplicate(text)
+    assert len(duplicate_filter._signatures) == 3
+    assert sum(len(bucket) for buckets in duplicate_filter._buckets for bucket in buckets.values()) == 3 * 8
+
+    # Forgotten texts pass again, recent ones are still caught
+    assert not duplicate_filter.is_duplicate(sentences(50)[0])
+    assert duplicate_filter.is_duplicate(sentences(50)[-1])
+
+
+def test_table_rows_are_near_duplicates_only_with_the_same_numbers():
+    row = "{code} Смартфон Альфа, чёрный корпус, {memory} ГБ памяти, гарантия производителя, доставка курьером {price}"
+    rows = [row.format(code=f"SKU-{i}", memory=128, price=19990 + i) for i in range(20)]
+    variant = rows[3].replace("Смартфон", "смартфон").replace("чёрный", "черный")
+    other_memory = row.format(code="SKU-3", memory=256, price=19993)
+    texts = [*rows, rows[5], variant, other_memory]
+
+    duplicate_filter = NearDuplicateFilter(threshold=0.95, match_numbers=True)
+    assert list(dedupe(texts, duplicate_filter)) == [*rows, other_memory]
+
+
+def test_exact_dedupe_remembers_only_the_window():
+    texts = ["Да", "Нет", "Да", "Может быть", "Нет", "Да"]
+    assert list(dedupe_exact(texts, window=2)) == ["Да", "Нет", "Может быть", "Да"]
@@ -0,0 +1,97 @@
+import os
+import random
+
+import pytest
+
+import inverted_index
+from config import config
+from inverted_index import InvertedIndex
+
+WORDS = "база знаний документ вопрос ответ система модель поиск договор клиент оплата доставка".split()
+
+
+def text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(20))
+
+
+def same(a: InvertedIndex, b: InvertedIndex):
+    assert set(a.doc_numbers) == set(b.doc_numbers)
+    for query in ("договор оплата", "модель поиск", "доставка"):
+        assert a.search(query, 10) == pytest.approx(b.search(query, 10))
+
+
+def churn(index, rng, rounds=1):
+    for _ in range(rounds):
+        for _ in range(10):
+            index.add(f"c{rng.randint(0, 100)}", text(rng))
+        index.remove([f"c{rng.randint(0, 100)}" for _ in range(3)])
+        index.persist()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "bm25.idx")
+
+
+def test_reload_replays_the_journal(path):
+    rng = random.Random(1)
+    index = InvertedIndex(path=path)
+    churn(index, rng, rounds=5)
+
+    assert os.path.getsize(index.journal_path) > 8
+    same(InvertedIndex(path=path), index)
+
+
+def test_torn_journal_tail_is_ignored_and_overwritten(path):
+    rng = random.Random(2)
+    index = InvertedIndex(path=path)
+    churn(index, rng, rounds=2)
+    with open(index.journal_path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00torn")
+
+    same(InvertedIndex(path=path), index)
+    churn(index, rng)
+    same(InvertedIndex(path=path), index)
+
+
+def test_refresh_follows_a_writer(path):
+    rng = random.Random(3)
+    writer = InvertedIndex(path=path)
+    writer.persist()
+    reader = InvertedIndex(path=path)
+    for _ in range(20):
+        churn(writer, rng)
+        reader.refresh()
+        same(reader, writer)
+
+
+def test_refresh_between_index_replace_and_journal_restart(path, monkeypatch):
+    rng = random.Random(4)
+    writer = InvertedIndex(path=path)
+    churn(writer, rng, rounds=3)
+    reader = InvertedIndex(path=path)
+    replace = os.replace
+
+    def replace_then_refresh(src, dst):
+        # The reader catches the new index while the old journal is still on disk
+        replace(src, dst)
+        if dst == path:
+            reader.refresh()
+
+    monkeypatch.setattr(inverted_index.os, "replace", replace_then_refresh)
+    monkeypatch.setattr(config, "BM25_JOURNAL_RATIO", 0.0)
+    churn(writer, rng)
+    monkeypatch.setattr(config, "BM25_JOURNAL_RATIO", 100.0)
+    monkeypatch.setattr(inverted_index.os, "replace", replace)
+
+    churn(writer, rng, rounds=3)
+    reader.refresh()
+    same(reader, writer)
+
+
+def test_reset_empties_index_and_journal(path):
+    index = InvertedIndex(path=path)
+    churn(index, random.Random(5), rounds=2)
+    index.reset()
+
+    assert len(InvertedIndex(path=path)) == 0
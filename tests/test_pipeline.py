@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+
+from ai_engine.pipeline import AnswerPipeline
+from ai_engine.sessions import Turn
+from config import config
+
+DELIVERY = "a" * 32
+PRINTER = "b" * 32
+
+
+class FakeKnowledgeBase:
+    """Two chunks with fixed embeddings; records which retrieval path ran"""
+
+    def __init__(self, query_embeddings):
+        self.query_embeddings = query_embeddings
+        self.embeddings = {DELIVERY: np.array([1.0, 0.0]), PRINTER: np.array([0.0, 1.0])}
+        self.searched = []
+
+    def kb_version(self):
+        return "v1", 1
+
+    def query_encoder(self, query):
+        return self.query_embeddings[query]
+
+    def _hit(self, chunk_id, query_embedding):
+        similarity = float(self.embeddings[chunk_id] @ query_embedding)
+        return {"id": chunk_id, "content": chunk_id, "similarity": similarity}
+
+    def get_chunks(self, chunk_ids, query_embedding):
+        hits = [self._hit(chunk_id, query_embedding) for chunk_id in chunk_ids]
+        return sorted(hits, key=lambda hit: hit["similarity"], reverse=True)
+
+    def hybrid_search(self, query, query_embedding, top_k):
+        self.searched.append(query)
+        hits = [self._hit(chunk_id, query_embedding) for chunk_id in self.embeddings]
+        return sorted(hits, key=lambda hit: hit["similarity"], reverse=True)[:top_k]
+
+    search_by_embedding = None
+
+
+class FakeEngine:
+    @staticmethod
+    def _generate_fallback_response(query):
+        return "fallback"
+
+
+def previous_turn(chunk_id):
+    return Turn("Сколько стоит доставка?", np.array([1.0, 0.0], dtype=np.float16), bytes.fromhex(chunk_id), time.time())
+
+
+def pipeline(query_embeddings):
+    kb = FakeKnowledgeBase(query_embeddings)
+    return AnswerPipeline(kb, FakeEngine()), kb
+
+
+def test_short_followup_reuses_previous_chunks(monkeypatch):
+    monkeypatch.setattr(config, "HYBRID_SEARCH", True)
+    answer_pipeline, kb = pipeline({"А сколько идёт?": np.array([0.9, 0.1])})
+
+    retrieval = answer_pipeline.retrieve("А сколько идёт?", previous_turn(DELIVERY))
+
+    assert retrieval.followup
+    assert [hit["id"] for hit in retrieval.hits] == [DELIVERY]
+    assert kb.searched == []
+
+
+def test_short_new_topic_falls_through_to_search(monkeypatch):
+    monkeypatch.setattr(config, "HYBRID_SEARCH", True)
+    answer_pipeline, kb = pipeline({"Гарантия на принтер?": np.array([0.0, 1.0])})
+
+    retrieval = answer_pipeline.retrieve("Гарантия на принтер?", previous_turn(DELIVERY))
+
+    assert not retrieval.followup
+    assert kb.searched == ["Гарантия на принтер?"]
+    assert [hit["id"] for hit in retrieval.hits] == [PRINTER]
+
+
+def test_old_turn_is_not_a_followup(monkeypatch):
+    monkeypatch.setattr(config, "HYBRID_SEARCH", True)
+    answer_pipeline, kb = pipeline({"А сколько идёт?": np.array([0.9, 0.1])})
+    turn = previous_turn(DELIVERY)
+    turn.at -= config.SESSION_FOLLOWUP_SECONDS + 1
+
+    retrieval = answer_pipeline.retrieve("А сколько идёт?", turn)
+
+    assert not retrieval.followup
+    assert kb.searched == ["А сколько идёт?"]
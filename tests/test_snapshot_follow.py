@@ -0,0 +1,56 @@
+import multiprocessing
+import random
+
+from config import config
+from inverted_index import InvertedIndex
+from snapshots import SnapshotManager
+
+WORDS = "база знаний документ вопрос ответ система модель поиск договор клиент оплата доставка".split()
+
+
+def write(path: str, rounds: int):
+    # Small ratio: the writer rewrites the index every few persists, racing the reader's refreshes
+    config.BM25_JOURNAL_RATIO = 0.05
+    rng = random.Random(7)
+    index = InvertedIndex(path=path)
+    for _ in range(rounds):
+        for _ in range(5):
+            index.add(f"c{rng.randint(0, 200)}", " ".join(rng.choice(WORDS) for _ in range(15)))
+        index.remove([f"c{rng.randint(0, 200)}"])
+        index.persist()
+
+
+def test_worker_bm25_refresh_keeps_up_with_a_concurrent_writer(tmp_path):
+    path = str(tmp_path / "bm25.idx")
+    InvertedIndex(path=path).persist()
+    reader = InvertedIndex(path=path)
+
+    writer = multiprocessing.get_context("fork").Process(target=write, args=(path, 300))
+    writer.start()
+    while writer.is_alive():
+        reader.refresh()
+    writer.join()
+    assert writer.exitcode == 0
+
+    reader.refresh()
+    final = InvertedIndex(path=path)
+    assert set(reader.doc_numbers) == set(final.doc_numbers)
+    assert reader.search("договор оплата", 10) == final.search("договор оплата", 10)
+
+
+def test_reopened_snapshot_reuses_the_loaded_bm25(data_dir, monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "compact")
+    snapshots = SnapshotManager(root=str(data_dir / "versions"))
+    snapshot = snapshots.create()
+    snapshot.bm25.add("a" * 32, "договор оплата доставка")
+    snapshot.bm25.persist()
+    snapshots.publish(snapshot.name)
+
+    reader = snapshots.open(snapshot.name)
+    snapshot.bm25.add("b" * 32, "модель поиск")
+    snapshot.bm25.persist()
+    reader.bm25.refresh()
+    followed = snapshots.open(snapshot.name, bm25=reader.bm25)
+
+    assert followed.bm25 is reader.bm25
+    assert "b" * 32 in followed.bm25
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+import uploader
+from config import config
+from snapshots import LEGACY, SnapshotManager
+
+
+@pytest.fixture(autouse=True)
+def compact_store(monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "compact")
+
+
+def publish_new(snapshots: SnapshotManager, staging: bool = False) -> str:
+    name = snapshots.create(staging=staging).name
+    if not staging:
+        snapshots.publish(name)
+    return name
+
+
+def test_rollback_walks_back_through_published_versions(data_dir):
+    snapshots = SnapshotManager(root=str(data_dir / "versions"))
+    first, second = publish_new(snapshots), publish_new(snapshots)
+    assert snapshots.current() == second
+    assert snapshots.history() == [LEGACY, first, second]
+
+    assert snapshots.rollback() == first
+    assert snapshots.current() == first
+    assert snapshots.rollback() == LEGACY
+    assert snapshots.rollback() is None
+    assert snapshots.current() == LEGACY
+
+    # Numbers are not reused after a rollback
+    assert publish_new(snapshots) == "v0003"
+
+
+def test_garbage_collection_keeps_recent_current_in_use_and_staging_versions(data_dir):
+    snapshots = SnapshotManager(root=str(data_dir / "versions"), keep=2)
+    old, read, *recent = [publish_new(snapshots) for _ in range(4)]
+    staging = publish_new(snapshots, staging=True)
+
+    assert snapshots.collect_garbage(in_use=[read]) == [old]
+    assert snapshots.versions() == [read, *recent, staging]
+    # Rollback never points at a deleted directory
+    assert snapshots.history() == [LEGACY, read, *recent]
+    assert all(os.path.isdir(os.path.join(snapshots.root, name)) for name in snapshots.history()[1:])
+
+
+def test_knowledge_base_rollback_serves_the_previous_snapshot(hashing_kb):
+    kb_manager = uploader.KnowledgeBaseManager()
+    try:
+        snapshot = kb_manager.snapshots.create()
+        kb_manager.add_chunks([("faq.txt", 0, "Доставка курьером занимает два дня")], snapshot=snapshot)
+        kb_manager.finalize_source("faq.txt", snapshot.manifest.source_chunk_ids("faq.txt"), snapshot)
+        kb_manager.snapshots.publish(snapshot.name)
+        assert kb_manager.follow_published()
+        published = kb_manager.snapshot
+
+        # A query still reading the old snapshot keeps it open across the reset
+        with published.reading():
+            assert kb_manager.reset_knowledge_base()
+            assert not kb_manager.bm25.search("доставка", 5)
+            assert kb_manager.rollback_knowledge_base() == snapshot.name
+        assert kb_manager.snapshot is published
+        assert [chunk_id for chunk_id, _ in kb_manager.bm25.search("доставка", 5)] == \
+            list(kb_manager.manifest.source_chunk_ids("faq.txt"))
+        assert kb_manager.get_knowledge_base_info()["version"] == snapshot.name
+    finally:
+        kb_manager.close()
@@ -1,152 +1,333 @@
 import os
-import pandas as pd
 import json
 import sqlite3
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Iterator, Callable, Set, Tuple
 from loguru import logger
 from config import config
-import chromadb
-from sentence_transformers import SentenceTransformer
+import metrics
+from parsers import get_parser, is_tabular, batched
+from chunking import NearDuplicateFilter, dedupe, dedupe_exact, iter_sentences, iter_token_chunks
+from snapshots import KnowledgeSnapshot, SnapshotManager
+from ai_engine.batching import MicroBatcher
+from inverted_index import reciprocal_rank_fusion
+from ai_engine.inference import embedding_model_version, load_embedding_model
+from ai_engine.qa_tokens import QATokenStore
 import hashlib
+import heapq
+import shutil
+import threading
+import numpy as np
+
+def iter_documents(file_path: str) -> Iterator[str]:
+    """Stream a file's token-bounded chunks through its registered parser"""
+    records = metrics.TimedIterator(get_parser(file_path)(file_path), "ingest_stage_seconds", stage="parse")
+    if config.DEDUP_ENABLED and is_tabular(file_path):
+        # Whole rows and records are compared, more strictly than prose: rows repeating a
+        # template are dropped only when their codes, prices and dates match as well.
+        # Exact repeats go first, however short the row
+        duplicate_filter = NearDuplicateFilter(threshold=config.DEDUP_TABULAR_THRESHOLD, match_numbers=True)
+        sentences = iter_sentences(dedupe(dedupe_exact(records), duplicate_filter))
+    elif config.DEDUP_ENABLED:
+        # Boilerplate repeated across records is embedded once
+        sentences = dedupe(iter_sentences(records))
+    else:
+        sentences = iter_sentences(records)
+    # Chunking time excludes the parser it pulls records from
+    return metrics.TimedIterator(iter_token_chunks(sentences), "ingest_stage_seconds", exclude=records, stage="chunk")
 
 class KnowledgeBaseManager:
     def __init__(self):
-        self.embedding_model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
-        self.chroma_client = chromadb.PersistentClient(path=config.DATA_DIR)
-        self.collection = self._get_or_create_collection()
-        
-    def _get_or_create_collection(self):
-        """Get or create ChromaDB collection"""
-        try:
-            return self.chroma_client.get_collection("knowledge_base")
-        except:
-            return self.chroma_client.create_collection(
-                name="knowledge_base",
-                metadata={"description": "Russian Knowledge Base"}
-            )
+        self.embedding_model = load_embedding_model()
+        # Queries read the current snapshot; rebuilds write a new one and swap it in
+        self.snapshots = SnapshotManager()
+        self.snapshot = self.snapshots.open(self.snapshots.current())
+        # QA model input of every chunk, tokenized once at ingest
+        self.qa_tokens = QATokenStore()
+        self._retired: List[KnowledgeSnapshot] = []
+        self._staging: Set[str] = set()
+        self._swap_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        # Concurrent searches share one encode() call per batch
+        self.query_encoder = MicroBatcher(self._encode_documents, name="query_embed")
+    
+    def close(self):
+        """Stop the query batcher; requests already queued are answered first"""
+        self.query_encoder.close()
+    
+    @property
+    def store(self):
+        return self.snapshot.store
+    
+    @property
+    def bm25(self):
+        return self.snapshot.bm25
+    
+    @property
+    def manifest(self):
+        return self.snapshot.manifest
+    
+    @property
+    def files_dir(self) -> str:
+        """Where uploaded source files of the current snapshot are kept"""
+        return self.snapshot.files_dir
+    
+    def kb_version(self):
+        """Cache key for the KB contents; changes on every write and swap"""
+        return self.snapshot.version()
     
     def _generate_document_id(self, content: str) -> str:
         """Generate unique document ID"""
         return hashlib.md5(content.encode()).hexdigest()
     
-    def _chunk_text(self, text: str, chunk_size: int = 500, chunk_overlap: int = 50) -> List[str]:
-        """Split text into overlapping chunks"""
-        words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), chunk_size - chunk_overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            chunks.append(chunk)
-            if i + chunk_size >= len(words):
-                break
-                
-        return chunks
+    @staticmethod
+    def _content_hash(text: str) -> str:
+        """Hash of chunk text used to address cached embeddings"""
+        return hashlib.sha1(text.encode()).hexdigest()
     
-    def process_uploaded_file(self, file_path: str) -> Dict[str, Any]:
+    def process_uploaded_file(self, file_path: str, snapshot: Optional[KnowledgeSnapshot] = None,
+                              embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None) -> Dict[str, Any]:
         """Process uploaded file and add to knowledge base"""
         try:
-            file_ext = os.path.splitext(file_path)[1].lower()
-            documents = []
+            source = os.path.basename(file_path)
+            chunks_created = 0
+            seen_ids = set()
             
-            if file_ext == '.txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                documents = self._chunk_text(content)
-                
-            elif file_ext == '.csv':
-                df = pd.read_csv(file_path)
-                # Convert all columns to text
-                text_content = ""
-                for _, row in df.iterrows():
-                    text_content += " ".join(str(cell) for cell in row) + "\n"
-                documents = self._chunk_text(text_content)
-                
-            elif file_ext == '.json':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                # Flatten JSON to text
-                text_content = json.dumps(data, ensure_ascii=False)
-                documents = self._chunk_text(text_content)
-            
-            # Add documents to ChromaDB
-            if documents:
-                self._add_documents_to_kb(documents, os.path.basename(file_path))
-                
-                return {
-                    "success": True,
-                    "documents_processed": len(documents),
-                    "chunks_created": len(documents)
-                }
-            else:
+            # Embed and store batch by batch as the parser produces chunks
+            for batch in batched(iter_documents(file_path), config.INGEST_BATCH_SIZE):
+                seen_ids.update(self._add_documents_to_kb(batch, source, chunks_created, embed_fn, snapshot))
+                chunks_created += len(batch)
+            
+            # Finalizing with nothing seen would delete every chunk the source already has
+            if not chunks_created:
                 return {"success": False, "error": "No documents extracted"}
+            
+            self.finalize_source(source, seen_ids, snapshot)
+            return {
+                "success": True,
+                "documents_processed": chunks_created,
+                "chunks_created": chunks_created
+            }
                 
         except Exception as e:
             logger.error(f"Error processing file {file_path}: {e}")
             return {"success": False, "error": str(e)}
     
-    def _add_documents_to_kb(self, documents: List[str], source: str):
-        """Add documents to knowledge base with embeddings"""
+    def _encode_documents(self, documents: List[str]) -> np.ndarray:
+        # float32 rows all the way to the store; no per-float Python objects
+        return np.asarray(self.embedding_model.encode(documents), dtype=np.float32)
+    
+    def _add_documents_to_kb(self, documents: List[str], source: str, start_index: int = 0,
+                             embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+                             snapshot: Optional[KnowledgeSnapshot] = None) -> List[str]:
+        """Add new or changed documents to the knowledge base; returns the batch's chunk IDs"""
+        chunks = [(source, i, document) for i, document in enumerate(documents, start_index)]
+        return self.add_chunks(chunks, embed_fn, snapshot)
+    
+    def add_chunks(self, chunks: List[Tuple[str, int, str]],
+                   embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+                   snapshot: Optional[KnowledgeSnapshot] = None) -> List[str]:
+        """Add (source, chunk_index, text) chunks of any number of sources with one embed call and one index write"""
         try:
-            # Generate embeddings
-            embeddings = self.embedding_model.encode(documents).tolist()
-            
-            # Prepare documents for ChromaDB
-            ids = [self._generate_document_id(f"{source}_{i}") for i in range(len(documents))]
-            metadatas = [{"source": source, "chunk_index": i} for i in range(len(documents))]
-            
-            # Add to collection
-            self.collection.add(
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
+            kb = snapshot or self.snapshot
+            embed_fn = embed_fn or self._encode_documents
+            model_version = embedding_model_version()
+            
+            # Chunk IDs are content-addressed, so unchanged chunks keep their ID
+            rows = {}
+            for source, i, document in chunks:
+                content_hash = self._content_hash(document)
+                chunk_id = self._generate_document_id(f"{source}:{content_hash}")
+                rows.setdefault(chunk_id, {
+                    "chunk_id": chunk_id,
+                    "source": source,
+                    "chunk_index": i,
+                    "content_hash": content_hash,
+                    "document": document,
+                })
+            
+            current = kb.manifest.current_ids(list(rows), model_version)
+            new_rows = [row for chunk_id, row in rows.items() if chunk_id not in current]
+            
+            # Chunks stored before the lexical index existed get indexed on re-upload
+            for chunk_id in current:
+                if chunk_id not in kb.bm25:
+                    kb.bm25.add(chunk_id, rows[chunk_id]["document"])
+            
+            if not new_rows:
+                return list(rows)
+            
+            # Reuse embeddings of identical text from any source, embed only the rest
+            cached = kb.manifest.cached_embeddings([row["content_hash"] for row in new_rows], model_version)
+            to_embed = [row for row in new_rows if row["content_hash"] not in cached]
+            if to_embed:
+                with metrics.timer("ingest_stage_seconds", stage="embed"):
+                    vectors = embed_fn([row["document"] for row in to_embed])
+                for row, vector in zip(to_embed, vectors):
+                    cached[row["content_hash"]] = vector
+            for row in new_rows:
+                row["embedding"] = cached[row["content_hash"]]
             
-            logger.info(f"Added {len(documents)} documents from {source} to knowledge base")
+            # Keyed by content like the embeddings: a chunk seen in any source or snapshot is not re-tokenized
+            to_tokenize = set(self.qa_tokens.missing(row["content_hash"] for row in new_rows))
+            if to_tokenize:
+                with metrics.timer("ingest_stage_seconds", stage="qa_tokenize"):
+                    self.qa_tokens.add({row["content_hash"]: row["document"] for row in new_rows
+                                        if row["content_hash"] in to_tokenize})
+            
+            with metrics.timer("ingest_stage_seconds", stage="index_write"):
+                kb.store.upsert(
+                    embeddings=[row["embedding"] for row in new_rows],
+                    documents=[row["document"] for row in new_rows],
+                    metadatas=[{"source": row["source"], "chunk_index": row["chunk_index"]} for row in new_rows],
+                    ids=[row["chunk_id"] for row in new_rows]
+                )
+                for row in new_rows:
+                    kb.bm25.add(row["chunk_id"], row["document"])
+                kb.manifest.record_chunks(new_rows, model_version)
+            metrics.inc("ingest_chunks_total", len(new_rows))
+            
+            sources = {row["source"] for row in new_rows}
+            logger.info(
+                f"Added {len(new_rows)} new chunks from "
+                f"{sources.pop() if len(sources) == 1 else f'{len(sources)} sources'} to knowledge base "
+                f"({len(to_embed)} embedded, {len(new_rows) - len(to_embed)} from cache, "
+                f"{len(rows) - len(new_rows)} unchanged)"
+            )
+            return list(rows)
             
         except Exception as e:
             logger.error(f"Error adding documents to KB: {e}")
             raise
     
+    def finalize_source(self, source: str, seen_ids: Set[str], snapshot: Optional[KnowledgeSnapshot] = None,
+                        persist: bool = True):
+        """Delete chunks of a fully re-ingested source that no longer exist in it
+
+        Bulk loads pass persist=False and write the indexes once for many sources.
+        """
+        kb = snapshot or self.snapshot
+        stale = kb.manifest.source_chunk_ids(source) - seen_ids
+        if stale:
+            kb.store.delete(stale)
+            kb.bm25.remove(stale)
+            kb.manifest.remove_chunks(stale)
+            logger.info(f"Removed {len(stale)} stale chunks of {source}")
+        if persist:
+            kb.store.persist()
+            kb.bm25.persist()
+        kb.manifest.finalize_source(source)
+    
     def semantic_search(self, query: str, top_k: int = config.TOP_K_RESULTS) -> List[Dict]:
         """Perform semantic search on knowledge base"""
         try:
             # Generate query embedding
-            query_embedding = self.embedding_model.encode([query]).tolist()
+            query_embedding = self.query_encoder(query)
+            return self.search_by_embedding(query_embedding, top_k)
             
-            # Search in ChromaDB
-            results = self.collection.query(
-                query_embeddings=query_embedding,
-                n_results=top_k
-            )
+        except Exception as e:
+            logger.error(f"Error in semantic search: {e}")
+            return []
+    
+    def search_by_embedding(self, query_embedding: List[float], top_k: int = config.TOP_K_RESULTS) -> List[Dict]:
+        """Search the knowledge base with an already computed query embedding"""
+        try:
+            with self.snapshot.reading() as kb:
+                return kb.store.query(query_embedding, top_k)
             
-            # Format results
-            formatted_results = []
-            if results['documents']:
-                for i, doc in enumerate(results['documents'][0]):
-                    formatted_results.append({
-                        'content': doc,
-                        'similarity': results['distances'][0][i] if results['distances'] else 0,
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {}
-                    })
+        except Exception as e:
+            logger.error(f"Error in semantic search: {e}")
+            return []
+    
+    def get_chunks(self, chunk_ids: List[str], query_embedding: List[float]) -> List[Dict]:
+        """Chunks by ID scored against a query, best first; IDs no longer in the KB are skipped"""
+        try:
+            with self.snapshot.reading() as kb:
+                hits = kb.store.get(chunk_ids, query_embedding)
+            return sorted(hits, key=lambda hit: hit["similarity"], reverse=True)
+            
+        except Exception as e:
+            logger.error(f"Error fetching chunks: {e}")
+            return []
+    
+    def hybrid_search(self, query: str, query_embedding: List[float],
+                      top_k: int = config.TOP_K_RESULTS) -> List[Dict]:
+        """Fuse vector and BM25 rankings with reciprocal-rank fusion"""
+        try:
+            # Both retrievers read the same snapshot even if a swap happens meanwhile
+            with self.snapshot.reading() as kb:
+                vector_hits = kb.store.query(query_embedding, config.HYBRID_CANDIDATES)
+                lexical_hits = kb.bm25.search(query, config.HYBRID_CANDIDATES)
+                
+                fused = reciprocal_rank_fusion([
+                    [hit["id"] for hit in vector_hits],
+                    [chunk_id for chunk_id, _ in lexical_hits],
+                ])
+                best_ids = heapq.nlargest(top_k, fused, key=fused.get)
+                
+                # Lexical-only hits still get a real cosine similarity for thresholding
+                hits_by_id = {hit["id"]: hit for hit in vector_hits}
+                missing = [chunk_id for chunk_id in best_ids if chunk_id not in hits_by_id]
+                for hit in kb.store.get(missing, query_embedding):
+                    hits_by_id[hit["id"]] = hit
             
-            return formatted_results
+            bm25_scores = dict(lexical_hits)
+            results = []
+            for chunk_id in best_ids:
+                if chunk_id in hits_by_id:
+                    hit = dict(hits_by_id[chunk_id])
+                    hit["bm25_score"] = bm25_scores.get(chunk_id, 0.0)
+                    hit["rrf_score"] = fused[chunk_id]
+                    results.append(hit)
+            return results
             
         except Exception as e:
-            logger.error(f"Error in semantic search: {e}")
+            logger.error(f"Error in hybrid search: {e}")
             return []
     
+    def _swap(self, snapshot: KnowledgeSnapshot):
+        """Make snapshot the one new queries read; in-flight queries finish on the old one"""
+        with self._swap_lock:
+            self._retired.append(self.snapshot)
+            self.snapshot = snapshot
+        self.collect_garbage()
+    
+    def follow_published(self, reopen: bool = False) -> bool:
+        """Reopen the published snapshot when another process changed it; returns True on reload
+
+        For read-only inference workers. A forked worker must reopen once
+        before its first query, since SQLite handles cannot cross a fork.
+        """
+        current = self.snapshots.current()
+        if not reopen and not self.snapshot.is_stale(current):
+            return False
+        if not reopen and current == self.snapshot.name:
+            # Same version, written by another process: replay the BM25 journal instead of unpickling it all
+            bm25 = self.snapshot.bm25
+            bm25.refresh()
+            snapshot = self.snapshots.open(current, bm25=bm25)
+        else:
+            snapshot = self.snapshots.open(current)
+        with self._swap_lock:
+            if reopen:
+                # Inherited from the parent: never closed here, or the parent's locks go with it
+                self._retired.append(self.snapshot)
+            self.snapshot = snapshot
+        logger.info(f"Worker {os.getpid()} now reads KB snapshot {current}")
+        return True
+    
+    def collect_garbage(self) -> List[str]:
+        """Delete old snapshot directories once no query is reading them"""
+        with self._swap_lock:
+            self._retired = [snapshot for snapshot in self._retired if snapshot.in_use]
+            in_use = {snapshot.name for snapshot in self._retired} | self._staging | {self.snapshot.name}
+        return self.snapshots.collect_garbage(in_use)
+    
     def reset_knowledge_base(self) -> bool:
-        """Reset the knowledge base"""
+        """Publish an empty snapshot; the previous one stays available to /rollback"""
         try:
-            self.chroma_client.delete_collection("knowledge_base")
-            self.collection = self.chroma_client.create_collection("knowledge_base")
-            
-            # Clear knowledge base directory
-            for file in os.listdir(config.KNOWLEDGE_BASE_DIR):
-                file_path = os.path.join(config.KNOWLEDGE_BASE_DIR, file)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
+            snapshot = self.snapshots.create()
+            self.snapshots.publish(snapshot.name)
+            self._swap(snapshot)
             
             logger.info("Knowledge base reset successfully")
             return True
@@ -155,18 +336,82 @@ class KnowledgeBaseManager:
             logger.error(f"Error resetting knowledge base: {e}")
             return False
     
+    def rebuild_knowledge_base(self, progress: Optional[Callable[[str], None]] = None,
+                               embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None) -> Dict[str, Any]:
+        """Re-ingest every source file into a new snapshot in the background, then swap it in
+        
+        Queries keep reading the current snapshot until the new one is published.
+        Unchanged chunks come from the shared embedding cache, so only text the
+        current model version has not seen is embedded again. embed_fn replaces
+        the in-process model, e.g. with the ingestion pool.
+        """
+        if not self._rebuild_lock.acquire(blocking=False):
+            return {"success": False, "error": "Rebuild already running"}
+        snapshot = None
+        try:
+            source_dir = self.files_dir
+            snapshot = self.snapshots.create()
+            self._staging.add(snapshot.name)
+            
+            files = sorted(
+                name for name in os.listdir(source_dir)
+                if os.path.isfile(os.path.join(source_dir, name))
+                and os.path.splitext(name)[1].lower() in config.ALLOWED_EXTENSIONS
+            )
+            chunks = 0
+            for number, name in enumerate(files, 1):
+                file_path = os.path.join(snapshot.files_dir, name)
+                try:
+                    os.link(os.path.join(source_dir, name), file_path)
+                except OSError:
+                    shutil.copy2(os.path.join(source_dir, name), file_path)
+                result = self.process_uploaded_file(file_path, snapshot, embed_fn)
+                if not result["success"]:
+                    raise RuntimeError(f"{name}: {result['error']}")
+                chunks += result["chunks_created"]
+                if progress:
+                    progress(f"{number}/{len(files)} {name}")
+            
+            self.snapshots.publish(snapshot.name)
+            self._swap(snapshot)
+            logger.info(f"Rebuilt knowledge base into {snapshot.name}: {len(files)} files, {chunks} chunks")
+            return {"success": True, "version": snapshot.name, "files": len(files), "chunks_created": chunks}
+            
+        except Exception as e:
+            logger.error(f"Error rebuilding knowledge base: {e}")
+            return {"success": False, "error": str(e)}
+        finally:
+            if snapshot is not None:
+                self._staging.discard(snapshot.name)
+            self._rebuild_lock.release()
+            # An aborted rebuild leaves an unpublished directory behind
+            self.collect_garbage()
+    
+    def rollback_knowledge_base(self) -> Optional[str]:
+        """Switch back to the previously published snapshot; returns its name"""
+        try:
+            name = self.snapshots.rollback()
+            if name is None:
+                return None
+            # A recently retired snapshot is still open and can be swapped back without loading
+            with self._swap_lock:
+                snapshot = next((retired for retired in self._retired if retired.name == name), None)
+            self._swap(snapshot or self.snapshots.open(name))
+            return name
+            
+        except Exception as e:
+            logger.error(f"Error rolling back knowledge base: {e}")
+            return None
+    
     def get_knowledge_base_info(self) -> Dict[str, Any]:
         """Get information about the knowledge base"""
         try:
-            count = self.collection.count()
-            return {
-                "document_count": count,
-                "chunk_count": count,  # In this implementation, each chunk is a document
-                "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
+            # Counters are maintained by the manifest, no collection scan needed
+            return {**self.manifest.stats(), "version": self.snapshot.name}
         except:
             return {
                 "document_count": 0,
                 "chunk_count": 0,
-                "last_update": "Never"
+                "last_update": "Never",
+                "version": "?"
             }
@@ -0,0 +1,649 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from config import config
+
+
+def _cosine(vector, query) -> float:
+    vector = np.asarray(vector, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    denominator = float(np.linalg.norm(vector) * np.linalg.norm(query))
+    return float(vector @ query) / denominator if denominator else 0.0
+
+
+class VectorStore(ABC):
+    """Storage and nearest-neighbour search for chunk embeddings keyed by chunk ID"""
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               documents: List[str], metadatas: List[Dict[str, Any]]):
+        """Insert or replace chunks"""
+
+    @abstractmethod
+    def delete(self, ids: Iterable[str]):
+        """Remove chunks by ID"""
+
+    @abstractmethod
+    def query(self, embedding: List[float], top_k: int) -> List[Dict[str, Any]]:
+        """Return the top_k chunks as dicts with id, content, distance, similarity and metadata"""
+
+    @abstractmethod
+    def get(self, ids: List[str], query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Fetch chunks by ID, scored against query_embedding when given"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of stored chunks"""
+
+    @abstractmethod
+    def reset(self):
+        """Drop every chunk"""
+
+    def persist(self):
+        """Flush in-memory state to disk (no-op for stores that write through)"""
+
+
+class ChromaVectorStore(VectorStore):
+    """Chroma PersistentClient collection using cosine distance"""
+
+    def __init__(self, path: str = config.DATA_DIR, name: str = "knowledge_base"):
+        import chromadb
+
+        self.name = name
+        self.client = chromadb.PersistentClient(path=path)
+        self.collection = self._get_or_create_collection()
+
+    def _get_or_create_collection(self):
+        """Get or create ChromaDB collection"""
+        try:
+            return self.client.get_collection(self.name)
+        except:
+            return self._create_collection()
+
+    def _create_collection(self):
+        """Create the ChromaDB collection with cosine distance"""
+        return self.client.create_collection(
+            name=self.name,
+            metadata={"description": "Russian Knowledge Base", "hnsw:space": "cosine"}
+        )
+
+    def _distance_to_similarity(self, distance: float) -> float:
+        """Convert a Chroma distance into cosine similarity"""
+        space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "l2":
+            # Squared L2; exact for unit-length vectors, approximate otherwise
+            return 1.0 - distance / 2
+        # Chroma reports both cosine and ip as 1 - similarity
+        return 1.0 - distance
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        embeddings = np.asarray(embeddings, dtype=np.float32).tolist()
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        ids = list(ids)
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def query(self, embedding, top_k):
+        embedding = np.asarray(embedding, dtype=np.float32).tolist()
+        results = self.collection.query(query_embeddings=[embedding], n_results=top_k)
+
+        formatted_results = []
+        if results['documents']:
+            for i, doc in enumerate(results['documents'][0]):
+                distance = results['distances'][0][i] if results['distances'] else None
+                formatted_results.append({
+                    'id': results['ids'][0][i],
+                    'content': doc,
+                    'distance': distance,
+                    'similarity': self._distance_to_similarity(distance) if distance is not None else 0,
+                    'metadata': results['metadatas'][0][i] if results['metadatas'] else {}
+                })
+        return formatted_results
+
+    def get(self, ids, query_embedding=None):
+        if not ids:
+            return []
+        results = self.collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+        formatted_results = []
+        for i, chunk_id in enumerate(results['ids']):
+            similarity = _cosine(results['embeddings'][i], query_embedding) if query_embedding is not None else 0
+            formatted_results.append({
+                'id': chunk_id,
+                'content': results['documents'][i],
+                'distance': 1.0 - similarity,
+                'similarity': similarity,
+                'metadata': results['metadatas'][i] or {}
+            })
+        return formatted_results
+
+    def count(self):
+        return self.collection.count()
+
+    def reset(self):
+        self.client.delete_collection(self.name)
+        self.collection = self._create_collection()
+
+
+class FaissVectorStore(VectorStore):
+    """FAISS index (flat, IVF or HNSW) over cosine similarity with a SQLite sidecar
+
+    The sidecar holds documents, metadata and full vectors and is the source
+    of truth: the index file is a derived artifact, memory-mapped at startup
+    and rebuilt from the sidecar whenever the two disagree.
+    """
+
+    def __init__(self, directory: str = config.FAISS_DIR, index_type: str = config.FAISS_INDEX_TYPE,
+                 dim: int = config.EMBEDDING_DIM):
+        import faiss
+
+        self.faiss = faiss
+        self.directory = directory
+        self.index_type = index_type
+        self.dim = dim
+        self.index_path = os.path.join(directory, f"index.{index_type}.faiss")
+        self._lock = threading.RLock()
+        # HNSW cannot remove vectors, so deletions are masked until the next rebuild
+        self._tombstones = set()
+        self._needs_rebuild = False
+        self._writable = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "docstore.db"), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                faiss_id INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self.index = self._load_index()
+
+    @staticmethod
+    def _faiss_id(chunk_id: str) -> int:
+        # Chunk IDs are hex digests; 60 bits keep the value a positive int64
+        return int(chunk_id[:15], 16)
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.array(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self.faiss.normalize_L2(vectors)
+        return vectors
+
+    def _count_docs(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                # Serve from the page cache instead of reading the whole index into RAM
+                index = self.faiss.read_index(self.index_path, self.faiss.IO_FLAG_MMAP)
+            except RuntimeError:
+                index = self.faiss.read_index(self.index_path)
+                self._writable = True
+            if index.ntotal == self._count_docs():
+                logger.info(f"Loaded FAISS {self.index_type} index with {index.ntotal} vectors")
+                return index
+            logger.warning("FAISS index is out of date with its docstore, rebuilding")
+        return self._rebuild()
+
+    def _new_index(self, n_vectors: int):
+        faiss = self.faiss
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dim, config.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = config.FAISS_HNSW_EF_SEARCH
+            return faiss.IndexIDMap2(index)
+        if self.index_type == "ivf" and n_vectors >= config.FAISS_IVF_NLIST * config.FAISS_IVF_MIN_POINTS_PER_LIST:
+            quantizer = faiss.IndexFlatIP(self.dim)
+            index = faiss.IndexIVFFlat(quantizer, self.dim, config.FAISS_IVF_NLIST, faiss.METRIC_INNER_PRODUCT)
+            index.nprobe = config.FAISS_IVF_NPROBE
+            return index
+        # "flat", and "ivf" until there is enough data to train the coarse quantizer
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+
+    def _ivf_ready(self) -> bool:
+        """True when IVF is configured but still served by the flat fallback and can now be trained"""
+        return (
+            self.index_type == "ivf"
+            and not isinstance(self.index, self.faiss.IndexIVF)
+            and self._count_docs() >= config.FAISS_IVF_NLIST * config.FAISS_IVF_MIN_POINTS_PER_LIST
+        )
+
+    def _rebuild(self):
+        """Build a fresh index from every vector in the docstore"""
+        rows = self._conn.execute("SELECT faiss_id, vector FROM docs").fetchall()
+        index = self._new_index(len(rows))
+        if rows:
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            vectors = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(-1, self.dim)
+            if not index.is_trained:
+                index.train(vectors)
+            index.add_with_ids(vectors, ids)
+        self._tombstones.clear()
+        self._needs_rebuild = False
+        self._writable = True
+        self.index = index
+        logger.info(f"Built FAISS {self.index_type} index with {len(rows)} vectors")
+        return index
+
+    def _ensure_writable(self):
+        # Memory-mapped indexes are read-only; load a private copy on first write
+        if not self._writable:
+            self.index = self.faiss.read_index(self.index_path)
+            self._writable = True
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        vectors = self._normalize(embeddings)
+        faiss_ids = np.array([self._faiss_id(chunk_id) for chunk_id in ids], dtype=np.int64)
+        with self._lock:
+            existing = {
+                row[0] for row in self._conn.execute(
+                    f"SELECT faiss_id FROM docs WHERE faiss_id IN ({', '.join('?' * len(ids))})",
+                    [int(faiss_id) for faiss_id in faiss_ids],
+                )
+            }
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs (faiss_id, chunk_id, document, metadata, vector) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (int(faiss_id), chunk_id, document, json.dumps(metadata, ensure_ascii=False), vector.tobytes())
+                    for faiss_id, chunk_id, document, metadata, vector
+                    in zip(faiss_ids, ids, documents, metadatas, vectors)
+                ],
+            )
+            self._conn.commit()
+
+            self._ensure_writable()
+            if existing:
+                if self.index_type == "hnsw":
+                    self._needs_rebuild = True
+                else:
+                    self.index.remove_ids(self.faiss.IDSelectorBatch(np.array(sorted(existing), dtype=np.int64)))
+            self._tombstones.difference_update(int(faiss_id) for faiss_id in faiss_ids)
+
+            if self._ivf_ready():
+                self._rebuild()
+            else:
+                self.index.add_with_ids(vectors, faiss_ids)
+
+    def delete(self, ids):
+        faiss_ids = [self._faiss_id(chunk_id) for chunk_id in ids]
+        if not faiss_ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM docs WHERE faiss_id = ?", ((faiss_id,) for faiss_id in faiss_ids))
+            self._conn.commit()
+            self._ensure_writable()
+            if self.index_type == "hnsw":
+                self._tombstones.update(faiss_ids)
+                if len(self._tombstones) > config.FAISS_MAX_TOMBSTONE_RATIO * max(self.index.ntotal, 1):
+                    self._needs_rebuild = True
+            else:
+                self.index.remove_ids(self.faiss.IDSelectorBatch(np.array(faiss_ids, dtype=np.int64)))
+
+    def query(self, embedding, top_k):
+        query = self._normalize(embedding)
+        with self._lock:
+            # Over-fetch so masked HNSW deletions do not shrink the result list
+            k = top_k + len(self._tombstones)
+            scores, faiss_ids = self.index.search(query, k)
+            hits = []
+            for score, faiss_id in zip(scores[0], faiss_ids[0]):
+                faiss_id = int(faiss_id)
+                if faiss_id == -1 or faiss_id in self._tombstones:
+                    continue
+                if any(hit[1] == faiss_id for hit in hits):
+                    continue
+                hits.append((float(score), faiss_id))
+                if len(hits) == top_k:
+                    break
+            if not hits:
+                return []
+            rows = {
+                row[0]: row[1:] for row in self._conn.execute(
+                    f"SELECT faiss_id, chunk_id, document, metadata FROM docs "
+                    f"WHERE faiss_id IN ({', '.join('?' * len(hits))})",
+                    [faiss_id for _, faiss_id in hits],
+                )
+            }
+
+        results = []
+        for score, faiss_id in hits:
+            if faiss_id not in rows:
+                continue
+            chunk_id, document, metadata = rows[faiss_id]
+            results.append({
+                'id': chunk_id,
+                'content': document,
+                'distance': 1.0 - score,
+                'similarity': score,
+                'metadata': json.loads(metadata),
+            })
+        return results
+
+    def get(self, ids, query_embedding=None):
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT chunk_id, document, metadata, vector FROM docs WHERE chunk_id IN ({', '.join('?' * len(ids))})",
+                list(ids),
+            ).fetchall()
+        results = []
+        for chunk_id, document, metadata, vector in rows:
+            vector = np.frombuffer(vector, dtype=np.float32)
+            similarity = _cosine(vector, query_embedding) if query_embedding is not None else 0
+            results.append({
+                'id': chunk_id,
+                'content': document,
+                'distance': 1.0 - similarity,
+                'similarity': similarity,
+                'metadata': json.loads(metadata),
+            })
+        return results
+
+    def count(self):
+        with self._lock:
+            return self._count_docs()
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+            self._rebuild()
+            self.persist()
+
+    def persist(self):
+        """Write the index atomically so the next start can mmap it"""
+        with self._lock:
+            if self._needs_rebuild or self._tombstones or self._ivf_ready():
+                self._rebuild()
+            if not self._writable:
+                return
+            tmp_path = self.index_path + ".tmp"
+            self.faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, self.index_path)
+
+
+class CompactVectorStore(VectorStore):
+    """Scalar-quantized vectors scanned from a memory-mapped matrix, re-scored exactly
+
+    The hot file holds one int8 (scaled per row) or float16 row per chunk and
+    is the only file a search scans. The cold file keeps the float32 vectors
+    and is read only for the few candidates being re-scored. Rows are
+    append-only: replaced or deleted chunks leave a dead row until the next
+    compaction. Documents and metadata live in a SQLite sidecar keyed by row.
+    """
+
+    def __init__(self, directory: str = config.COMPACT_DIR, dtype: str = config.COMPACT_DTYPE,
+                 dim: int = config.EMBEDDING_DIM):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported compact dtype: {dtype}")
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.dim = dim
+        self._paths = {
+            "hot": os.path.join(directory, f"hot.{dtype}.bin"),
+            "cold": os.path.join(directory, "cold.float32.bin"),
+            "scales": os.path.join(directory, "scales.float32.bin"),
+        }
+        self._row_shapes = {
+            "hot": (self.dtype, (dim,)),
+            "cold": (np.dtype(np.float32), (dim,)),
+            "scales": (np.dtype(np.float32), ()),
+        }
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, f"docstore.{dtype}.db"), check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                row INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta VALUES ('rows', 0);
+            """
+        )
+        self._conn.commit()
+
+        # Rows past the committed count belong to an interrupted write and are ignored
+        self._rows = self._conn.execute("SELECT value FROM meta WHERE key = 'rows'").fetchone()[0]
+        self._capacity = 0
+        self._maps: Dict[str, np.memmap] = {}
+        self._open_maps(max(self._rows, 1024))
+        self._live = np.zeros(self._capacity, dtype=bool)
+        live_rows = [row[0] for row in self._conn.execute("SELECT row FROM docs")]
+        self._live[live_rows] = True
+        logger.info(f"Loaded compact {dtype} store with {len(live_rows)} vectors ({self._rows} rows)")
+
+    def _open_maps(self, capacity: int):
+        """(Re)map every file at the given row capacity, growing files as needed"""
+        for name, path in self._paths.items():
+            dtype, shape = self._row_shapes[name]
+            size = capacity * dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            old = self._maps.pop(name, None)
+            if old is not None:
+                old.flush()
+                del old
+            self._maps[name] = np.memmap(path, dtype=dtype, mode="r+", shape=(capacity, *shape))
+        self._capacity = capacity
+
+    def _ensure_capacity(self, rows: int):
+        if rows > self._capacity:
+            self._open_maps(max(rows, 2 * self._capacity))
+            live = np.zeros(self._capacity, dtype=bool)
+            live[:len(self._live)] = self._live
+            self._live = live
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.array(vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _quantize(self, vectors: np.ndarray):
+        """Hot rows and their per-row dequantization scales"""
+        if self.dtype == np.float16:
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Scores of every row against the compressed vectors, dead rows at -inf"""
+        hot, scales = self._maps["hot"], self._maps["scales"]
+        scores = np.empty(self._rows, dtype=np.float32)
+        # Dequantize block by block so the float32 working set stays small
+        for start in range(0, self._rows, config.COMPACT_SCAN_ROWS):
+            end = min(start + config.COMPACT_SCAN_ROWS, self._rows)
+            scores[start:end] = (hot[start:end].astype(np.float32) @ query) * scales[start:end]
+        scores[~self._live[:self._rows]] = -np.inf
+        return scores
+
+    def _rows_for(self, ids: List[str]) -> Dict[str, int]:
+        if not ids:
+            return {}
+        return dict(self._conn.execute(
+            f"SELECT chunk_id, row FROM docs WHERE chunk_id IN ({', '.join('?' * len(ids))})", list(ids)
+        ).fetchall())
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        vectors = self._normalize(embeddings)
+        hot, scales = self._quantize(vectors)
+        with self._lock:
+            replaced = self._rows_for(ids)
+            start, end = self._rows, self._rows + len(ids)
+            self._ensure_capacity(end)
+            self._maps["hot"][start:end] = hot
+            self._maps["cold"][start:end] = vectors
+            self._maps["scales"][start:end] = scales
+
+            # INSERT OR REPLACE drops the old row record through the UNIQUE chunk_id
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs (row, chunk_id, document, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (row, chunk_id, document, json.dumps(metadata, ensure_ascii=False))
+                    for row, chunk_id, document, metadata in zip(range(start, end), ids, documents, metadatas)
+                ],
+            )
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'rows'", (end,))
+            self._conn.commit()
+
+            self._live[list(replaced.values())] = False
+            self._live[start:end] = True
+            self._rows = end
+
+    def delete(self, ids):
+        ids = list(ids)
+        with self._lock:
+            rows = self._rows_for(ids)
+            if not rows:
+                return
+            self._conn.executemany("DELETE FROM docs WHERE row = ?", ((row,) for row in rows.values()))
+            self._conn.commit()
+            self._live[list(rows.values())] = False
+
+    def _fetch(self, rows: List[int]) -> Dict[int, tuple]:
+        return {
+            row[0]: row[1:] for row in self._conn.execute(
+                f"SELECT row, chunk_id, document, metadata FROM docs WHERE row IN ({', '.join('?' * len(rows))})",
+                rows,
+            )
+        }
+
+    def query(self, embedding, top_k):
+        query = self._normalize(embedding)[0]
+        with self._lock:
+            if not self._rows:
+                return []
+            scores = self._approximate_scores(query)
+            n_candidates = min(top_k * config.COMPACT_RESCORE_FACTOR, self._rows)
+            candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            candidates = np.sort(candidates[np.isfinite(scores[candidates])])
+            if not len(candidates):
+                return []
+
+            # Exact re-scoring reads only the candidates' pages of the cold file
+            exact = self._maps["cold"][candidates] @ query
+            order = np.argsort(-exact)[:top_k]
+            hits = [(float(exact[i]), int(candidates[i])) for i in order]
+            rows = self._fetch([row for _, row in hits])
+
+        results = []
+        for score, row in hits:
+            if row not in rows:
+                continue
+            chunk_id, document, metadata = rows[row]
+            results.append({
+                'id': chunk_id,
+                'content': document,
+                'distance': 1.0 - score,
+                'similarity': score,
+                'metadata': json.loads(metadata),
+            })
+        return results
+
+    def get(self, ids, query_embedding=None):
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT row, chunk_id, document, metadata FROM docs WHERE chunk_id IN ({', '.join('?' * len(ids))})",
+                list(ids),
+            ).fetchall()
+            vectors = {row: np.array(self._maps["cold"][row]) for row, _, _, _ in rows}
+        results = []
+        for row, chunk_id, document, metadata in rows:
+            similarity = _cosine(vectors[row], query_embedding) if query_embedding is not None else 0
+            results.append({
+                'id': chunk_id,
+                'content': document,
+                'distance': 1.0 - similarity,
+                'similarity': similarity,
+                'metadata': json.loads(metadata),
+            })
+        return results
+
+    def count(self):
+        with self._lock:
+            return int(self._live[:self._rows].sum())
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM docs")
+            self._conn.execute("UPDATE meta SET value = 0 WHERE key = 'rows'")
+            self._conn.commit()
+            self._rows = 0
+            self._live[:] = False
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the files with live rows only and renumber the sidecar"""
+        live_rows = np.flatnonzero(self._live[:self._rows])
+        capacity = max(len(live_rows), 1024)
+        for name, path in self._paths.items():
+            dtype, shape = self._row_shapes[name]
+            tmp_path = path + ".tmp"
+            compacted = np.memmap(tmp_path, dtype=dtype, mode="w+", shape=(capacity, *shape))
+            for start in range(0, len(live_rows), config.COMPACT_SCAN_ROWS):
+                block = live_rows[start:start + config.COMPACT_SCAN_ROWS]
+                compacted[start:start + len(block)] = self._maps[name][block]
+            compacted.flush()
+            del compacted
+            self._maps.pop(name).flush()
+            os.replace(tmp_path, path)
+
+        # Ascending order: each row moves down onto a slot that is already free
+        self._conn.executemany(
+            "UPDATE docs SET row = ? WHERE row = ?",
+            [(new, int(old)) for new, old in enumerate(live_rows) if new != old],
+        )
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'rows'", (len(live_rows),))
+        self._conn.commit()
+
+        self._rows = len(live_rows)
+        self._open_maps(capacity)
+        self._live = np.zeros(capacity, dtype=bool)
+        self._live[:self._rows] = True
+        logger.info(f"Compacted {self.dtype.name} store to {self._rows} vectors")
+
+    def persist(self):
+        """Flush the memory maps, compacting first when too many rows are dead"""
+        with self._lock:
+            dead = self._rows - int(self._live[:self._rows].sum())
+            if dead and dead > config.COMPACT_MAX_DEAD_RATIO * self._rows:
+                self._compact()
+            for memmap in self._maps.values():
+                memmap.flush()
+
+
+def create_vector_store(backend: Optional[str] = None, directory: Optional[str] = None) -> VectorStore:
+    """Build the vector store selected by config.VECTOR_BACKEND, in directory if given"""
+    backend = backend or config.VECTOR_BACKEND
+    if backend == "chroma":
+        return ChromaVectorStore(path=directory or config.DATA_DIR)
+    if backend == "faiss":
+        return FaissVectorStore(directory=directory or config.FAISS_DIR)
+    if backend == "compact":
+        return CompactVectorStore(directory=directory or config.COMPACT_DIR)
+    raise ValueError(f"Unknown vector backend: {backend}")